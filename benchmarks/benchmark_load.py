@@ -0,0 +1,60 @@
+"""Benchmark loading the bundled lattices with pytac.load_csv.
+
+Compares parsing the csv files row by row with csv.DictReader, as load did
+before the files were read into typed columns, with reading the columnar
+tables sequentially and concurrently, and times a complete load and a lazy
+load followed by reading the BPM PV names.
+
+Usage, from any directory:
+    python benchmarks/benchmark_load.py [repeats]
+"""
+from __future__ import print_function
+import csv
+import os
+import sys
+import timeit
+import mock
+# Use the pytac of this checkout, whether or not it is installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import pytac  # noqa: E402
+from pytac import load_csv  # noqa: E402
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(load_csv.__file__)),
+                        'data')
+MODES = ('VMX', 'VMXSP', 'DIAD')
+
+
+def read_dicts(directory, mode):
+    """Parse every csv file of a mode into a list of dictionaries."""
+    rows = {}
+    for name, (filename, _) in load_csv.TABLES.items():
+        with open(os.path.join(directory, mode, filename)) as csv_file:
+            rows[name] = list(csv.DictReader(csv_file))
+    return rows
+
+
+def best(function, repeats):
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main(repeats=5):
+    cs = mock.MagicMock()
+    row = '{0:<8} {1:>12} {2:>12} {3:>12} {4:>12} {5:>12}'
+    print(row.format('mode', 'DictReader', 'columns', 'concurrent', 'load',
+                     'lazy BPMs'))
+    for mode in MODES:
+        times = [best(lambda: read_dicts(DATA_DIR, mode), repeats),
+                 best(lambda: load_csv.read_tables(DATA_DIR, mode, False),
+                      repeats),
+                 best(lambda: load_csv.read_tables(DATA_DIR, mode, True),
+                      repeats),
+                 best(lambda: load_csv.load(mode, cs), repeats),
+                 best(lambda: load_csv.load(mode, cs, lazy=True).get_pv_names(
+                     'BPM', 'x', pytac.RB), repeats)]
+        print(row.format(mode, *['{0:.4f} s'.format(t) for t in times]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
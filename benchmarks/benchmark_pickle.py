@@ -0,0 +1,46 @@
+"""Benchmark sending lattices to other processes by pickling them.
+
+Compares loading each bundled lattice with pytac.load_csv against pickling
+and unpickling a loaded lattice, which is what a process pool does to send
+a lattice to its workers.
+
+Usage, from any directory:
+    python benchmarks/benchmark_pickle.py [repeats]
+"""
+from __future__ import print_function
+import os
+import pickle
+import sys
+import timeit
+import mock
+# Use the pytac of this checkout, whether or not it is installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+from pytac import load_csv  # noqa: E402
+
+
+MODES = ('VMX', 'VMXSP', 'DIAD')
+
+
+def best(function, repeats):
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main(repeats=5):
+    cs = mock.MagicMock()
+    row = '{0:<8} {1:>12} {2:>12} {3:>12} {4:>12}'
+    print(row.format('mode', 'load', 'dumps', 'loads', 'size'))
+    for mode in MODES:
+        lattice = load_csv.load(mode, cs)
+        data = pickle.dumps(lattice, pickle.HIGHEST_PROTOCOL)
+        times = [best(lambda: load_csv.load(mode, cs), repeats),
+                 best(lambda: pickle.dumps(lattice, pickle.HIGHEST_PROTOCOL),
+                      repeats),
+                 best(lambda: pickle.loads(data), repeats)]
+        cells = ['{0:.4f} s'.format(t) for t in times]
+        cells.append('{0} kB'.format(len(data) // 1024))
+        print(row.format(mode, *cells))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
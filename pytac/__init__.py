@@ -8,13 +8,15 @@ PHYS = 'physics'
 # Data Source types.
 SIM = 'simulation'
 LIVE = 'live'
+ARCHIVE = 'archive'
 # Default argument flag.
 DEFAULT = 'default'
 
 
-from . import data_source, element, epics, exceptions, lattice, load_csv, units, utils  # noqa: E402
+from . import acquisition, archive, data_source, deferred, element, epics, exceptions, lattice, load_csv, load_db, prewarm, shared_lattice, tune, units, utils  # noqa: E402
 """Error 402 is suppressed as we cannot import these modules at the top of the
 file as the strings above must be set first or the imports will fail.
 """
-__all__ = ["data_source", "element", "epics", "exceptions", "lattice",
-           "load_csv", "units", "utils"]
+__all__ = ["acquisition", "archive", "data_source", "deferred", "element",
+           "epics", "exceptions", "lattice", "load_csv", "load_db", "prewarm",
+           "shared_lattice", "tune", "units", "utils"]
@@ -0,0 +1,285 @@
+"""Module for streaming acquisition of family values into ring buffers."""
+import time
+import numpy
+import pytac
+
+
+# time.monotonic is not available in Python 2.7.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class RingBuffer(object):
+    """A preallocated buffer holding the most recent samples of a family.
+
+    Each sample is a row of one value per channel (e.g. one value per BPM).
+    Every row is written twice, once in each half of the underlying array, so
+    that the last n samples are always a contiguous block and can be returned
+    as a view in chronological order without copying.
+
+    A running sum and sum of squares are maintained over the samples held in
+    the buffer so that the mean and RMS are available at any time without
+    rescanning it. To avoid the accumulation of rounding errors the sums are
+    recomputed exactly each time the write position wraps around, which
+    amortises to one extra addition per sample.
+
+    **Attributes:**
+
+    Attributes:
+        capacity (int): The maximum number of samples held.
+        n_channels (int): The number of values in each sample.
+
+    .. Private Attributes:
+           _data (numpy.ndarray): The (2 * capacity, n_channels) storage.
+           _count (int): The total number of samples appended.
+           _sum (numpy.ndarray): The sum of the samples in the buffer.
+           _sum_sq (numpy.ndarray): The sum of the squares of the samples in
+                                     the buffer.
+    """
+    def __init__(self, capacity, n_channels, dtype=numpy.float64):
+        """
+        Args:
+            capacity (int): The maximum number of samples held.
+            n_channels (int): The number of values in each sample.
+            dtype (numpy.dtype): The data type of the stored values.
+
+        Raises:
+            ValueError: if capacity or n_channels is less than one.
+
+        **Methods:**
+        """
+        if capacity < 1 or n_channels < 1:
+            raise ValueError("Capacity and number of channels must be at "
+                             "least one.")
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self._data = numpy.zeros((2 * capacity, n_channels), dtype=dtype)
+        self._count = 0
+        self._sum = numpy.zeros(n_channels)
+        self._sum_sq = numpy.zeros(n_channels)
+
+    def __len__(self):
+        """The number of samples currently held in the buffer.
+
+        Returns:
+            int: The number of samples held, at most capacity.
+        """
+        return min(self._count, self.capacity)
+
+    def append(self, values):
+        """Add a sample to the buffer, evicting the oldest if it is full.
+
+        Args:
+            values (sequence): One value for each channel.
+
+        Returns:
+            numpy.ndarray: A read-only view of the stored sample.
+
+        Raises:
+            ValueError: if the number of values does not match n_channels.
+        """
+        values = numpy.asarray(values)
+        if values.shape != (self.n_channels,):
+            raise ValueError("Expected {0} values, got shape {1}."
+                             .format(self.n_channels, values.shape))
+        position = self._count % self.capacity
+        if self._count >= self.capacity:
+            evicted = self._data[position]
+            self._sum -= evicted
+            self._sum_sq -= evicted * evicted
+        self._data[position] = values
+        self._data[position + self.capacity] = values
+        self._count += 1
+        if position == self.capacity - 1:
+            self._recompute()
+        else:
+            row = self._data[position]
+            self._sum += row
+            self._sum_sq += row * row
+        return self._view(position + self.capacity,
+                          position + self.capacity + 1)[0]
+
+    def get_last(self, n=None):
+        """Get the most recent samples in chronological order.
+
+        The returned array is a read-only view onto the buffer, so it is only
+        valid until the samples it covers are overwritten; copy it if it must
+        be kept for longer.
+
+        Args:
+            n (int): The number of samples requested. If None, all the samples
+                      held are returned.
+
+        Returns:
+            numpy.ndarray: A (n, n_channels) view of the samples.
+
+        Raises:
+            ValueError: if more samples are requested than are held.
+        """
+        held = len(self)
+        if n is None:
+            n = held
+        if n > held:
+            raise ValueError("Requested {0} samples but only {1} are held."
+                             .format(n, held))
+        end = (self._count - 1) % self.capacity + 1 + self.capacity
+        return self._view(end - n, end)
+
+    def mean(self):
+        """Get the mean of each channel over the samples held.
+
+        Returns:
+            numpy.ndarray: The mean of each channel.
+        """
+        return self._sum / len(self)
+
+    def rms(self):
+        """Get the root mean square of each channel over the samples held.
+
+        Returns:
+            numpy.ndarray: The RMS of each channel.
+        """
+        return numpy.sqrt(self._sum_sq / len(self))
+
+    def std(self):
+        """Get the standard deviation of each channel over the samples held.
+
+        Returns:
+            numpy.ndarray: The standard deviation of each channel.
+        """
+        mean = self.mean()
+        variance = self._sum_sq / len(self) - mean * mean
+        return numpy.sqrt(numpy.maximum(variance, 0))
+
+    def clear(self):
+        """Discard all samples held in the buffer."""
+        self._count = 0
+        self._sum[:] = 0
+        self._sum_sq[:] = 0
+
+    def _view(self, start, stop):
+        view = self._data[start:stop]
+        view.flags.writeable = False
+        return view
+
+    def _recompute(self):
+        block = self._data[self.capacity:]
+        numpy.sum(block, axis=0, out=self._sum)
+        numpy.einsum('ij,ij->j', block, block, out=self._sum_sq)
+
+
+class FamilyAcquisition(object):
+    """Repeated acquisition of fields of a family into ring buffers.
+
+    **Attributes:**
+
+    Attributes:
+        family (str): The family being acquired.
+        fields (list): The fields being acquired.
+        handle (str): pytac.RB or pytac.SP.
+        buffers (dict): A RingBuffer for each field.
+
+    .. Private Attributes:
+           _lattice (Lattice): The lattice the values are read from.
+    """
+    def __init__(self, lattice, family, fields, capacity, handle=pytac.RB):
+        """
+        Args:
+            lattice (Lattice): The lattice the values are read from.
+            family (str): The family to acquire.
+            fields (sequence): The fields to acquire, e.g. ('x', 'y').
+            capacity (int): The number of samples to keep for each field.
+            handle (str): pytac.RB or pytac.SP.
+
+        **Methods:**
+        """
+        self._lattice = lattice
+        self.family = family
+        self.fields = list(fields)
+        self.handle = handle
+        n_channels = len(lattice.get_elements(family))
+        self.buffers = dict((field, RingBuffer(capacity, n_channels))
+                            for field in self.fields)
+
+    def _read(self, field):
+        if hasattr(self._lattice, 'get_values'):
+            return self._lattice.get_values(self.family, field, self.handle,
+                                            dtype=numpy.float64)
+        return self._lattice.get_element_values(self.family, field,
+                                                self.handle,
+                                                dtype=numpy.float64)
+
+    def acquire(self):
+        """Read one snapshot of every field into the buffers.
+
+        Returns:
+            dict: A read-only view of the new sample for each field.
+        """
+        return dict((field, self.buffers[field].append(self._read(field)))
+                    for field in self.fields)
+
+    def stream(self, rate, count=None):
+        """Acquire snapshots at a fixed rate.
+
+        Snapshots are scheduled on a fixed grid of period 1 / rate. If an
+        acquisition overruns by more than a whole period the schedule is
+        restarted rather than acquiring a burst of snapshots to catch up.
+
+        Args:
+            rate (float): The acquisition rate in Hz.
+            count (int): The number of snapshots to acquire. If None, acquire
+                          until the generator is closed.
+
+        Yields:
+            dict: A read-only view of the new sample for each field.
+
+        Raises:
+            ValueError: if rate is not positive.
+        """
+        if rate <= 0:
+            raise ValueError("Acquisition rate must be positive.")
+        period = 1.0 / rate
+        next_time = _clock()
+        n = 0
+        while count is None or n < count:
+            delay = next_time - _clock()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                next_time = _clock()
+            yield self.acquire()
+            next_time += period
+            n += 1
+
+    def get_last(self, field, n=None):
+        """Get a view of the most recent samples of a field.
+
+        Args:
+            field (str): The requested field.
+            n (int): The number of samples. If None, all samples held.
+
+        Returns:
+            numpy.ndarray: A read-only (n, n_elements) view of the samples.
+        """
+        return self.buffers[field].get_last(n)
+
+    def mean(self, field):
+        """Get the mean of a field for each element over the samples held.
+
+        Args:
+            field (str): The requested field.
+
+        Returns:
+            numpy.ndarray: The mean for each element.
+        """
+        return self.buffers[field].mean()
+
+    def rms(self, field):
+        """Get the RMS of a field for each element over the samples held.
+
+        Args:
+            field (str): The requested field.
+
+        Returns:
+            numpy.ndarray: The RMS for each element.
+        """
+        return self.buffers[field].rms()
@@ -0,0 +1,281 @@
+"""Module for replaying archived PV values through the pytac data source API.
+
+An archive is stored in a directory with the following files:
+
+ * timestamps.npy - the sorted sample times, one per row.
+ * values.npy - a (n_times, n_pvs) array of values, one column per PV.
+ * pvs.csv - the name of the PV stored in each column.
+
+The arrays are memory-mapped, so reading a value only touches the pages that
+hold it. The value of each PV at a given time is the last sample at or before
+that time. Values are stored one row per timestamp, so the values of PVs held
+in adjacent columns, such as those of one family and field, are read from a
+single contiguous slice.
+"""
+import csv
+import os
+import numpy
+import pytac
+from pytac.data_source import DataSource
+from pytac.exceptions import DataSourceException
+
+
+TIMESTAMPS_FILENAME = 'timestamps.npy'
+VALUES_FILENAME = 'values.npy'
+PVS_FILENAME = 'pvs.csv'
+
+
+def write_archive(directory, samples, pv_names=None):
+    """Write timestamped PV samples to an archive directory.
+
+    Samples are placed on the union of all sample times, each PV holding its
+    last value until the next sample. Times before a PV's first sample are
+    filled with NaN.
+
+    Args:
+        directory (str): The directory to write the archive to.
+        samples (dict): A (times, values) pair of sequences for each PV.
+        pv_names (list): The order of the PV columns. Listing the PVs of each
+                          family and field together makes bulk reads of them
+                          contiguous. Defaults to sorted order.
+    """
+    if pv_names is None:
+        pv_names = sorted(samples)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    times = [numpy.asarray(samples[pv][0], dtype=numpy.float64)
+             for pv in pv_names]
+    timestamps = numpy.unique(numpy.concatenate(times))
+    numpy.save(os.path.join(directory, TIMESTAMPS_FILENAME), timestamps)
+    values = numpy.lib.format.open_memmap(
+        os.path.join(directory, VALUES_FILENAME), mode='w+',
+        dtype=numpy.float64, shape=(len(timestamps), len(pv_names)))
+    for column, pv in enumerate(pv_names):
+        order = numpy.argsort(times[column], kind='mergesort')
+        pv_times = times[column][order]
+        pv_values = numpy.asarray(samples[pv][1], dtype=numpy.float64)[order]
+        index = numpy.searchsorted(pv_times, timestamps, side='right') - 1
+        values[:, column] = numpy.where(index >= 0,
+                                        pv_values[numpy.maximum(index, 0)],
+                                        numpy.nan)
+    values.flush()
+    del values
+    with open(os.path.join(directory, PVS_FILENAME), 'w') as pvs:
+        csv_writer = csv.writer(pvs)
+        csv_writer.writerow(['column', 'pv'])
+        for column, pv in enumerate(pv_names):
+            csv_writer.writerow([column, pv])
+
+
+class Archive(object):
+    """A memory-mapped archive of PV values.
+
+    **Attributes:**
+
+    Attributes:
+        timestamps (numpy.ndarray): The sorted sample times.
+        values (numpy.memmap): The (n_times, n_pvs) values.
+        replay_time (float): The time values are read at, if not given.
+
+    .. Private Attributes:
+           _columns (dict): The column of each PV.
+    """
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The directory holding the archive.
+
+        **Methods:**
+        """
+        self.timestamps = numpy.load(os.path.join(directory,
+                                                  TIMESTAMPS_FILENAME),
+                                     mmap_mode='r')
+        self.values = numpy.load(os.path.join(directory, VALUES_FILENAME),
+                                 mmap_mode='r')
+        self._columns = {}
+        with open(os.path.join(directory, PVS_FILENAME)) as pvs:
+            csv_reader = csv.DictReader(pvs)
+            for item in csv_reader:
+                self._columns[item['pv']] = int(item['column'])
+        self.replay_time = None
+
+    def get_pv_names(self):
+        """Get the names of all the PVs in the archive.
+
+        Returns:
+            list: The PV names in column order.
+        """
+        return sorted(self._columns, key=self._columns.get)
+
+    def _get_row(self, time):
+        if time is None:
+            time = self.replay_time
+        if time is None:
+            raise DataSourceException("No replay time set on archive {0}."
+                                      .format(self))
+        row = numpy.searchsorted(self.timestamps, time, side='right') - 1
+        if row < 0:
+            raise DataSourceException("Time {0} is before the start of archive "
+                                      "{1}.".format(time, self))
+        return row
+
+    def _get_column(self, pv):
+        try:
+            return self._columns[pv]
+        except KeyError:
+            raise DataSourceException("No PV {0} in archive {1}."
+                                      .format(pv, self))
+
+    def get_value(self, pv, time=None):
+        """Get the value of a PV at a given time.
+
+        Args:
+            pv (str): The PV name.
+            time (float): The time to read at. Defaults to the replay time.
+
+        Returns:
+            float: The last value of the PV at or before the given time.
+
+        Raises:
+            DataSourceException: if the PV is not archived or the time is not
+                                  covered by the archive.
+        """
+        return float(self.values[self._get_row(time), self._get_column(pv)])
+
+    def get_values(self, pvs, time=None):
+        """Get the values of several PVs at a given time.
+
+        If the PVs occupy adjacent columns in order the result is a read-only
+        view onto the archive; otherwise only the requested columns of a
+        single row are copied.
+
+        Args:
+            pvs (sequence): The PV names.
+            time (float): The time to read at. Defaults to the replay time.
+
+        Returns:
+            numpy.ndarray: The values of the PVs.
+
+        Raises:
+            DataSourceException: if a PV is not archived or the time is not
+                                  covered by the archive.
+        """
+        row = self._get_row(time)
+        columns = numpy.array([self._get_column(pv) for pv in pvs],
+                              dtype=numpy.intp)
+        if len(columns) > 0 and numpy.all(numpy.diff(columns) == 1):
+            return self.values[row, columns[0]:columns[-1] + 1]
+        return self.values[row, columns]
+
+
+class ArchiveDataSource(DataSource):
+    """Data source serving values from an archive.
+
+    The PV for each field is taken from the devices of a DeviceDataSource, so
+    the archive replays exactly what the live data source would have read.
+    Devices without PVs, such as BasicDevices, return their own value.
+
+    **Attributes:**
+
+    Attributes:
+        archive (Archive): The archive values are read from.
+        units (str): pytac.ENG, as archived values are raw PV values.
+
+    .. Private Attributes:
+           _device_data_source (DeviceDataSource): The data source holding the
+                                                    devices for each field.
+    """
+    def __init__(self, archive, device_data_source):
+        """
+        Args:
+            archive (Archive): The archive values are read from.
+            device_data_source (DeviceDataSource): The data source holding the
+                                                    devices for each field.
+
+        **Methods:**
+        """
+        self.archive = archive
+        self._device_data_source = device_data_source
+        self.units = pytac.ENG
+
+    def get_fields(self):
+        """Get all the fields represented by this data source.
+
+        Returns:
+            list: The fields of the underlying device data source.
+        """
+        return self._device_data_source.get_fields()
+
+    def get_value(self, field, handle):
+        """Get the archived value of a field at the replay time.
+
+        Args:
+            field (str): field of the requested value.
+            handle (str): pytac.RB or pytac.SP.
+
+        Returns:
+            float: The archived value.
+
+        Raises:
+            FieldException: if the data source does not have the field.
+            DataSourceException: if the value is not in the archive.
+        """
+        device = self._device_data_source.get_device(field)
+        if not hasattr(device, 'get_pv_name'):
+            return device.get_value(handle)
+        return self.archive.get_value(device.get_pv_name(handle))
+
+    def get_pv_values(self, pv_names):
+        """Get the archived values of several PVs at the replay time.
+
+        Args:
+            pv_names (sequence): The PV names.
+
+        Returns:
+            numpy.ndarray: The archived values.
+        """
+        return self.archive.get_values(pv_names)
+
+    def set_value(self, field, value):
+        """Archive data sources are read-only.
+
+        Raises:
+            DataSourceException: always.
+        """
+        raise DataSourceException("Cannot set field {0} on archive data source "
+                                  "{1}.".format(field, self))
+
+    def set_replay_time(self, time):
+        """Set the time at which values are read from the archive.
+
+        Args:
+            time (float): The replay time.
+        """
+        self.archive.replay_time = time
+
+
+def attach_archive(lattice, archive):
+    """Add archive data sources to a lattice and all its elements.
+
+    The data sources are added as pytac.ARCHIVE and share the archive, so the
+    replay time set on the lattice applies to every element.
+
+    Args:
+        lattice (Lattice): The lattice to replay values on.
+        archive (Archive): The archive values are read from.
+
+    Raises:
+        DataSourceException: if the lattice has no device data source.
+    """
+    try:
+        live = lattice._data_source_manager._data_sources[pytac.LIVE]
+    except KeyError:
+        raise DataSourceException("No device data source on lattice {0}."
+                                  .format(lattice))
+    lattice.set_data_source(ArchiveDataSource(archive, live), pytac.ARCHIVE)
+    for element in lattice:
+        data_sources = element._data_source_manager._data_sources
+        if pytac.LIVE in data_sources:
+            element.set_data_source(ArchiveDataSource(archive,
+                                                      data_sources[pytac.LIVE]),
+                                    pytac.ARCHIVE)
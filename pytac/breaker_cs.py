@@ -0,0 +1,274 @@
+"""Control system wrapper isolating PVs that repeatedly fail.
+
+Each PV has a circuit breaker. Consecutive failed reads or writes of a PV are
+counted and once they reach a threshold its circuit is opened: the PV is
+then skipped in bulk reads, returned as NaN and marked invalid, so a single
+disconnected IOC costs nothing instead of a channel access timeout on every
+call. Only failed reads, not NaN values, count as failures. Open PVs are
+retried with exponential backoff, either by calling
+retry_open() or by a background thread started with start(), and their
+circuits are closed again as soon as a retry succeeds.
+
+The wrapped control system is always called through its run() method, so a
+control system that must be used from one thread, such as the cothread one,
+is called on that thread even by the retry thread and by the threads reading
+a failed batch. Cothread runs each of these calls in a cothread of its own,
+so the PVs of a failed batch are still read concurrently.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from pytac import utils
+from pytac.cs import ControlSystem
+from pytac.exceptions import ControlSystemException
+
+
+# time.monotonic is not available in Python 2.7.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class _PvHealth(object):
+    """Failure count and retry schedule of a PV that has failed."""
+    def __init__(self, backoff):
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_time = None
+
+    def is_open(self):
+        return self.retry_time is not None
+
+
+class CircuitBreakerControlSystem(ControlSystem):
+    """Control system wrapper tracking the health of each PV.
+
+    **Attributes:**
+
+    Attributes:
+        failure_threshold (int): The number of consecutive failures that open
+                                  the circuit of a PV.
+        backoff (float): The delay in seconds before the first retry of an
+                          open PV.
+        max_backoff (float): The longest delay in seconds between retries.
+        max_workers (int): The largest number of PVs read at once when a
+                            batched read fails.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The wrapped control system.
+           _executor (ThreadPoolExecutor): The threads reading the PVs of a
+                                            failed batch, created when first
+                                            needed.
+           _health (dict): The _PvHealth of each PV with recent failures.
+           _lock (threading.Lock): Protects _health.
+           _thread (threading.Thread): The background retry thread, if
+                                        started.
+           _stop (threading.Event): Set to stop the background thread.
+    """
+    def __init__(self, cs, failure_threshold=3, backoff=1.0, max_backoff=60.0,
+                 max_workers=8):
+        """
+        Args:
+            cs (ControlSystem): The control system to wrap.
+            failure_threshold (int): The number of consecutive failures that
+                                      open the circuit of a PV.
+            backoff (float): The delay in seconds before the first retry of an
+                              open PV. It doubles after each failed retry.
+            max_backoff (float): The longest delay in seconds between retries.
+            max_workers (int): The largest number of PVs read at once when a
+                                batched read fails.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self._executor = None
+        self._health = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def is_open(self, pv):
+        """Whether the circuit of a PV is open.
+
+        Args:
+            pv (str): The PV name.
+
+        Returns:
+            bool: True if the PV is currently being skipped.
+        """
+        health = self._health.get(pv)
+        return health is not None and health.is_open()
+
+    def get_open_pvs(self):
+        """Get the PVs whose circuits are open.
+
+        Returns:
+            list: The PVs currently being skipped.
+        """
+        with self._lock:
+            return [pv for pv, health in self._health.items()
+                    if health.is_open()]
+
+    def _success(self, pv):
+        if pv in self._health:
+            with self._lock:
+                self._health.pop(pv, None)
+
+    def _failure(self, pv):
+        with self._lock:
+            health = self._health.setdefault(pv, _PvHealth(self.backoff))
+            health.failures += 1
+            if health.is_open():
+                health.backoff = min(health.backoff * 2, self.max_backoff)
+            if health.failures >= self.failure_threshold:
+                health.retry_time = _clock() + health.backoff
+
+    def _get_one(self, pv):
+        try:
+            return self._cs.run(self._cs.get, pv)
+        except Exception as e:
+            return e
+
+    def _get_each(self, pvs):
+        """Read PVs individually and concurrently, so that the PVs of a
+        failed batch cost about one timeout rather than one each.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+        return list(self._executor.map(self._get_one, pvs))
+
+    def get_partial(self, pvs):
+        """Get the values of the PVs that are not open-circuit.
+
+        Open PVs are not requested. If the batched request to the wrapped
+        control system raises, the PVs are read individually, max_workers at
+        a time, to find the ones that failed.
+
+        Args:
+            pvs (sequence): The PV names.
+
+        Returns:
+            tuple: A list of values, with NaN for the PVs that were skipped or
+                    failed, and a boolean numpy array that is True for the
+                    values that were read successfully, including NaN
+                    values.
+        """
+        pvs = list(pvs)
+        values = [numpy.nan] * len(pvs)
+        valid = numpy.zeros(len(pvs), dtype=bool)
+        indices = [i for i, pv in enumerate(pvs) if not self.is_open(pv)]
+        if not indices:
+            return values, valid
+        healthy = [pvs[i] for i in indices]
+        try:
+            results = self._cs.run(self._cs.get, healthy)
+        except Exception:
+            results = self._get_each(healthy)
+        for i, pv, value in zip(indices, healthy, results):
+            if not utils.is_read_error(value):
+                values[i] = value
+                valid[i] = True
+                self._success(pv)
+            else:
+                self._failure(pv)
+        return values, valid
+
+    def get(self, pv):
+        """Get the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to get the value of.
+
+        Returns:
+            object: The value of a single PV, or a list of values in which
+                     skipped and failed PVs are NaN.
+
+        Raises:
+            ControlSystemException: if a single PV is open-circuit or its read
+                                     fails.
+        """
+        if not isinstance(pv, utils.string_types):
+            return self.get_partial(pv)[0]
+        if self.is_open(pv):
+            raise ControlSystemException("PV {0} is open-circuit.".format(pv))
+        value = self._get_one(pv)
+        if utils.is_read_error(value):
+            self._failure(pv)
+            raise ControlSystemException("Failed to get PV {0}: {1}"
+                                         .format(pv, value))
+        self._success(pv)
+        return value
+
+    def put(self, pv, value):
+        """Put the value of a PV, or the values of a list of PVs.
+
+        Writes are never silently dropped, so writing to an open PV raises.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value or values to be set.
+
+        Raises:
+            ControlSystemException: if any of the PVs is open-circuit.
+        """
+        pvs = [pv] if isinstance(pv, utils.string_types) else list(pv)
+        open_pvs = [p for p in pvs if self.is_open(p)]
+        if open_pvs:
+            raise ControlSystemException("PVs {0} are open-circuit."
+                                         .format(open_pvs))
+        try:
+            self._cs.run(self._cs.put, pv, value)
+        except Exception:
+            for p in pvs:
+                self._failure(p)
+            raise
+        for p in pvs:
+            self._success(p)
+
+    def retry_open(self):
+        """Retry each open PV whose backoff has expired.
+
+        Returns:
+            list: The PVs whose circuits were closed.
+        """
+        now = _clock()
+        with self._lock:
+            due = [pv for pv, health in self._health.items()
+                   if health.is_open() and health.retry_time <= now]
+        closed = []
+        for pv in due:
+            if not utils.is_read_error(self._get_one(pv)):
+                self._success(pv)
+                closed.append(pv)
+            else:
+                self._failure(pv)
+        return closed
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.retry_open()
+
+    def start(self, interval=0.5):
+        """Start retrying open PVs in a background thread.
+
+        Args:
+            interval (float): The time in seconds between checks for PVs due
+                               to be retried.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            args=(interval,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background retry thread."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -1,5 +1,6 @@
 from pytac.cs import ControlSystem
-from cothread.catools import caget, caput
+import cothread
+from cothread.catools import caget, caput, connect
 
 
 class CothreadControlSystem(ControlSystem):
@@ -25,6 +26,27 @@ class CothreadControlSystem(ControlSystem):
         """
         return caget(pv)
 
+    def connect(self, pvs, timeout=None):
+        """ Connect to PVs, so that later requests for them are not delayed
+        by establishing connections.
+
+        May be called from any thread. The connections are made by the
+        cothread scheduler, which must be given the chance to run.
+
+        Args:
+            pvs (sequence): The PVs to connect to.
+            timeout (float): The time in seconds to wait for the connections,
+                              five seconds if None.
+
+        Returns:
+            list: True for each PV that is connected.
+        """
+        if timeout is None:
+            timeout = 5
+        results = cothread.CallbackResult(connect, list(pvs), timeout=timeout,
+                                          throw=False)
+        return [bool(result.ok) for result in results]
+
     def put(self, pv, value):
         """ Set the value for a given.
 
@@ -33,3 +55,20 @@ class CothreadControlSystem(ControlSystem):
             value (Number): The value to set the PV to.
         """
         caput(pv, value)
+
+    def run(self, function, *args, **kwargs):
+        """ Call a function on the cothread thread, as channel access calls
+        must be made from it, and wait for its result.
+
+        May be called from any thread. On the cothread thread itself the
+        function is called directly.
+
+        Args:
+            function (callable): The function to call, such as self.get.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            object: The result of the function.
+        """
+        return cothread.CallbackResult(function, *args, **kwargs)
@@ -17,6 +17,35 @@ class ControlSystem(object):
         """
         raise NotImplementedError()
 
+    def connect(self, pvs, timeout=None):
+        """ Connect to PVs, so that later requests for them are not delayed
+        by establishing connections.
+
+        This default implementation reads the PVs, reading them one at a
+        time if reading them together fails.
+
+        Args:
+            pvs (sequence): The PVs to connect to.
+            timeout (float): The time in seconds to wait for the connections,
+                              if the control system supports it.
+
+        Returns:
+            list: True for each PV that is connected.
+        """
+        pvs = list(pvs)
+        try:
+            self.get(pvs)
+            return [True] * len(pvs)
+        except Exception:
+            connected = []
+            for pv in pvs:
+                try:
+                    self.get(pv)
+                    connected.append(True)
+                except Exception:
+                    connected.append(False)
+            return connected
+
     def put(self, pv, value):
         """ Put the value of a given PV.
 
@@ -25,3 +54,22 @@ class ControlSystem(object):
             value (Number): The value to be set.
         """
         raise NotImplementedError()
+
+    def run(self, function, *args, **kwargs):
+        """ Call a function using the control system on the thread the
+        control system must be used from.
+
+        Wrappers that use the control system from threads of their own make
+        their calls through this method. This default implementation calls
+        the function directly, as the control system may be used from any
+        thread.
+
+        Args:
+            function (callable): The function to call, such as self.get.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            object: The result of the function.
+        """
+        return function(*args, **kwargs)
@@ -1,5 +1,6 @@
 """Module containing pytac data source classes."""
 import pytac
+from pytac.deferred import DeferredValue
 from pytac.exceptions import FieldException, DataSourceException, HandleException
 
 
@@ -190,8 +191,12 @@ class DataSourceManager(object):
         try:
             data_source = self._data_sources[data_source]
             value = data_source.get_value(field, handle)
-            return self._uc[field].convert(value, origin=data_source.units,
-                                           target=units)
+            uc = self._uc[field]
+            origin = data_source.units
+            if isinstance(value, DeferredValue):
+                return value.then(lambda v: uc.convert(v, origin=origin,
+                                                       target=units))
+            return uc.convert(value, origin=origin, target=units)
         except KeyError:
             raise DataSourceException("No data source type {0} on manager {1}."
                                       .format(data_source, self))
@@ -0,0 +1,278 @@
+"""Deferred reads, batching the reads of loops over elements.
+
+Code such as
+
+    for quad in lattice.get_elements('QUAD'):
+        values.append(quad.get_value('b1'))
+
+makes one control system request per element. Inside a prefetch block,
+started with EpicsLattice.prefetch(), reads of EPICS devices return a
+DeferredValue instead of a value. The reads of the block are made in one
+batched control system request, when the block exits or when the first
+deferred value is needed, whichever is first:
+
+    with lattice.prefetch():
+        for quad in lattice.get_elements('QUAD'):
+            values.append(quad.get_value('b1'))
+    values = [value.result() for value in values]
+
+Deferred values also convert to float and support arithmetic, so most code
+using them does not need changing.
+
+Requests for a PV already waiting to be read share its read. A PV requested
+again after the block has been read is read again, with the next batch, so
+loops polling a field inside one block see new values. Each deferred value
+keeps the result of the read it was requested for.
+"""
+import collections
+import operator
+import threading
+
+
+_local = threading.local()
+
+
+def get_active(cs):
+    """Get the innermost prefetch block of this thread using a control
+    system.
+
+    Args:
+        cs (ControlSystem): The control system.
+
+    Returns:
+        Prefetch: The block, or None if reads through the control system are
+                   not being deferred.
+    """
+    for prefetch in reversed(getattr(_local, 'stack', ())):
+        if prefetch.cs is cs:
+            return prefetch
+    return None
+
+
+class Prefetch(object):
+    """A block of reads from a control system, made in one batch.
+
+    **Attributes:**
+
+    Attributes:
+        cs (ControlSystem): The control system read from.
+
+    .. Private Attributes:
+           _pending (OrderedDict): The _Read of each PV requested and not yet
+                                    read.
+           _values (dict): The latest value, or the exception raised reading
+                            it, of each PV read.
+           _lock (threading.Lock): Protects the reads and values.
+    """
+    def __init__(self, cs):
+        """
+        Args:
+            cs (ControlSystem): The control system read from.
+
+        **Methods:**
+        """
+        self.cs = cs
+        self._pending = collections.OrderedDict()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, pv):
+        """Request a PV, to be read with the next batch of the block.
+
+        A PV already waiting to be read is only read once, but a PV that has
+        been read is read again.
+
+        Args:
+            pv (str): The PV to read.
+
+        Returns:
+            DeferredValue: The value of the PV, once read.
+        """
+        with self._lock:
+            read = self._pending.get(pv)
+            if read is None:
+                read = self._pending[pv] = _Read(pv)
+        return DeferredValue(self, read)
+
+    def resolve(self):
+        """Read all the PVs requested and not yet read, in one request.
+
+        If the batched request raises, each PV is read individually so that
+        only the deferred values of the PVs that fail raise.
+        """
+        with self._lock:
+            pvs = list(self._pending)
+            reads = list(self._pending.values())
+            self._pending.clear()
+            if not pvs:
+                return
+            try:
+                values = self.cs.get(pvs)
+            except Exception:
+                values = []
+                for pv in pvs:
+                    try:
+                        values.append(self.cs.get(pv))
+                    except Exception as e:
+                        values.append(_Failure(e))
+            for read, value in zip(reads, values):
+                read.value = value
+                read.done = True
+            self._values.update(zip(pvs, values))
+
+    def get_value(self, pv):
+        """Get the latest value of a PV, reading the block first if the PV
+        is waiting to be read.
+
+        Args:
+            pv (str): The PV, which was requested with add().
+
+        Returns:
+            object: The value of the PV.
+
+        Raises:
+            Exception: the error raised reading the PV.
+        """
+        if pv in self._pending or pv not in self._values:
+            self.resolve()
+        return _result(self._values[pv])
+
+    def __enter__(self):
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.stack.remove(self)
+        if exc_type is None:
+            self.resolve()
+
+
+class _Failure(object):
+    """The error raised reading a PV."""
+    def __init__(self, error):
+        self.error = error
+
+
+class _Read(object):
+    """A read of a PV, shared by the requests made for it in one batch."""
+    def __init__(self, pv):
+        self.pv = pv
+        self.value = None
+        self.done = False
+
+
+def _result(value):
+    if isinstance(value, _Failure):
+        raise value.error
+    return value
+
+
+class DeferredValue(object):
+    """The value of a PV read in a prefetch block, together with the
+    functions, such as unit conversions, to apply to it.
+
+    Converting the value to a float, or using it in arithmetic or
+    comparisons, gets its result.
+
+    .. Private Attributes:
+           _prefetch (Prefetch): The block the PV is read in.
+           _read (_Read): The read of the PV.
+           _functions (tuple): The functions applied to the value of the PV,
+                                in order.
+    """
+    def __init__(self, prefetch, read, functions=()):
+        """
+        Args:
+            prefetch (Prefetch): The block the PV is read in.
+            read (_Read): The read of the PV.
+            functions (tuple): The functions applied to the value of the PV,
+                                in order.
+
+        **Methods:**
+        """
+        self._prefetch = prefetch
+        self._read = read
+        self._functions = functions
+
+    def then(self, function):
+        """Get a deferred value with a function applied to this one.
+
+        Args:
+            function (callable): Called with this value.
+
+        Returns:
+            DeferredValue: The result of the function.
+        """
+        return DeferredValue(self._prefetch, self._read,
+                             self._functions + (function,))
+
+    def done(self):
+        """Whether the PV has been read.
+
+        Returns:
+            bool: True if the PV has been read.
+        """
+        return self._read.done
+
+    def result(self):
+        """Get the value, reading the PVs of the block first if needed.
+
+        Returns:
+            object: The value.
+
+        Raises:
+            Exception: the error raised reading the PV.
+        """
+        if not self._read.done:
+            self._prefetch.resolve()
+        value = _result(self._read.value)
+        for function in self._functions:
+            value = function(value)
+        return value
+
+    def __float__(self):
+        return float(self.result())
+
+    def __int__(self):
+        return int(self.result())
+
+    def __bool__(self):
+        return bool(self.result())
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        if self.done():
+            return '<DeferredValue {0}: {1!r}>'.format(self._read.pv,
+                                                       self.result())
+        return '<DeferredValue {0}: pending>'.format(self._read.pv)
+
+
+def _unwrap(value):
+    if isinstance(value, DeferredValue):
+        return value.result()
+    return value
+
+
+def _binary(op, reflected=False):
+    if reflected:
+        return lambda self, other: op(_unwrap(other), self.result())
+    return lambda self, other: op(self.result(), _unwrap(other))
+
+
+for _name, _op in (('add', operator.add), ('sub', operator.sub),
+                   ('mul', operator.mul), ('truediv', operator.truediv),
+                   ('floordiv', operator.floordiv), ('mod', operator.mod),
+                   ('pow', operator.pow)):
+    setattr(DeferredValue, '__{0}__'.format(_name), _binary(_op))
+    setattr(DeferredValue, '__r{0}__'.format(_name), _binary(_op, True))
+DeferredValue.__div__ = DeferredValue.__truediv__
+DeferredValue.__rdiv__ = DeferredValue.__rtruediv__
+for _name in ('lt', 'le', 'eq', 'ne', 'gt', 'ge'):
+    setattr(DeferredValue, '__{0}__'.format(_name),
+            _binary(getattr(operator, _name)))
+DeferredValue.__hash__ = None
+DeferredValue.__neg__ = lambda self: -self.result()
+DeferredValue.__abs__ = lambda self: abs(self.result())
@@ -78,3 +78,34 @@ class BasicDevice(Device):
             ?: the value of the PV.
         """
         return self.value
+
+
+class EnergyDevice(BasicDevice):
+    """A basic device holding the beam energy of a lattice.
+
+    Its value is the energy of a Rigidity object, which is shared by the unit
+    conversions of the magnets, so setting the energy rescales those
+    conversions without reloading the lattice.
+
+    **Attributes:**
+
+    Attributes:
+        rigidity (Rigidity): The rigidity at the current energy.
+    """
+    def __init__(self, rigidity, enabled=True):
+        """Args:
+            rigidity (Rigidity): The rigidity object holding the energy.
+            enabled (bool-like): Whether the device is enabled. May be a
+                                  PvEnabler object.
+        """
+        self.rigidity = rigidity
+        super(EnergyDevice, self).__init__(rigidity.energy, enabled)
+
+    @property
+    def value(self):
+        """float: The beam energy in MeV."""
+        return self.rigidity.energy
+
+    @value.setter
+    def value(self, value):
+        self.rigidity.energy = value
@@ -25,6 +25,9 @@ class Element(object):
            _data_source_manager (DataSourceManager): A class that manages the
                                                       data sources associated
                                                       with this element.
+           _parent_lattice (Lattice): The lattice the element was added to,
+                                       which is told about devices added to
+                                       the element later.
     """
     def __init__(self, name, length, element_type, s, index=None, cell=None):
         """
@@ -46,6 +49,17 @@ class Element(object):
         self.cell = cell
         self.families = set()
         self._data_source_manager = DataSourceManager()
+        self._parent_lattice = None
+
+    def __getstate__(self):
+        """Get the state of the element to pickle, without its lattice, so
+        that pickling an element does not pickle the whole lattice. The
+        lattice is set again when a lattice containing the element is
+        unpickled.
+        """
+        state = self.__dict__.copy()
+        state['_parent_lattice'] = None
+        return state
 
     def __str__(self):
         """Auxiliary function to print out an element.
@@ -102,6 +116,8 @@ class Element(object):
         except DataSourceException:
             raise DataSourceException("No device data source for field {0} on "
                                       "element {1}.".format(field, self))
+        if self._parent_lattice is not None:
+            self._parent_lattice._device_added(self, field, device)
 
     def get_device(self, field):
         """Get the device for the given field.
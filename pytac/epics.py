@@ -1,10 +1,40 @@
 """EPICS implementations of the classes in pytac."""
+import bisect
+import collections
+import fnmatch
+import itertools
+import re
 import numpy
 import pytac
 from pytac.device import Device
 from pytac.element import Element
+from pytac import deferred, utils
 from pytac.exceptions import DataSourceException, HandleException, FieldException
-from pytac.lattice import Lattice
+from pytac.lattice import Lattice, masked_values, waveform_array
+from pytac.prewarm import Prewarmer
+
+
+def _get_devices(manager):
+    """Get the devices of a DataSourceManager, keyed by field."""
+    data_source = manager._data_sources.get(pytac.LIVE)
+    return getattr(data_source, '_devices', {})
+
+
+def _set_control_system(manager, cs):
+    """Set the control system of the EPICS devices of a DataSourceManager."""
+    for device in _get_devices(manager).values():
+        if isinstance(device, EpicsDevice):
+            device.set_control_system(cs)
+
+
+def _get_pvs(device):
+    """Get the (handle, PV name) pairs of a device."""
+    pvs = []
+    for handle, pv in ((pytac.RB, getattr(device, 'rb_pv', None)),
+                       (pytac.SP, getattr(device, 'sp_pv', None))):
+        if pv is not None:
+            pvs.append((handle, pv))
+    return pvs
 
 
 class EpicsLattice(Lattice):
@@ -12,6 +42,26 @@ class EpicsLattice(Lattice):
 
     Allows efficient get_values() and set_values() methods, and adds
     get_pv_names() method.
+
+    Every readback and setpoint PV of the lattice and its elements is kept in
+    an index, so the owner of a PV is found in constant time by find_pv() and
+    find_pvs(). Device names are indexed too, for find_device() and the glob
+    patterns of find_devices().
+
+    The lattice can be pickled. The control system is not included, so one
+    must be set with set_control_system() after unpickling.
+
+    .. Private Attributes:
+           _pv_index (dict): The (owner, field, handle) of each PV name, where
+                              the owner is the lattice or an element.
+           _positions (dict): The position in the ring of each element.
+           _device_names (dict): The set of (position, field) pairs of the
+                                  devices with each name, where the position
+                                  of the lattice itself is -1.
+           _sorted_device_names (list): The sorted device names, or None if
+                                         they have changed since last sorted.
+           _prewarmer (Prewarmer): The connections to the PVs made by
+                                    prewarm(), if called.
     """
     def __init__(self, name, epics_cs):
         """
@@ -22,9 +72,224 @@ class EpicsLattice(Lattice):
 
         **Methods:**
         """
+        self._pv_index = {}
+        self._positions = {}
+        self._device_names = {}
+        self._sorted_device_names = None
+        self._prewarmer = None
         super(EpicsLattice, self).__init__(name)
         self._cs = epics_cs
 
+    def __getstate__(self):
+        """Get the state of the lattice to pickle, without the control
+        system.
+        """
+        state = super(EpicsLattice, self).__getstate__()
+        state['_cs'] = None
+        state['_prewarmer'] = None
+        return state
+
+    def set_control_system(self, cs):
+        """Set the control system of the lattice and all its EPICS devices.
+
+        Used to attach a control system to an unpickled lattice.
+
+        Args:
+            cs (ControlSystem): The control system used to store the values
+                                 on a PV.
+        """
+        self._cs = cs
+        _set_control_system(self._data_source_manager, cs)
+        for element in self._get_loaded_elements():
+            _set_control_system(element._data_source_manager, cs)
+
+    def _add_device_name(self, name, position, field):
+        entries = self._device_names.get(name)
+        if entries is None:
+            entries = self._device_names[name] = set()
+            self._sorted_device_names = None
+        entries.add((position, field))
+
+    def prewarm(self, background=True, chunk_size=200, timeout=None,
+                callback=None):
+        """Connect to every readback and setpoint PV of the lattice and its
+        elements, so that the first reads of each family are not delayed.
+
+        Elements of a lazy lattice are not built to find their PVs.
+
+        Args:
+            background (bool): If True, connect in a background thread and
+                                return at once.
+            chunk_size (int): The number of PVs connected to at once.
+            timeout (float): The time in seconds to wait for the connections
+                              of each chunk, or None for the control system
+                              default.
+            callback (callable): Called with the number of PVs done and the
+                                  total after each chunk.
+
+        Returns:
+            Prewarmer: Reports the progress and the PVs that connected.
+        """
+        self._prewarmer = Prewarmer(self._cs, self._get_all_pv_names(),
+                                    chunk_size, timeout, callback)
+        if background:
+            self._prewarmer.start()
+        else:
+            self._prewarmer.run()
+        return self._prewarmer
+
+    def _get_all_pv_names(self):
+        return list(self._pv_index)
+
+    def get_prewarmer(self):
+        """Get the connections to the PVs made by the last call to
+        prewarm().
+
+        Returns:
+            Prewarmer: The connections, or None if prewarm() was not called.
+        """
+        return self._prewarmer
+
+    def _device_added(self, owner, field, device):
+        for handle, pv in _get_pvs(device):
+            self._pv_index[pv] = (owner, field, handle)
+        name = getattr(device, 'name', None)
+        if isinstance(name, utils.string_types):
+            position = -1 if owner is self else self._positions[owner]
+            self._add_device_name(name, position, field)
+
+    def _index_element(self, element):
+        for field, device in _get_devices(element._data_source_manager).items():
+            self._device_added(element, field, device)
+
+    def add_element(self, element):
+        """Append an element to the lattice.
+
+        Args:
+            element (Element): element to append.
+        """
+        self._positions[element] = len(self._lattice)
+        super(EpicsLattice, self).add_element(element)
+        self._index_element(element)
+
+    def _get_owner(self, owner):
+        return owner
+
+    def _lookup_pv(self, pv):
+        entry = self._pv_index.get(pv)
+        if entry is None:
+            return None
+        owner, field, handle = entry
+        owner = self._get_owner(owner)
+        # Entries are not removed when a device is replaced, so check that
+        # the PV still belongs to the field.
+        try:
+            device = owner.get_device(field)
+        except (DataSourceException, FieldException):
+            return None
+        if dict(_get_pvs(device)).get(handle) != pv:
+            return None
+        return owner, field, handle
+
+    def find_pv(self, pv):
+        """Find the lattice or element, field and handle that a PV belongs
+        to.
+
+        Args:
+            pv (str): The readback or setpoint PV name.
+
+        Returns:
+            tuple: The lattice or element, the field and pytac.RB or pytac.SP.
+
+        Raises:
+            DataSourceException: if no device of the lattice has the PV.
+        """
+        entry = self._lookup_pv(pv)
+        if entry is None:
+            raise DataSourceException("No PV {0} on lattice {1}."
+                                      .format(pv, self))
+        return entry
+
+    def find_pvs(self, pv_names):
+        """Find the lattice or element, field and handle of each of a number
+        of PVs.
+
+        Args:
+            pv_names (sequence): The readback or setpoint PV names, which may
+                                  be a numpy array.
+
+        Returns:
+            list: The (lattice or element, field, handle) of each PV, or None
+                   for PVs that no device of the lattice has.
+        """
+        return [self._lookup_pv(pv) for pv in pv_names]
+
+    def _get_device_owners(self, names):
+        entries = sorted((position, field, name) for name in names
+                         for position, field in self._device_names[name])
+        owners = []
+        for position, field, name in entries:
+            owner = self if position < 0 else self[position]
+            # Entries are not removed when a device is replaced, so check
+            # that the name still belongs to the field.
+            try:
+                device = owner.get_device(field)
+            except (DataSourceException, FieldException):
+                continue
+            if getattr(device, 'name', None) == name:
+                owners.append((owner, field))
+        return owners
+
+    def find_device(self, name):
+        """Find the lattice or elements and fields of the devices with a
+        name.
+
+        Devices such as BPMs have the same name on several fields.
+
+        Args:
+            name (str): The name of the device.
+
+        Returns:
+            list: The (lattice or element, field) pairs of the devices, with
+                   the lattice first and then the elements in ring order.
+
+        Raises:
+            DataSourceException: if no device of the lattice has the name.
+        """
+        owners = []
+        if name in self._device_names:
+            owners = self._get_device_owners([name])
+        if not owners:
+            raise DataSourceException("No device {0} on lattice {1}."
+                                      .format(name, self))
+        return owners
+
+    def find_devices(self, pattern):
+        """Find the lattice or elements and fields of the devices whose names
+        match a glob pattern, such as 'SR05*'.
+
+        Args:
+            pattern (str): The pattern, matched case-sensitively using
+                            fnmatch. The part before the first wildcard is
+                            looked up as a prefix of the sorted names.
+
+        Returns:
+            list: The (lattice or element, field) pairs of the devices, with
+                   the lattice first and then the elements in ring order.
+        """
+        if self._sorted_device_names is None:
+            self._sorted_device_names = sorted(self._device_names)
+        prefix = re.split(r'[*?[]', pattern, 1)[0]
+        names = self._sorted_device_names
+        start = bisect.bisect_left(names, prefix)
+        matches = []
+        for name in itertools.islice(names, start, None):
+            if not name.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(name, pattern):
+                matches.append(name)
+        return self._get_device_owners(matches)
+
     def get_pv_names(self, family, field, handle):
         """Get all PV names for a specific family, field, and handle.
 
@@ -45,25 +310,236 @@ class EpicsLattice(Lattice):
             pv_names.append(element.get_pv_name(field, handle))
         return pv_names
 
-    def get_values(self, family, field, handle, dtype=None):
+    def prefetch(self):
+        """Start a block in which reads of the EPICS devices of the lattice,
+        its elements and any other devices using the control system of the
+        lattice are deferred.
+
+        The reads return DeferredValue objects, and are made in one request
+        when the block exits or the first deferred value is needed. Reading
+        a field again after that reads its PV again, in the next request.
+        Reads from other threads are not deferred.
+
+        Returns:
+            Prefetch: The block, to be used in a with statement.
+        """
+        return deferred.Prefetch(self._cs)
+
+    def _get_archive(self):
+        try:
+            return self._data_source_manager._data_sources[pytac.ARCHIVE]
+        except KeyError:
+            raise DataSourceException("No data source {0} on lattice {1}."
+                                      .format(pytac.ARCHIVE, self))
+
+    def _check_data_source(self, data_source):
+        """Check that PVs can be read in bulk from a data source."""
+        if data_source == pytac.ARCHIVE:
+            self._get_archive()
+        elif data_source != pytac.LIVE:
+            raise DataSourceException("PVs of lattice {0} can only be read "
+                                      "from {1} or {2}, not {3}."
+                                      .format(self, pytac.LIVE, pytac.ARCHIVE,
+                                              data_source))
+
+    def _get_pv_values(self, pv_names, data_source):
+        self._check_data_source(data_source)
+        if data_source == pytac.ARCHIVE:
+            return self._get_archive().get_pv_values(pv_names)
+        return self._cs.get(pv_names)
+
+    def _get_masked_values(self, family, field, handle, dtype, data_source):
+        self._check_data_source(data_source)
+        elements = self.get_elements(family)
+        pv_names = []
+        for element in elements:
+            try:
+                pv_names.append(element.get_pv_name(field, handle))
+            except (DataSourceException, FieldException, HandleException):
+                pv_names.append(None)
+        indices = [i for i, pv in enumerate(pv_names) if pv is not None]
+        values = [None] * len(elements)
+        if indices:
+            requested = [pv_names[i] for i in indices]
+            try:
+                results = self._get_pv_values(requested, data_source)
+            except Exception:
+                # Read the PVs one at a time to keep the ones that succeed.
+                # The control system may not be usable from other threads, so
+                # they are not read concurrently here, and each PV that fails
+                # costs a timeout.
+                results = []
+                for pv in requested:
+                    try:
+                        results.append(self._get_pv_values([pv],
+                                                           data_source)[0])
+                    except Exception as e:
+                        results.append(e)
+            for i, value in zip(indices, results):
+                values[i] = value
+        valid = [utils.is_valid_value(value) for value in values]
+        return masked_values(values, valid, dtype)
+
+    def get_values(self, family, field, handle, dtype=None,
+                   data_source=pytac.DEFAULT, masked=False, out=None):
         """Get the value for a family and field for all elements in the lattice.
 
+        Values are read from the control system unless the data source, or the
+        lattice default if it is not given, is pytac.ARCHIVE, in which case
+        they are read from the archive at the replay time.
+
         Args:
             family (str): requested family.
             field (str): requested field.
             handle (str): pytac.RB or pytac.SP.
             dtype (numpy.dtype): if set it specifies the data type of the values
                                   in the output array.
+            data_source (str): pytac.LIVE or pytac.ARCHIVE.
+            masked (bool): if True, return a numpy masked array with one entry
+                            for every element in the family. Elements without
+                            a PV for the field and PVs whose read fails are
+                            masked rather than raising. If the batched read
+                            fails, the PVs are read again one at a time, so
+                            each PV that cannot be read costs a full control
+                            system timeout. Wrapping the control system in a
+                            CircuitBreakerControlSystem avoids this, as it
+                            reads the PVs of failed batches concurrently,
+                            through the run() method of the control system,
+                            and then skips the PVs that keep failing.
+            out (numpy.ndarray): if set, an array with one entry for every
+                                  element in the family to store the values
+                                  in, for example one reused between calls.
+                                  The dtype is then ignored. Not used if
+                                  masked.
 
         Returns:
-            list or array: The requested values.
+            list, array or masked array: The requested values, in out if it is
+                                          given.
+
+        Raises:
+            DataSourceException: if the data source is not pytac.LIVE or
+                                  pytac.ARCHIVE, or pytac.ARCHIVE is
+                                  requested but there is no archive data
+                                  source on the lattice.
+            ValueError: if out does not have one entry for every element.
         """
+        if data_source == pytac.DEFAULT:
+            data_source = self.get_default_data_source()
+        if masked:
+            return self._get_masked_values(family, field, handle, dtype,
+                                           data_source)
         pv_names = self.get_pv_names(family, field, handle)
-        values = self._cs.get(pv_names)
+        values = self._get_pv_values(pv_names, data_source)
+        if out is not None:
+            if len(out) != len(values):
+                raise ValueError("Output array has {0} entries for {1} "
+                                 "elements.".format(len(out), len(values)))
+            out[...] = values
+            return out
         if dtype is not None:
-            values = numpy.array(values, dtype=dtype)
+            # Arrays already of the type returned by the control system are
+            # not copied.
+            values = numpy.asarray(values, dtype=dtype)
+        if isinstance(values, numpy.ndarray) and not values.flags.writeable:
+            # Archives return read-only views of their memory-mapped files,
+            # which callers must be free to modify.
+            values = values.copy()
         return values
 
+    def get_waveforms(self, family, field, handle=pytac.RB, samples=None,
+                      dtype=None, out=None, data_source=pytac.DEFAULT):
+        """Get the waveforms of an array-valued field, such as turn-by-turn
+        BPM data, for all elements of a family.
+
+        The PVs are read in one request and each waveform returned by the
+        control system is copied once, straight into its row of the result.
+
+        Args:
+            family (str): requested family.
+            field (str): requested field.
+            handle (str): pytac.RB or pytac.SP.
+            samples (int): The number of samples per element; see
+                            waveform_array().
+            dtype (numpy.dtype): The data type of the array, float64 if None.
+            out (numpy.ndarray): An array of shape (elements, samples) to
+                                  copy the waveforms into.
+            data_source (str): pytac.LIVE or pytac.ARCHIVE.
+
+        Returns:
+            numpy.ndarray: The waveform of each element, one per row.
+
+        Raises:
+            DataSourceException: if the data source is not pytac.LIVE or
+                                  pytac.ARCHIVE, or pytac.ARCHIVE is
+                                  requested but there is no archive data
+                                  source on the lattice.
+            ValueError: if out does not have the expected shape.
+        """
+        if data_source == pytac.DEFAULT:
+            data_source = self.get_default_data_source()
+        pv_names = self.get_pv_names(family, field, handle)
+        values = self._get_pv_values(pv_names, data_source)
+        return waveform_array(values, samples, dtype, out)
+
+    def get_snapshot(self, requests, lattice_fields=(), dtype=None,
+                     data_source=pytac.DEFAULT):
+        """Get the values of several families and fields and of lattice fields
+        in a single read.
+
+        The PVs of all the requests are merged into one read, in which each
+        PV is only requested once, and the values are split back up by
+        request. Lattice fields without PVs, such as 's_position', are read
+        from their devices in engineering units.
+
+        Args:
+            requests (sequence): (family, field, handle) tuples.
+            lattice_fields (sequence): Fields of the lattice, whose readback
+                                        values are read.
+            dtype (numpy.dtype): if set, the values of each request are
+                                  returned as a numpy array of this type.
+            data_source (str): pytac.LIVE or pytac.ARCHIVE.
+
+        Returns:
+            dict: The values of each request, keyed by the request tuple, and
+                   the value of each lattice field, keyed by the field.
+
+        Raises:
+            DataSourceException: if the data source is not pytac.LIVE or
+                                  pytac.ARCHIVE, or pytac.ARCHIVE is
+                                  requested but there is no archive data
+                                  source on the lattice.
+            FieldException: if the lattice does not have a lattice field.
+        """
+        if data_source == pytac.DEFAULT:
+            data_source = self.get_default_data_source()
+        self._check_data_source(data_source)
+        positions = collections.OrderedDict()
+        indices = collections.OrderedDict()
+        for request in requests:
+            indices[tuple(request)] = [
+                positions.setdefault(pv, len(positions))
+                for pv in self.get_pv_names(*request)]
+        snapshot = {}
+        for field in lattice_fields:
+            try:
+                pv = self.get_device(field).get_pv_name(pytac.RB)
+            except (AttributeError, HandleException):
+                snapshot[field] = self.get_value(field, pytac.RB, pytac.ENG,
+                                                 data_source)
+            else:
+                indices[field] = positions.setdefault(pv, len(positions))
+        values = []
+        if positions:
+            values = self._get_pv_values(list(positions), data_source)
+        for key, index in indices.items():
+            if isinstance(index, list):
+                snapshot[key] = [values[i] for i in index]
+                if dtype is not None:
+                    snapshot[key] = numpy.array(snapshot[key], dtype=dtype)
+            else:
+                snapshot[key] = values[index]
+        return snapshot
+
     def set_values(self, family, field, values):
         """Set the value for a family and field for all elements in the lattice.
 
@@ -83,6 +559,183 @@ class EpicsLattice(Lattice):
         self._cs.put(pv_names, values)
 
 
+class LazyEpicsLattice(EpicsLattice):
+    """EPICS lattice whose elements are only built when they are first used.
+
+    The families, cell and length of every element are known up front, so
+    selecting elements by family or cell only builds the elements selected.
+    Iterating over the lattice builds every element, after which it behaves
+    exactly like an EpicsLattice. Pickling the lattice also builds every
+    element. The names and devices of elements not built yet may be given
+    up front, so that finding an element by name or a device by PV or name
+    only builds the elements found.
+
+    .. Private Attributes:
+           _factory (callable): Builds the element at an index of the ring.
+           _families (list): The set of families of each element.
+           _cells (list): The cell of each element.
+           _lengths (list): The length of each element.
+    """
+    def __init__(self, name, epics_cs, factory, families, cells, lengths,
+                 names=None, devices=None):
+        """
+        Args:
+            name (str): The name of the epics lattice.
+            epics_cs (ControlSystem): The control system used to store the
+                                       values on a PV.
+            factory (callable): Called with the index of an element in the
+                                 ring to build that element.
+            families (sequence): The set of families of each element.
+            cells (sequence): The cell of each element.
+            lengths (sequence): The length of each element.
+            names (sequence): The name of each element.
+            devices (sequence): The (index, name, field, readback PV, setpoint
+                                 PV) of each device of the elements, where the
+                                 index is that of the element in the ring.
+
+        **Methods:**
+        """
+        super(LazyEpicsLattice, self).__init__(name, epics_cs)
+        for index, element_name in enumerate(names or ()):
+            self._element_names.setdefault(element_name, []).append(index)
+        for index, device_name, field, rb_pv, sp_pv in devices or ():
+            for handle, pv in ((pytac.RB, rb_pv), (pytac.SP, sp_pv)):
+                if pv is not None:
+                    self._pv_index[pv] = (index, field, handle)
+            if device_name is not None:
+                self._add_device_name(device_name, index, field)
+        self._factory = factory
+        self._families = [set(f) for f in families]
+        self._cells = list(cells)
+        self._lengths = list(lengths)
+        self._lattice = [None] * len(self._lengths)
+
+    def _load(self, index):
+        element = self._lattice[index]
+        if element is None:
+            element = self._factory(index)
+            manager = element._data_source_manager
+            _set_control_system(manager, self._cs)
+            manager.default_units = self.get_default_units()
+            manager.default_data_source = self.get_default_data_source()
+            element._parent_lattice = self
+            self._lattice[index] = element
+            self._positions[element] = index
+            self._index_element(element)
+            # Later changes to the families of the element must be seen here.
+            self._families[index] = element.families
+        return element
+
+    def _get_loaded_elements(self):
+        return [element for element in self._lattice if element is not None]
+
+    def __getstate__(self):
+        """Get the state of the lattice to pickle, with every element built
+        so that the element factory is not needed.
+        """
+        for index in range(len(self._lattice)):
+            self._load(index)
+        state = super(LazyEpicsLattice, self).__getstate__()
+        state['_factory'] = None
+        state.pop('_shared_memory', None)
+        return state
+
+    def _get_owner(self, owner):
+        # Elements not built yet are indexed by their index in the ring.
+        if isinstance(owner, int):
+            return self._load(owner)
+        return owner
+
+    def get_loaded_count(self):
+        """Get the number of elements that have been built.
+
+        Returns:
+            int: The number of elements built so far.
+        """
+        return len(self._get_loaded_elements())
+
+    def __getitem__(self, n):
+        """Get the (n + 1)th element of the lattice, building it if needed.
+
+        Args:
+            n (int or slice): index.
+
+        Returns:
+            Element: indexed element, or a list of elements for a slice.
+        """
+        if isinstance(n, slice):
+            return [self._load(i) for i in range(len(self._lattice))[n]]
+        # Raises IndexError past the end, which also ends iteration.
+        self._lattice[n]
+        return self._load(n if n >= 0 else len(self._lattice) + n)
+
+    def get_length(self):
+        """Returns the length of the lattice.
+
+        Returns:
+            float: The length of the lattice.
+        """
+        return sum(self._lengths)
+
+    def add_element(self, element):
+        """Append an element to the lattice.
+
+        Args:
+            element (Element): element to append.
+        """
+        element._parent_lattice = self
+        self._element_names.setdefault(element.name, []).append(
+            len(self._lattice))
+        self._positions[element] = len(self._lattice)
+        self._lattice.append(element)
+        self._index_element(element)
+        self._families.append(element.families)
+        self._cells.append(element.cell)
+        self._lengths.append(element.length)
+
+    def get_elements(self, family=None, cell=None):
+        """Get the elements of a family from the lattice, building them if
+        needed.
+
+        If no family is specified it returns all elements. Elements are
+        returned in the order they exist in the ring.
+
+        Args:
+            family (str): requested family.
+            cell (int): restrict elements to those in the specified cell.
+
+        Returns:
+            list: list containing all elements of the specified family.
+
+        Raises:
+            ValueError: if there are no elements in the specified cell or
+                         family.
+        """
+        if family is None:
+            indices = range(len(self._lattice))
+        else:
+            indices = [i for i, families in enumerate(self._families)
+                       if family in families]
+        if not indices:
+            raise ValueError("No elements in family {0}.".format(family))
+        if cell is not None:
+            indices = [i for i in indices if self._cells[i] == cell]
+        if not indices:
+            raise ValueError("No elements in cell {0}.".format(cell))
+        return [self._load(i) for i in indices]
+
+    def get_all_families(self):
+        """Get all families of elements in the lattice.
+
+        Returns:
+            set: all defined families.
+        """
+        families = set()
+        for element_families in self._families:
+            families.update(element_families)
+        return families
+
+
 class EpicsElement(Element):
     """EPICS-aware element.
 
@@ -161,6 +814,25 @@ class EpicsDevice(Device):
         self.sp_pv = sp_pv
         self._enabled = enabled
 
+    def __getstate__(self):
+        """Get the state of the device to pickle, without the control
+        system.
+        """
+        state = self.__dict__.copy()
+        state['_cs'] = None
+        return state
+
+    def set_control_system(self, cs):
+        """Set the control system of the device and of its PvEnabler.
+
+        Args:
+            cs (ControlSystem): The control system object used to get and set
+                                 the value of a PV.
+        """
+        self._cs = cs
+        if isinstance(self._enabled, PvEnabler):
+            self._enabled.set_control_system(cs)
+
     def is_enabled(self):
         """Whether the device is enabled.
 
@@ -187,22 +859,23 @@ class EpicsDevice(Device):
     def get_value(self, handle):
         """Read the value of a readback or setpoint PV.
 
+        Inside a prefetch block of the control system of the device, the
+        read is deferred.
+
         Args:
             handle (str): pytac.SP or pytac.RB.
 
         Returns:
-            float: The value of the PV.
+            float or DeferredValue: The value of the PV.
 
         Raises:
             HandleException: if the requested PV doesn't exist.
         """
-        if handle == pytac.RB and self.rb_pv:
-            return self._cs.get(self.rb_pv)
-        elif handle == pytac.SP and self.sp_pv:
-            return self._cs.get(self.sp_pv)
-        else:
-            raise HandleException("Device {0} has no {1} PV."
-                                  .format(self.name, handle))
+        pv = self.get_pv_name(handle)
+        prefetch = deferred.get_active(self._cs)
+        if prefetch is not None:
+            return prefetch.add(pv)
+        return self._cs.get(pv)
 
     def get_pv_name(self, handle):
         """Get the PV name for the specified handle.
@@ -251,6 +924,22 @@ class PvEnabler(object):
         self._enabled_value = str(int(float(enabled_value)))
         self._cs = cs
 
+    def __getstate__(self):
+        """Get the state of the enabler to pickle, without the control
+        system.
+        """
+        state = self.__dict__.copy()
+        state['_cs'] = None
+        return state
+
+    def set_control_system(self, cs):
+        """Set the control system used to read the PV.
+
+        Args:
+            cs (ControlSystem): The control system object.
+        """
+        self._cs = cs
+
     def __nonzero__(self):
         """Used to override the 'if object' clause.
 
@@ -0,0 +1,357 @@
+"""Runtime instrumentation of control systems, lattices and data sources.
+
+Instrumentation is attached to individual objects by shadowing their methods
+with timing wrappers, and removed again by deleting the wrappers, so objects
+that are not instrumented run with no overhead at all. For each call the
+wrapper records its latency against the API method and, for control system
+calls, against every PV in the request. Top-level calls are also recorded
+against the family and field they concern.
+
+Nested calls are tracked per thread, so the time spent in each method
+excluding its callees can be exported as collapsed stacks for flame-graph
+tools such as flamegraph.pl or speedscope.
+"""
+import bisect
+import collections
+import threading
+import time
+from pytac import utils
+from pytac.cs import ControlSystem
+from pytac.data_source import DataSourceManager
+from pytac.element import Element
+from pytac.lattice import Lattice
+from pytac.units import UnitConv
+
+
+# time.perf_counter is not available in Python 2.7.
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Upper edges of the latency histogram bins in seconds, from 1us to 100s in
+# four bins per decade; a final bin holds anything slower.
+BIN_EDGES = [10 ** (e / 4.0) for e in range(-24, 9)]
+
+# Marks methods that were not in the __dict__ of an object before attaching.
+_MISSING = object()
+
+# Methods instrumented by default for each kind of object. The first
+# matching class is used.
+DEFAULT_METHODS = [
+    (ControlSystem, ('get', 'put')),
+    (Lattice, ('get_value', 'set_value', 'get_values', 'set_values',
+               'get_element_values', 'set_element_values', 'get_pv_names',
+               'get_elements', 'get_element_devices')),
+    (Element, ('get_value', 'set_value')),
+    (DataSourceManager, ('get_value', 'set_value')),
+    (UnitConv, ('convert',)),
+]
+
+# Methods whose first arguments are a family and a field.
+_FAMILY_METHODS = ('get_values', 'set_values', 'get_element_values',
+                   'set_element_values', 'get_pv_names', 'get_element_devices')
+
+
+class LatencyStats(object):
+    """Call count, batch size and latency histogram for one key.
+
+    **Attributes:**
+
+    Attributes:
+        calls (int): The number of calls.
+        items (int): The total number of items (e.g. PVs) requested.
+        max_batch (int): The largest number of items in one call.
+        total (float): The total time spent in seconds.
+        max (float): The slowest call in seconds.
+        counts (list): The number of calls in each latency bin.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.max_batch = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.counts = [0] * (len(BIN_EDGES) + 1)
+
+    def add(self, latency, items=1):
+        """Record one call.
+
+        Args:
+            latency (float): The duration of the call in seconds.
+            items (int): The number of items in the call.
+        """
+        self.calls += 1
+        self.items += items
+        self.max_batch = max(self.max_batch, items)
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.counts[bisect.bisect_left(BIN_EDGES, latency)] += 1
+
+    def percentile(self, q):
+        """Estimate a latency percentile from the histogram.
+
+        Args:
+            q (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The upper edge of the bin holding the percentile, or the
+                    maximum latency if it is in the last bin.
+        """
+        target = q / 100.0 * self.calls
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return BIN_EDGES[i] if i < len(BIN_EDGES) else self.max
+        return 0.0
+
+    def as_dict(self):
+        """Summarise the statistics.
+
+        Returns:
+            dict: calls, items, max_batch, total, mean, max, p50, p90, p99
+                   and the histogram counts.
+        """
+        return {'calls': self.calls, 'items': self.items,
+                'max_batch': self.max_batch, 'total': self.total,
+                'mean': self.total / self.calls if self.calls else 0.0,
+                'max': self.max, 'p50': self.percentile(50),
+                'p90': self.percentile(90), 'p99': self.percentile(99),
+                'histogram': list(self.counts)}
+
+
+def _batch(pv):
+    return [pv] if isinstance(pv, utils.string_types) else list(pv)
+
+
+class Instrumentation(object):
+    """Collects latency statistics from the objects attached to it.
+
+    **Attributes:**
+
+    Attributes:
+        methods (dict): LatencyStats for each 'Class.method'.
+        fields (dict): LatencyStats of top-level calls for each (family,
+                        field); family is None for calls on a single element
+                        or data source manager.
+        pvs (dict): LatencyStats for each PV. A batched control system call
+                     is counted once against each of its PVs.
+
+    .. Private Attributes:
+           _attached (dict): The object and the wrapped methods of each
+                              attached object, keyed by object id. Each
+                              method name maps to the entry the object's
+                              __dict__ had for it before attaching, or a
+                              marker if it had none.
+           _folded (Counter): Self time in microseconds of each call stack.
+           _local (threading.local): The call stack of each thread.
+           _lock (threading.Lock): Serialises updates to the statistics.
+    """
+    def __init__(self):
+        """
+        **Methods:**
+        """
+        self.methods = collections.defaultdict(LatencyStats)
+        self.fields = collections.defaultdict(LatencyStats)
+        self.pvs = collections.defaultdict(LatencyStats)
+        self._attached = {}
+        self._folded = collections.Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def attach(self, obj, methods=None):
+        """Start instrumenting an object.
+
+        Args:
+            obj (object): The object to instrument.
+            methods (sequence): The names of the methods to instrument. By
+                                 default these depend on the type of object,
+                                 see DEFAULT_METHODS.
+
+        Raises:
+            ValueError: if no methods are given and the object is not of a
+                         known type.
+        """
+        if methods is None:
+            for cls, names in DEFAULT_METHODS:
+                if isinstance(obj, cls):
+                    methods = names
+                    break
+            else:
+                raise ValueError("No default methods to instrument on {0}."
+                                 .format(obj))
+        if id(obj) in self._attached:
+            self.detach(obj)
+        wrapped = {}
+        for name in methods:
+            if hasattr(obj, name):
+                # Instance attributes, such as mocks or patched methods, are
+                # wrapped too and put back when detaching.
+                wrapped[name] = obj.__dict__.get(name, _MISSING)
+                setattr(obj, name, self._wrap(obj, name))
+        self._attached[id(obj)] = (obj, wrapped)
+
+    def detach(self, obj):
+        """Stop instrumenting an object, restoring its original methods.
+
+        Args:
+            obj (object): The instrumented object.
+        """
+        _, wrapped = self._attached.pop(id(obj), (None, {}))
+        for name, original in wrapped.items():
+            if original is _MISSING:
+                obj.__dict__.pop(name, None)
+            else:
+                obj.__dict__[name] = original
+
+    def attach_lattice(self, lattice):
+        """Instrument a lattice with its control system, elements, data source
+        managers and unit conversions.
+
+        Only the elements already built are instrumented, so attaching to a
+        LazyEpicsLattice does not build all its elements. Elements built
+        later can be attached individually.
+
+        Args:
+            lattice (Lattice): The lattice to instrument.
+        """
+        targets = [lattice, lattice._data_source_manager]
+        for element in lattice._get_loaded_elements():
+            targets.append(element)
+            targets.append(element._data_source_manager)
+            targets.extend(element._data_source_manager._uc.values())
+        targets.extend(lattice._data_source_manager._uc.values())
+        seen = set()
+        for obj in targets:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                self.attach(obj)
+        # The control system is only required to provide get and put.
+        cs = getattr(lattice, '_cs', None)
+        if cs is not None:
+            self.attach(cs, ('get', 'put'))
+
+    def detach_all(self):
+        """Stop instrumenting all attached objects."""
+        for obj, _ in list(self._attached.values()):
+            self.detach(obj)
+
+    def reset(self):
+        """Discard all the statistics collected so far."""
+        with self._lock:
+            self.methods.clear()
+            self.fields.clear()
+            self.pvs.clear()
+            self._folded.clear()
+
+    def _wrap(self, obj, name):
+        method = getattr(obj, name)
+        label = '{0}.{1}'.format(type(obj).__name__, name)
+        is_cs = name in ('get', 'put') and not isinstance(obj, Lattice)
+
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            frame = [label, 0.0]
+            stack.append(frame)
+            start = _clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                latency = _clock() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += latency
+                self._record(name, label, is_cs, args, kwargs, latency,
+                             latency - frame[1], stack)
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, name, label, is_cs, args, kwargs, latency, self_time,
+                stack):
+        path = ';'.join([frame[0] for frame in stack] + [label])
+        pvs = None
+        key = None
+        if is_cs:
+            pvs = _batch(args[0] if args else kwargs['pv'])
+        elif name in _FAMILY_METHODS:
+            key = (args[0] if args else kwargs.get('family'),
+                   args[1] if len(args) > 1 else kwargs.get('field'))
+        elif name in ('get_value', 'set_value'):
+            key = (None, args[0] if args else kwargs.get('field'))
+        with self._lock:
+            self._folded[path] += int(round(self_time * 1e6))
+            self.methods[label].add(latency, len(pvs) if pvs else 1)
+            # Only top-level calls count against a field, so that nested
+            # calls such as get_pv_names within get_values are not counted
+            # twice.
+            if key is not None and not stack:
+                self.fields[key].add(latency)
+            if pvs:
+                for pv in pvs:
+                    self.pvs[pv].add(latency, len(pvs))
+
+    def get_summary(self):
+        """Summarise the statistics collected.
+
+        Returns:
+            dict: 'methods', 'fields' and 'pvs', each mapping keys to the
+                   dictionaries returned by LatencyStats.as_dict().
+        """
+        with self._lock:
+            return dict((kind, dict((key, stats.as_dict())
+                                    for key, stats in getattr(self,
+                                                              kind).items()))
+                        for kind in ('methods', 'fields', 'pvs'))
+
+    def format_summary(self, limit=20):
+        """Format the slowest methods, fields and PVs as a text table.
+
+        Args:
+            limit (int): The number of rows shown for each kind of key,
+                          ordered by total time.
+
+        Returns:
+            str: The formatted summary.
+        """
+        summary = self.get_summary()
+        lines = []
+        row = '{0:<50} {1:>8} {2:>8} {3:>12} {4:>12} {5:>12}'
+        for kind in ('methods', 'fields', 'pvs'):
+            lines.append(row.format(kind, 'calls', 'items', 'total (s)',
+                                    'mean (s)', 'p99 (s)'))
+            ordered = sorted(summary[kind].items(),
+                             key=lambda item: -item[1]['total'])
+            for key, stats in ordered[:limit]:
+                if isinstance(key, tuple):
+                    key = '/'.join(str(k) for k in key)
+                lines.append(row.format(key, stats['calls'], stats['items'],
+                                        '{0:.6f}'.format(stats['total']),
+                                        '{0:.6f}'.format(stats['mean']),
+                                        '{0:.6f}'.format(stats['p99'])))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def get_folded(self):
+        """Get the self time of each call stack in collapsed stack format.
+
+        Returns:
+            list: 'caller;callee microseconds' lines, one per call stack.
+        """
+        with self._lock:
+            return ['{0} {1}'.format(path, us)
+                    for path, us in sorted(self._folded.items())]
+
+    def write_folded(self, filename):
+        """Write the collapsed call stacks to a file for flame-graph tools.
+
+        Args:
+            filename (str): The file to write.
+        """
+        with open(filename, 'w') as folded:
+            for line in self.get_folded():
+                folded.write(line + '\n')
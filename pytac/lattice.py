@@ -3,10 +3,75 @@
 """
 import numpy
 import pytac
+from pytac import utils
 from pytac.data_source import DataSourceManager
+from pytac.units import UnitConvBank
 from pytac.exceptions import UnitsException, DataSourceException, FieldException
 
 
+def masked_values(values, valid, dtype=None):
+    """Build a masked array from values and their validity.
+
+    Args:
+        values (sequence): The values; invalid entries may be of any type.
+        valid (sequence): True for each value that is valid.
+        dtype (numpy.dtype): The data type of the array, float64 if None.
+
+    Returns:
+        numpy.ma.MaskedArray: The values, masked where they are invalid.
+    """
+    if dtype is None:
+        dtype = numpy.float64
+    valid = numpy.asarray(valid, dtype=bool)
+    data = numpy.array([value if ok else 0 for value, ok in zip(values, valid)],
+                       dtype=dtype)
+    return numpy.ma.MaskedArray(data, mask=~valid)
+
+
+def waveform_array(values, samples=None, dtype=None, out=None):
+    """Copy waveforms into the rows of a 2-D array.
+
+    Each waveform is copied once, directly into its row. Waveforms shorter
+    than a row are padded with NaN, or zero for integer types, and longer
+    ones are truncated. Scalar values are treated as waveforms of length 1.
+
+    Args:
+        values (sequence): The waveform of each row, as numpy arrays or
+                            sequences.
+        samples (int): The length of the rows. Defaults to the width of out,
+                        or else to the length of the longest waveform.
+        dtype (numpy.dtype): The data type of the array, float64 if None.
+                              Ignored if out is given.
+        out (numpy.ndarray): An array to copy the waveforms into, for example
+                              one reused between acquisitions.
+
+    Returns:
+        numpy.ndarray: The waveforms, one per row.
+
+    Raises:
+        ValueError: if out does not have one row per waveform, or a length
+                     different from samples.
+    """
+    waveforms = [numpy.asarray(value) for value in values]
+    if samples is None:
+        if out is not None:
+            samples = out.shape[-1]
+        else:
+            samples = max([w.size for w in waveforms] or [0])
+    if out is None:
+        out = numpy.empty((len(waveforms), samples),
+                          dtype=numpy.float64 if dtype is None else dtype)
+    elif out.shape != (len(waveforms), samples):
+        raise ValueError("Output array has shape {0}, not {1}."
+                         .format(out.shape, (len(waveforms), samples)))
+    fill = numpy.nan if out.dtype.kind in 'fc' else 0
+    for row, waveform in zip(out, waveforms):
+        waveform = waveform.reshape(-1)[:samples]
+        row[:waveform.size] = waveform
+        row[waveform.size:] = fill
+    return out
+
+
 class Lattice(object):
     """Representation of a lattice.
 
@@ -25,6 +90,10 @@ class Lattice(object):
            _data_source_manager (DataSourceManager): A class that manages the
                                                       data sources associated
                                                       with this lattice.
+           _unitconv_bank (UnitConvBank): The cached bank of the unit
+                                           conversions of the elements.
+           _element_names (dict): The positions in the ring of the elements
+                                   with each name.
     """
     def __init__(self, name):
         """Args:
@@ -35,6 +104,25 @@ class Lattice(object):
         self.name = name
         self._lattice = []
         self._data_source_manager = DataSourceManager()
+        self._unitconv_bank = None
+        self._element_names = {}
+
+    def __getstate__(self):
+        """Get the state of the lattice to pickle, without the cached unit
+        conversion bank.
+        """
+        state = self.__dict__.copy()
+        state['_unitconv_bank'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state of an unpickled lattice and set it as the
+        lattice of its elements, which do not pickle it themselves.
+        """
+        self.__dict__.update(state)
+        for element in self._lattice:
+            if element is not None:
+                element._parent_lattice = self
 
     def set_data_source(self, data_source, data_source_type):
         """Add a data source to the lattice.
@@ -77,6 +165,12 @@ class Lattice(object):
         except DataSourceException:
             raise DataSourceException("No device data source on lattice {0}."
                                       .format(self))
+        self._device_added(self, field, device)
+
+    def _device_added(self, owner, field, device):
+        """Called when a device is added to the lattice or one of its
+        elements.
+        """
 
     def get_device(self, field):
         """Get the device for the given field.
@@ -117,6 +211,31 @@ class Lattice(object):
             raise FieldException("No unit conversion option for field {0} on "
                                  "lattice {1}.".format(field, self))
 
+    def get_unitconv_bank(self, refresh=False):
+        """Get a bank of the unit conversions of all the element fields.
+
+        The bank converts the values of any set of element fields in a few
+        vectorised operations. It is built on first use and cached, so it
+        must be refreshed if unit conversions are added or replaced later.
+        Changes to the pre and post functions of the unit conversions, such
+        as their rigidity, are picked up automatically.
+
+        Args:
+            refresh (bool): If True, rebuild the bank.
+
+        Returns:
+            UnitConvBank: The bank, keyed by (element, field) pairs.
+        """
+        if self._unitconv_bank is None or refresh:
+            keys = []
+            unitconvs = []
+            for element in self.get_elements():
+                for field, uc in element._data_source_manager._uc.items():
+                    keys.append((element, field))
+                    unitconvs.append(uc)
+            self._unitconv_bank = UnitConvBank(unitconvs, keys)
+        return self._unitconv_bank
+
     def get_value(self, field, handle=pytac.RB, units=pytac.DEFAULT,
                   data_source=pytac.DEFAULT):
         """Get the value for a field on the lattice.
@@ -216,8 +335,33 @@ class Lattice(object):
         Args:
             element (Element): element to append.
         """
+        element._parent_lattice = self
+        self._element_names.setdefault(element.name, []).append(
+            len(self._lattice))
         self._lattice.append(element)
 
+    def get_element(self, name):
+        """Get an element by name.
+
+        Elements are looked up by the name they had when they were added to
+        the lattice. If several elements have the name, the first in the ring
+        is returned.
+
+        Args:
+            name (str): The name of the element.
+
+        Returns:
+            Element: The element with the given name.
+
+        Raises:
+            ValueError: if there is no element with the given name.
+        """
+        for position in self._element_names.get(name, ()):
+            element = self[position]
+            if element.name == name:
+                return element
+        raise ValueError("No element named {0}.".format(name))
+
     def get_elements(self, family=None, cell=None):
         """Get the elements of a family from the lattice.
 
@@ -249,6 +393,9 @@ class Lattice(object):
             raise ValueError("No elements in cell {0}.".format(cell))
         return elements
 
+    def _get_loaded_elements(self):
+        return self._lattice
+
     def get_all_families(self):
         """Get all families of elements in the lattice.
 
@@ -288,7 +435,9 @@ class Lattice(object):
             field (str): field specifying the devices.
 
         Returns:
-            list: devices for specified family and field.
+            list: devices for specified family and field, with None for the
+                   elements that have no device data source, so that there is
+                   one entry for every element of the family.
         """
         elements = self.get_elements(family)
         devices = []
@@ -296,8 +445,7 @@ class Lattice(object):
             try:
                 devices.append(element.get_device(field))
             except DataSourceException:
-                print("No device for field {0} on element {1}.".format(field,
-                                                                       element))
+                devices.append(None)
         return devices
 
     def get_element_device_names(self, family, field):
@@ -313,12 +461,15 @@ class Lattice(object):
             field (str): field specifying the devices.
 
         Returns:
-            list: device names for specified family and field.
+            list: device names for specified family and field, with None for
+                   the elements without a device.
         """
         devices = self.get_element_devices(family, field)
-        return [device.name for device in devices]
+        return [None if device is None else device.name
+                for device in devices]
 
-    def get_element_values(self, family, field, handle, dtype=None):
+    def get_element_values(self, family, field, handle, dtype=None,
+                           masked=False, out=None):
         """Get all values for a family and field.
 
         Args:
@@ -327,16 +478,77 @@ class Lattice(object):
             handle (str): pytac.RB or pytac.SP.
             dtype (numpy.dtype): if None, return a list. If not None, return a
                                   numpy array of the specified type.
+            masked (bool): if True, return a numpy masked array with one entry
+                            for every element in the family. Elements whose
+                            value cannot be read or converted, for example
+                            because they lack the field or the read fails,
+                            are masked rather than raising. Any exception
+                            raised while reading an element masks it, as in
+                            EpicsLattice.get_values(), so the errors of
+                            control systems such as cothread's ca_nothing
+                            for a disconnected PV are masked too.
+            out (numpy.ndarray): if set, an array with one entry for every
+                                  element in the family to store the values
+                                  in, for example one reused between calls.
+                                  The dtype is then ignored. Not used if
+                                  masked.
 
         Returns:
-            list or numpy array: sequence of values.
+            list, numpy array or numpy masked array: sequence of values, in out
+                                                      if it is given.
+
+        Raises:
+            ValueError: if out does not have one entry for every element.
         """
         elements = self.get_elements(family)
+        if masked:
+            values = []
+            valid = []
+            for element in elements:
+                try:
+                    value = element.get_value(field, handle)
+                except Exception:
+                    value = None
+                values.append(value)
+                valid.append(utils.is_valid_value(value))
+            return masked_values(values, valid, dtype)
+        if out is not None:
+            if len(out) != len(elements):
+                raise ValueError("Output array has {0} entries for {1} "
+                                 "elements.".format(len(out), len(elements)))
+            for i, element in enumerate(elements):
+                out[i] = element.get_value(field, handle)
+            return out
         values = [element.get_value(field, handle) for element in elements]
         if dtype is not None:
             values = numpy.array(values, dtype=dtype)
         return values
 
+    def get_waveforms(self, family, field, handle=pytac.RB, samples=None,
+                      dtype=None, out=None):
+        """Get the waveforms of an array-valued field, such as turn-by-turn
+        BPM data, for all elements of a family.
+
+        Args:
+            family (str): family to request the values of.
+            field (str): field to request values for.
+            handle (str): pytac.RB or pytac.SP.
+            samples (int): The number of samples per element; see
+                            waveform_array().
+            dtype (numpy.dtype): The data type of the array, float64 if None.
+            out (numpy.ndarray): An array of shape (elements, samples) to
+                                  copy the waveforms into.
+
+        Returns:
+            numpy.ndarray: The waveform of each element, one per row.
+
+        Raises:
+            ValueError: if out does not have the expected shape.
+        """
+        values = [element.get_value(field, handle)
+                  for element in self.get_elements(family)]
+        return waveform_array(values, samples, dtype, out)
+
     def set_element_values(self, family, field, values):
         """Sets the values for a family and field.
 
@@ -372,8 +584,7 @@ class Lattice(object):
         """
         if default_units == pytac.ENG or default_units == pytac.PHYS:
             self._data_source_manager.default_units = default_units
-            elems = self.get_elements()
-            for elem in elems:
+            for elem in self._get_loaded_elements():
                 elem._data_source_manager.default_units = default_units
         elif default_units is not None:
             raise UnitsException("{0} is not a unit type. Please enter {1} or "
@@ -385,23 +596,42 @@ class Lattice(object):
 
         Args:
             default_data_source (str): The default data source to be set across
-                                        the entire lattice, pytac.LIVE or
-                                        pytac.SIM.
+                                        the entire lattice, pytac.LIVE,
+                                        pytac.SIM or pytac.ARCHIVE.
 
         Raises:
             DataSourceException: if specified default data source is not a valid
                                   data source.
         """
-        if default_data_source == pytac.LIVE or default_data_source == pytac.SIM:
+        if default_data_source in (pytac.LIVE, pytac.SIM, pytac.ARCHIVE):
             self._data_source_manager.default_data_source = default_data_source
-            elems = self.get_elements()
-            for elem in elems:
+            for elem in self._get_loaded_elements():
                 elem._data_source_manager.default_data_source = default_data_source
         elif default_data_source is not None:
             raise DataSourceException("{0} is not a data source. Please enter "
-                                      "{1} or {2}.".format(default_data_source,
-                                                           pytac.LIVE,
-                                                           pytac.SIM))
+                                      "{1}, {2} or {3}."
+                                      .format(default_data_source, pytac.LIVE,
+                                              pytac.SIM, pytac.ARCHIVE))
+
+    def set_replay_time(self, time):
+        """Set the time at which the archive data source replays values.
+
+        The archive is shared by the lattice and all its elements, so this
+        applies to every value read from pytac.ARCHIVE.
+
+        Args:
+            time (float): The replay time.
+
+        Raises:
+            DataSourceException: if there is no archive data source on the
+                                  lattice.
+        """
+        try:
+            data_source = self._data_source_manager._data_sources[pytac.ARCHIVE]
+        except KeyError:
+            raise DataSourceException("No data source {0} on lattice {1}."
+                                      .format(pytac.ARCHIVE, self))
+        data_source.set_replay_time(time)
 
     def get_default_units(self):
         """Get the default unit type, pytac.ENG or pytac.PHYS.
@@ -9,13 +9,17 @@ The csv files are stored in one directory with specified names:
  * uc_poly_data.csv
  * uc_pchip_data.csv
 
+Loading happens in two stages. First the files are parsed, concurrently,
+into tables: dictionaries holding a list of typed values for each column.
+Then the lattice is assembled from the tables.
 """
 from __future__ import print_function
 import os
 import csv
 import pytac
 import collections
-from pytac import epics, data_source, units, utils, device
+from concurrent.futures import ThreadPoolExecutor
+from pytac import epics, data_source, units, device
 from pytac.exceptions import ControlSystemException
 
 
@@ -29,6 +33,9 @@ UNITCONV_FILENAME = 'unitconv.csv'
 POLY_FILENAME = 'uc_poly_data.csv'
 PCHIP_FILENAME = 'uc_pchip_data.csv'
 
+# Families of magnets whose unit conversions include the beam rigidity.
+RIGIDITY_FAMILIES = ('HSTR', 'VSTR', 'QUAD', 'SEXT')
+
 
 def get_div_rigidity(energy):
     """
@@ -37,11 +44,7 @@ def get_div_rigidity(energy):
     Returns:
         function: div rigidity.
     """
-    rigidity = utils.rigidity(energy)
-
-    def div_rigidity(input):
-        return input / rigidity
-    return div_rigidity
+    return units.Rigidity(energy).div
 
 
 def get_mult_rigidity(energy):
@@ -51,11 +54,140 @@ def get_mult_rigidity(energy):
     Returns:
         function: mult rigidity.
     """
-    rigidity = utils.rigidity(energy)
+    return units.Rigidity(energy).mult
+
+
+def get_rigidity(lattice):
+    """Get the rigidity object shared by the unit conversions of a lattice.
+
+    Args:
+        lattice (Lattice): The lattice.
+
+    Returns:
+        Rigidity: The rigidity held by the energy device of the lattice, or a
+                   new one at the lattice energy if the device has none.
+    """
+    energy_device = lattice.get_device('energy')
+    if isinstance(energy_device, device.EnergyDevice):
+        return energy_device.rigidity
+    return units.Rigidity(lattice.get_value('energy'))
+
+
+def _optional_int(value):
+    return int(value) if value else None
+
+
+def _optional_str(value):
+    return value if value else None
+
+
+# The type of each column of each file; columns not listed are strings.
+TABLES = collections.OrderedDict([
+    ('elements', (ELEMENTS_FILENAME, {'id': int, 'length': float,
+                                      'cell': _optional_int})),
+    ('devices', (DEVICES_FILENAME, {'id': int, 'get_pv': _optional_str,
+                                    'set_pv': _optional_str})),
+    ('families', (FAMILIES_FILENAME, {'id': int})),
+    ('unitconv', (UNITCONV_FILENAME, {'el_id': int, 'uc_id': int})),
+    ('poly', (POLY_FILENAME, {'uc_id': int, 'coeff': int, 'val': float})),
+    ('pchip', (PCHIP_FILENAME, {'uc_id': int, 'eng': float, 'phy': float})),
+])
+# Tables that only exist for lattices with unit conversions.
+UNITCONV_TABLES = ('unitconv', 'poly', 'pchip')
+
+
+def read_table(filename, converters=None):
+    """Read a csv file into typed columns.
+
+    Args:
+        filename (path-like object): The pathname of the csv file.
+        converters (dict): A function converting the strings of each column;
+                            columns without one are left as strings.
+
+    Returns:
+        dict: A list of values for each column, keyed by the column header.
+    """
+    converters = converters or {}
+    with open(filename) as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader)
+        rows = list(csv_reader)
+    columns = zip(*rows) if rows else [()] * len(header)
+    table = {}
+    for name, column in zip(header, columns):
+        convert = converters.get(name)
+        table[name] = ([convert(value) for value in column] if convert
+                       else list(column))
+    return table
+
+
+def _rows(table, *names):
+    return zip(*[table[name] for name in names])
+
+
+def read_tables(directory, mode, parallel=False):
+    """Read all the csv files of a mode into tables.
+
+    The unit conversion files are only read if unitconv.csv exists.
+
+    Args:
+        directory (str): The directory where the data is stored.
+        mode (str): The name of the mode to be read.
+        parallel (bool): Whether to read the files concurrently. The files
+                          of the bundled lattices are too small for this to
+                          be faster, but it may help on slow file systems.
+
+    Returns:
+        dict: The table read from each file, keyed by the names in TABLES.
+    """
+    names = list(TABLES)
+    if not os.path.exists(os.path.join(directory, mode, UNITCONV_FILENAME)):
+        names = [name for name in names if name not in UNITCONV_TABLES]
+    args = [(os.path.join(directory, mode, TABLES[name][0]), TABLES[name][1])
+            for name in names]
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(args)) as executor:
+            tables = list(executor.map(lambda a: read_table(*a), args))
+    else:
+        tables = [read_table(*a) for a in args]
+    return dict(zip(names, tables))
+
+
+def build_poly_unitconvs(table):
+    """Build polynomial unit conversions from a table.
+
+    Args:
+        table (dict): The columns uc_id, coeff and val.
+
+    Returns:
+        dict: A PolyUnitConv for each uc_id.
+    """
+    data = collections.defaultdict(list)
+    for uc_id, coeff, val in _rows(table, 'uc_id', 'coeff', 'val'):
+        data[uc_id].append((coeff, val))
+    return dict((uc_id, units.PolyUnitConv([x[1] for x in
+                                            reversed(sorted(data[uc_id]))]))
+                for uc_id in data)
+
 
-    def mult_rigidity(input):
-        return input * rigidity
-    return mult_rigidity
+def build_pchip_unitconvs(table):
+    """Build pchip unit conversions from a table.
+
+    Args:
+        table (dict): The columns uc_id, eng and phy.
+
+    Returns:
+        dict: A PchipUnitConv for each uc_id.
+    """
+    data = collections.defaultdict(list)
+    for uc_id, eng, phy in _rows(table, 'uc_id', 'eng', 'phy'):
+        data[uc_id].append((eng, phy))
+    unitconvs = {}
+    for uc_id in data:
+        points = sorted(data[uc_id])
+        unitconvs[uc_id] = units.PchipUnitConv([x[0] for x in points],
+                                               [x[1] for x in points])
+    return unitconvs
 
 
 def load_poly_unitconv(filename):
@@ -68,18 +200,7 @@ def load_poly_unitconv(filename):
     Returns:
         dict: A dictionary of the unit conversions.
     """
-    unitconvs = {}
-    data = collections.defaultdict(list)
-    with open(filename) as poly:
-        csv_reader = csv.DictReader(poly)
-        for item in csv_reader:
-            data[(int(item['uc_id']))].append((int(item['coeff']),
-                                               float(item['val'])))
-    # Create PolyUnitConv for each item and put in the dict
-    for uc_id in data:
-        u = units.PolyUnitConv([x[1] for x in reversed(sorted(data[uc_id]))])
-        unitconvs[uc_id] = u
-    return unitconvs
+    return build_poly_unitconvs(read_table(filename, TABLES['poly'][1]))
 
 
 def load_pchip_unitconv(filename):
@@ -92,20 +213,32 @@ def load_pchip_unitconv(filename):
     Returns:
         dict: A dictionary of the unit conversions.
     """
+    return build_pchip_unitconvs(read_table(filename, TABLES['pchip'][1]))
+
+
+def add_unitconvs(lattice, tables):
+    """Add the unit conversion objects described by tables to the elements.
+
+    Args:
+        lattice (Lattice): The lattice object that will be used.
+        tables (dict): The unitconv, poly and pchip tables.
+    """
     unitconvs = {}
-    data = collections.defaultdict(list)
-    with open(filename) as pchip:
-        csv_reader = csv.DictReader(pchip)
-        for item in csv_reader:
-            data[(int(item['uc_id']))].append((float(item['eng']),
-                                               float(item['phy'])))
-    # Create PchipUnitConv for each item and put in the dict
-    for uc_id in data:
-        eng = [x[0] for x in sorted(data[uc_id])]
-        phy = [x[1] for x in sorted(data[uc_id])]
-        u = units.PchipUnitConv(eng, phy)
-        unitconvs[uc_id] = u
-    return unitconvs
+    unitconvs.update(build_poly_unitconvs(tables['poly']))
+    unitconvs.update(build_pchip_unitconvs(tables['pchip']))
+    rigidity = get_rigidity(lattice)
+    elements = dict((element.index, element) for element in lattice)
+    for el_id, field, uc_id in _rows(tables['unitconv'], 'el_id', 'field',
+                                     'uc_id'):
+        if el_id not in elements:
+            continue
+        element = elements[el_id]
+        # For certain magnet types, we need an additional rigidity
+        # conversion factor as well as the raw conversion.
+        if element.families.intersection(RIGIDITY_FAMILIES):
+            unitconvs[uc_id]._post_eng_to_phys = rigidity.div
+            unitconvs[uc_id]._pre_phys_to_eng = rigidity.mult
+        element._data_source_manager._uc[field] = unitconvs[uc_id]
 
 
 def load_unitconv(directory, mode, lattice):
@@ -116,27 +249,235 @@ def load_unitconv(directory, mode, lattice):
         mode (str): The name of the mode that is used.
         lattice(Lattice): The lattice object that will be used.
     """
-    unitconvs = {}
-    # Assemble datasets from the polynomial file
-    poly_file = os.path.join(directory, mode, POLY_FILENAME)
-    unitconvs.update(load_poly_unitconv(poly_file))
-    # Assemble datasets from the pchip file
-    pchip_file = os.path.join(directory, mode, PCHIP_FILENAME)
-    unitconvs.update(load_pchip_unitconv(pchip_file))
-    # Add the unitconv objects to the elements
-    with open(os.path.join(directory, mode, UNITCONV_FILENAME)) as unitconv:
-        csv_reader = csv.DictReader(unitconv)
-        for item in csv_reader:
-            element = lattice[int(item['el_id']) - 1]
+    tables = dict((name, read_table(os.path.join(directory, mode,
+                                                 TABLES[name][0]),
+                                    TABLES[name][1]))
+                  for name in UNITCONV_TABLES)
+    add_unitconvs(lattice, tables)
+
+
+def _group(table, key, *names):
+    groups = collections.defaultdict(list)
+    for row in _rows(table, key, *names):
+        groups[row[0]].append(row[1:])
+    return groups
+
+
+def _get_families(tables):
+    """The set of families of each element, including its type."""
+    families = [set([type_]) for type_ in tables['elements']['type']]
+    index = dict((id_, i) for i, id_ in enumerate(tables['elements']['id']))
+    for id_, family in _rows(tables['families'], 'id', 'family'):
+        if id_ in index:
+            families[index[id_]].add(family)
+    return families
+
+
+def _get_element_devices(tables):
+    """The devices of the elements, with the index of each element in the
+    ring.
+    """
+    index = dict((id_, i) for i, id_ in enumerate(tables['elements']['id']))
+    devices = []
+    for row in _rows(tables['devices'], 'id', 'name', 'field', 'get_pv',
+                     'set_pv'):
+        if row[0] in index:
+            devices.append((index[row[0]],) + tuple(row[1:]))
+    return devices
+
+
+def _element_builder(control_system, tables, positions, rigidity):
+    """Get a function building the element in each row of the elements table.
+
+    Unit conversion objects are built the first time they are needed and are
+    shared by all the elements that use them.
+    """
+    devices = _group(tables['devices'], 'id', 'name', 'field', 'get_pv',
+                     'set_pv')
+    families = _group(tables['families'], 'id', 'family')
+    elements = list(_rows(tables['elements'], 'id', 'name', 'type', 'length',
+                          'cell'))
+    fields = {}
+    poly = {}
+    pchip = {}
+    rigidity_ucs = set()
+    if 'unitconv' in tables:
+        fields = _group(tables['unitconv'], 'el_id', 'field', 'uc_id')
+        poly = _group(tables['poly'], 'uc_id', 'coeff', 'val')
+        pchip = _group(tables['pchip'], 'uc_id', 'eng', 'phy')
+        element_families = zip(tables['elements']['id'],
+                               _get_families(tables))
+        for id_, families_ in element_families:
             # For certain magnet types, we need an additional rigidity
             # conversion factor as well as the raw conversion.
-            if element.families.intersection(('HSTR', 'VSTR', 'QUAD', 'SEXT')):
-                unitconvs[int(item['uc_id'])]._post_eng_to_phys = get_div_rigidity(lattice.get_value('energy'))
-                unitconvs[int(item['uc_id'])]._pre_phys_to_eng = get_mult_rigidity(lattice.get_value('energy'))
-            element._data_source_manager._uc[item['field']] = unitconvs[int(item['uc_id'])]
+            if families_.intersection(RIGIDITY_FAMILIES):
+                rigidity_ucs.update(uc_id for _, uc_id in fields[id_])
+    unitconvs = {}
+
+    def get_unitconv(uc_id):
+        if uc_id not in unitconvs:
+            if uc_id in pchip:
+                points = sorted(pchip[uc_id])
+                uc = units.PchipUnitConv([x[0] for x in points],
+                                         [x[1] for x in points])
+            elif uc_id in poly:
+                uc = units.PolyUnitConv([x[1] for x in
+                                         reversed(sorted(poly[uc_id]))])
+            else:
+                raise KeyError("No unit conversion with uc_id {0}."
+                               .format(uc_id))
+            if uc_id in rigidity_ucs:
+                uc._post_eng_to_phys = rigidity.div
+                uc._pre_phys_to_eng = rigidity.mult
+            unitconvs[uc_id] = uc
+        return unitconvs[uc_id]
+
+    def build_element(index):
+        id_, name, type_, length, cell = elements[index]
+        e = epics.EpicsElement(name, length, type_, positions[index], id_,
+                               cell)
+        e.add_to_family(type_)
+        e.set_data_source(data_source.DeviceDataSource(), pytac.LIVE)
+        for device_name, field, get_pv, set_pv in devices[id_]:
+            pve = True
+            d = epics.EpicsDevice(device_name, control_system, pve, get_pv,
+                                  set_pv)
+            e.add_device(field, d, DEFAULT_UC)
+        for family, in families[id_]:
+            e.add_to_family(family)
+        for field, uc_id in fields.get(id_, ()):
+            e._data_source_manager._uc[field] = get_unitconv(uc_id)
+        return e
+    return build_element
+
+
+def build_lattice(mode, control_system, tables, lazy=False):
+    """Assemble a lattice from tables.
+
+    The element ids are used as their indices in the ring. If the elements
+    table has an 's' column the elements may be a subset of the ring, and
+    rows of the other tables that refer to missing elements are ignored.
+    Otherwise s positions are accumulated from the element lengths.
+
+    Args:
+        mode (str): The name of the lattice.
+        control_system (ControlSystem): The control system to be used.
+        tables (dict): The tables returned by read_tables.
+        lazy (bool): If True, return a LazyEpicsLattice which only builds
+                      elements, their devices and unit conversions when they
+                      are first used.
+
+    Returns:
+        Lattice: The lattice containing all elements.
+    """
+    positions = tables['elements'].get('s')
+    if positions is None:
+        positions = []
+        s = 0.0
+        for length in tables['elements']['length']:
+            positions.append(s)
+            s += length
+    rigidity = units.Rigidity(3000)
+    build_element = _element_builder(control_system, tables, positions,
+                                     rigidity)
+    if lazy:
+        lat = epics.LazyEpicsLattice(mode, control_system, build_element,
+                                     _get_families(tables),
+                                     tables['elements']['cell'],
+                                     tables['elements']['length'],
+                                     tables['elements']['name'],
+                                     _get_element_devices(tables))
+    else:
+        lat = epics.EpicsLattice(mode, control_system)
+    lat.set_data_source(data_source.DeviceDataSource(), pytac.LIVE)
+    # Devices on index 0 are attached to the lattice not elements.
+    for id_, name, field, get_pv, set_pv in _rows(tables['devices'], 'id',
+                                                  'name', 'field', 'get_pv',
+                                                  'set_pv'):
+        if id_ == 0:
+            pve = True
+            d = epics.EpicsDevice(name, control_system, pve, get_pv, set_pv)
+            lat.add_device(field, d, DEFAULT_UC)
+    # Add basic devices to the lattice.
+    lat.add_device('s_position', device.BasicDevice(list(positions)),
+                   DEFAULT_UC)
+    # The unit conversions of the magnets share the rigidity held by the
+    # energy device, so setting the energy rescales them.
+    lat.add_device('energy', device.EnergyDevice(rigidity), DEFAULT_UC)
+    if not lazy:
+        for index in range(len(positions)):
+            lat.add_element(build_element(index))
+    return lat
+
+
+def get_tables(lattice):
+    """Get the tables describing a loaded lattice.
+
+    This is the inverse of build_lattice: building a lattice from the tables
+    gives the same elements, families, devices and unit conversions. Unit
+    conversion objects shared by several fields are described once. The
+    lattice devices s_position and energy are not included.
 
+    Args:
+        lattice (EpicsLattice): The lattice, which is fully loaded.
+
+    Returns:
+        dict: The tables, in the form returned by read_tables with an
+               additional 's' column of element positions.
+    """
+    columns = {'elements': ('id', 'name', 'type', 'length', 'cell', 's'),
+               'devices': ('id', 'name', 'field', 'get_pv', 'set_pv'),
+               'families': ('id', 'family'),
+               'unitconv': ('el_id', 'field', 'uc_type', 'uc_id'),
+               'poly': ('uc_id', 'coeff', 'val'),
+               'pchip': ('uc_id', 'eng', 'phy')}
+    tables = dict((name, dict((column, []) for column in table_columns))
+                  for name, table_columns in columns.items())
+
+    def add_row(table, **row):
+        for column, value in row.items():
+            tables[table][column].append(value)
+
+    def add_devices(id_, manager):
+        devices = manager._data_sources[pytac.LIVE]._devices
+        for field, d in sorted(devices.items()):
+            if isinstance(d, epics.EpicsDevice):
+                add_row('devices', id=id_, name=d.name, field=field,
+                        get_pv=d.rb_pv, set_pv=d.sp_pv)
+    add_devices(0, lattice._data_source_manager)
+    uc_ids = {}
+    for element in lattice:
+        id_ = element.index
+        add_row('elements', id=id_, name=element.name, type=element.type_,
+                length=element.length, cell=element.cell, s=element.s)
+        add_devices(id_, element._data_source_manager)
+        for family in sorted(element.families - set([element.type_])):
+            add_row('families', id=id_, family=family)
+        for field, uc in sorted(element._data_source_manager._uc.items()):
+            if isinstance(uc, units.PolyUnitConv):
+                uc_type = 'poly'
+            elif isinstance(uc, units.PchipUnitConv):
+                uc_type = 'pchip'
+            else:
+                continue
+            if id(uc) not in uc_ids:
+                uc_id = uc_ids[id(uc)] = len(uc_ids) + 1
+                if uc_type == 'poly':
+                    coeffs = uc.p.coeffs
+                    for i, val in enumerate(coeffs):
+                        add_row('poly', uc_id=uc_id, coeff=len(coeffs) - 1 - i,
+                                val=float(val))
+                else:
+                    for eng, phy in zip(uc.x, uc.y):
+                        add_row('pchip', uc_id=uc_id, eng=float(eng),
+                                phy=float(phy))
+            add_row('unitconv', el_id=id_, field=field, uc_type=uc_type,
+                    uc_id=uc_ids[id(uc)])
+    return tables
 
-def load(mode, control_system=None, directory=None):
+
+def load(mode, control_system=None, directory=None, parallel=False,
+         lazy=False, prewarm=False):
     """Load the elements of a lattice from a directory.
 
     Args:
@@ -147,6 +488,11 @@ def load(mode, control_system=None, directory=None):
         directory (str): Directory where to load the files from. If no
                           directory is given the data directory at the root of
                           the repository is used.
+        parallel (bool): Whether to read the csv files concurrently; see
+                          read_tables().
+        lazy (bool): If True, only build elements when they are first used.
+        prewarm (bool): If True, start connecting to all the PVs of the lattice
+                         in the background; see EpicsLattice.prewarm().
 
     Returns:
         Lattice: The lattice containing all elements.
@@ -168,46 +514,8 @@ def load(mode, control_system=None, directory=None):
     if directory is None:
         directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                  'data')
-    lat = epics.EpicsLattice(mode, control_system)
-    lat.set_data_source(data_source.DeviceDataSource(), pytac.LIVE)
-    s = 0.0
-    index = 1
-    with open(os.path.join(directory, mode, ELEMENTS_FILENAME)) as elements:
-        csv_reader = csv.DictReader(elements)
-        for item in csv_reader:
-            length = float(item['length'])
-            cell = int(item['cell']) if item['cell'] else None
-            e = epics.EpicsElement(item['name'], length, item['type'], s, index,
-                                   cell)
-            e.add_to_family(item['type'])
-            e.set_data_source(data_source.DeviceDataSource(), pytac.LIVE)
-            lat.add_element(e)
-            s += length
-            index += 1
-    with open(os.path.join(directory, mode, DEVICES_FILENAME)) as devices:
-        csv_reader = csv.DictReader(devices)
-        for item in csv_reader:
-            name = item['name']
-            get_pv = item['get_pv'] if item['get_pv'] else None
-            set_pv = item['set_pv'] if item['set_pv'] else None
-            pve = True
-            d = epics.EpicsDevice(name, control_system, pve, get_pv, set_pv)
-            # Devices on index 0 are attached to the lattice not elements.
-            if int(item['id']) == 0:
-                lat.add_device(item['field'], d, DEFAULT_UC)
-            else:
-                lat[int(item['id']) - 1].add_device(item['field'], d,
-                                                    DEFAULT_UC)
-        # Add basic devices to the lattice.
-        positions = []
-        for elem in lat:
-            positions.append(elem.s)
-        lat.add_device('s_position', device.BasicDevice(positions), DEFAULT_UC)
-        lat.add_device('energy', device.BasicDevice(3000), DEFAULT_UC)
-    with open(os.path.join(directory, mode, FAMILIES_FILENAME)) as families:
-        csv_reader = csv.DictReader(families)
-        for item in csv_reader:
-            lat[int(item['id']) - 1].add_to_family(item['family'])
-    if os.path.exists(os.path.join(directory, mode, UNITCONV_FILENAME)):
-        load_unitconv(directory, mode, lat)
+    lat = build_lattice(mode, control_system,
+                        read_tables(directory, mode, parallel), lazy)
+    if prewarm:
+        lat.prewarm()
     return lat
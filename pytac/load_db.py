@@ -0,0 +1,334 @@
+"""Module to load the elements of the machine from a single SQLite file.
+
+The database holds the same tables as the csv files read by load_csv, for
+any number of modes, with indexes on element id, family, field and PV name.
+Each distinct table is stored once and shared by all the modes that use it,
+so near-identical modes such as VMX and VMXSP cost little extra space.
+
+The csv files remain the source of truth: csv_to_db builds a database from
+a csv data directory and db_to_csv writes it back out in the same layout.
+The original text of the real-valued cells is stored alongside their values,
+so that the files written out are identical to the files read in.
+"""
+import csv
+import hashlib
+import os
+import sqlite3
+from pytac import load_csv
+from pytac.exceptions import ControlSystemException, DataSourceException
+
+
+# The columns of each table, in the order they appear in the csv files.
+COLUMNS = {
+    'elements': ('id', 'name', 'type', 'length', 'cell'),
+    'devices': ('id', 'name', 'field', 'get_pv', 'set_pv'),
+    'families': ('id', 'family'),
+    'unitconv': ('el_id', 'field', 'uc_type', 'uc_id'),
+    'poly': ('uc_id', 'coeff', 'val'),
+    'pchip': ('uc_id', 'eng', 'phy'),
+}
+
+# The real-valued columns of each table, whose text is also stored.
+TEXT_COLUMNS = {
+    'elements': ('length',),
+    'poly': ('val',),
+    'pchip': ('eng', 'phy'),
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS modes (
+    mode TEXT, name TEXT, content INTEGER, PRIMARY KEY (mode, name));
+CREATE TABLE IF NOT EXISTS contents (
+    content INTEGER PRIMARY KEY, name TEXT, digest TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS elements (
+    content INTEGER, row INTEGER, id INTEGER, name TEXT, type TEXT,
+    length REAL, cell INTEGER, s REAL, length_text TEXT);
+CREATE TABLE IF NOT EXISTS devices (
+    content INTEGER, row INTEGER, id INTEGER, name TEXT, field TEXT,
+    get_pv TEXT, set_pv TEXT);
+CREATE TABLE IF NOT EXISTS families (
+    content INTEGER, row INTEGER, id INTEGER, family TEXT);
+CREATE TABLE IF NOT EXISTS unitconv (
+    content INTEGER, row INTEGER, el_id INTEGER, field TEXT, uc_type TEXT,
+    uc_id INTEGER);
+CREATE TABLE IF NOT EXISTS poly (
+    content INTEGER, row INTEGER, uc_id INTEGER, coeff INTEGER, val REAL,
+    val_text TEXT);
+CREATE TABLE IF NOT EXISTS pchip (
+    content INTEGER, row INTEGER, uc_id INTEGER, eng REAL, phy REAL,
+    eng_text TEXT, phy_text TEXT);
+CREATE INDEX IF NOT EXISTS elements_id ON elements (content, id);
+CREATE INDEX IF NOT EXISTS elements_type ON elements (content, type);
+CREATE INDEX IF NOT EXISTS devices_id ON devices (content, id);
+CREATE INDEX IF NOT EXISTS devices_field ON devices (content, field);
+CREATE INDEX IF NOT EXISTS devices_get_pv ON devices (get_pv);
+CREATE INDEX IF NOT EXISTS devices_set_pv ON devices (set_pv);
+CREATE INDEX IF NOT EXISTS families_id ON families (content, id);
+CREATE INDEX IF NOT EXISTS families_family ON families (content, family);
+CREATE INDEX IF NOT EXISTS unitconv_el_id ON unitconv (content, el_id);
+CREATE INDEX IF NOT EXISTS poly_uc_id ON poly (content, uc_id);
+CREATE INDEX IF NOT EXISTS pchip_uc_id ON pchip (content, uc_id);
+'''
+
+
+def _columns(name):
+    if name == 'elements':
+        return COLUMNS[name] + ('s',)
+    return COLUMNS[name]
+
+
+def _text_columns(name):
+    return tuple(column + '_text' for column in TEXT_COLUMNS.get(name, ()))
+
+
+def _stored_columns(name):
+    return _columns(name) + _text_columns(name)
+
+
+def _digest(name, table):
+    data = repr([name] + [table[column] for column in _stored_columns(name)])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _store_table(connection, mode, name, table):
+    digest = _digest(name, table)
+    row = connection.execute('SELECT content FROM contents WHERE digest = ?',
+                             (digest,)).fetchone()
+    if row is None:
+        content = connection.execute('INSERT INTO contents (name, digest) '
+                                     'VALUES (?, ?)',
+                                     (name, digest)).lastrowid
+        columns = _stored_columns(name)
+        rows = zip(*[table[column] for column in columns])
+        connection.executemany(
+            'INSERT INTO {0} (content, row, {1}) VALUES (?, ?, {2})'
+            .format(name, ', '.join(columns), ', '.join('?' * len(columns))),
+            ((content, i) + tuple(r) for i, r in enumerate(rows)))
+    else:
+        content = row[0]
+    connection.execute('INSERT OR REPLACE INTO modes VALUES (?, ?, ?)',
+                       (mode, name, content))
+
+
+def csv_to_db(directory, db_file, modes=None):
+    """Store the csv files of one or more modes in a database.
+
+    Modes already in the database are replaced.
+
+    Args:
+        directory (str): The csv data directory, containing a directory for
+                          each mode.
+        db_file (str): The database file, created if it does not exist.
+        modes (sequence): The modes to store. Defaults to every directory
+                           containing an elements.csv file.
+    """
+    if modes is None:
+        modes = sorted(m for m in os.listdir(directory)
+                       if os.path.exists(os.path.join(
+                           directory, m, load_csv.ELEMENTS_FILENAME)))
+    connection = sqlite3.connect(db_file)
+    try:
+        with connection:
+            connection.executescript(SCHEMA)
+            for mode in modes:
+                tables = load_csv.read_tables(directory, mode)
+                s = 0.0
+                positions = []
+                for length in tables['elements']['length']:
+                    positions.append(s)
+                    s += length
+                tables['elements']['s'] = positions
+                for name, columns in TEXT_COLUMNS.items():
+                    if name not in tables:
+                        continue
+                    text = load_csv.read_table(os.path.join(
+                        directory, mode, load_csv.TABLES[name][0]))
+                    for column in columns:
+                        tables[name][column + '_text'] = text[column]
+                connection.execute('DELETE FROM modes WHERE mode = ?',
+                                   (mode,))
+                for name, table in tables.items():
+                    _store_table(connection, mode, name, table)
+    finally:
+        connection.close()
+
+
+def get_modes(db_file):
+    """Get the modes stored in a database.
+
+    Args:
+        db_file (str): The database file.
+
+    Returns:
+        list: The names of the modes.
+    """
+    connection = sqlite3.connect(db_file)
+    try:
+        return [row[0] for row in
+                connection.execute('SELECT DISTINCT mode FROM modes '
+                                   'ORDER BY mode')]
+    finally:
+        connection.close()
+
+
+def _select(connection, name, content, where='', args=(), columns=None):
+    if columns is None:
+        columns = _columns(name)
+    rows = connection.execute('SELECT {0} FROM {1} WHERE content = ? {2} '
+                              'ORDER BY row'.format(', '.join(columns), name,
+                                                    where),
+                              (content,) + tuple(args)).fetchall()
+    columns_data = zip(*rows) if rows else [()] * len(columns)
+    return dict((column, list(data))
+                for column, data in zip(columns, columns_data))
+
+
+def _get_contents(connection, mode, db_file):
+    """Get the content id of each table of a mode."""
+    contents = dict(connection.execute('SELECT name, content FROM modes '
+                                       'WHERE mode = ?', (mode,)))
+    if not contents:
+        raise DataSourceException("No mode {0} in database {1}."
+                                  .format(mode, db_file))
+    return contents
+
+
+def read_tables(db_file, mode, families=None):
+    """Read the tables of a mode from a database.
+
+    Args:
+        db_file (str): The database file.
+        mode (str): The name of the mode to be read.
+        families (sequence): If given, only read the elements that are in at
+                              least one of these families, together with the
+                              devices, families and unit conversions of those
+                              elements. Lattice devices are always read.
+
+    Returns:
+        dict: The tables, in the form returned by load_csv.read_tables with an
+               additional 's' column of element positions.
+
+    Raises:
+        DataSourceException: if the mode is not in the database.
+    """
+    connection = sqlite3.connect(db_file)
+    try:
+        contents = _get_contents(connection, mode, db_file)
+        if families is None:
+            return dict((name, _select(connection, name, content))
+                        for name, content in contents.items())
+        families = list(families)
+        marks = ', '.join('?' * len(families))
+        args = [contents['elements']] + families
+        args += [contents['families']] + families
+        ids = set(row[0] for row in connection.execute(
+            'SELECT id FROM elements WHERE content = ? AND type IN ({0}) '
+            'UNION SELECT id FROM families WHERE content = ? AND family IN '
+            '({0})'.format(marks), args))
+        connection.execute('CREATE TEMP TABLE selected (id INTEGER PRIMARY '
+                           'KEY)')
+        connection.executemany('INSERT INTO selected VALUES (?)',
+                               ((id_,) for id_ in ids))
+        in_selected = 'AND {0} IN (SELECT id FROM selected)'
+        tables = {
+            'elements': _select(connection, 'elements', contents['elements'],
+                                in_selected.format('id')),
+            'devices': _select(connection, 'devices', contents['devices'],
+                               'AND (id = 0 OR id IN (SELECT id FROM '
+                               'selected))'),
+            'families': _select(connection, 'families', contents['families'],
+                                in_selected.format('id')),
+        }
+        if 'unitconv' in contents:
+            tables['unitconv'] = _select(connection, 'unitconv',
+                                         contents['unitconv'],
+                                         in_selected.format('el_id'))
+            uc_ids = ('AND uc_id IN (SELECT uc_id FROM unitconv WHERE '
+                      'content = ? {0})'.format(in_selected.format('el_id')))
+            for name in ('poly', 'pchip'):
+                tables[name] = _select(connection, name, contents[name],
+                                       uc_ids, (contents['unitconv'],))
+        return tables
+    finally:
+        connection.close()
+
+
+def db_to_csv(db_file, directory, modes=None):
+    """Write modes from a database back to csv files.
+
+    Real values are written with the text they were read from, so the csv
+    files a database was built from are reproduced exactly.
+
+    Args:
+        db_file (str): The database file.
+        directory (str): The csv data directory to write a directory for each
+                          mode in.
+        modes (sequence): The modes to write. Defaults to all of them.
+
+    Raises:
+        DataSourceException: if a mode is not in the database.
+    """
+    if modes is None:
+        modes = get_modes(db_file)
+    connection = sqlite3.connect(db_file)
+    try:
+        for mode in modes:
+            mode_dir = os.path.join(directory, mode)
+            if not os.path.exists(mode_dir):
+                os.makedirs(mode_dir)
+            contents = _get_contents(connection, mode, db_file)
+            for name, content in contents.items():
+                table = _select(connection, name, content,
+                                columns=_stored_columns(name))
+                for column in TEXT_COLUMNS.get(name, ()):
+                    table[column] = table[column + '_text']
+                filename = load_csv.TABLES[name][0]
+                with open(os.path.join(mode_dir, filename), 'w') as csv_file:
+                    csv_writer = csv.writer(csv_file, lineterminator='\n')
+                    csv_writer.writerow(COLUMNS[name])
+                    for row in zip(*[table[c] for c in COLUMNS[name]]):
+                        csv_writer.writerow(['' if v is None else v
+                                             for v in row])
+    finally:
+        connection.close()
+
+
+def load(mode, db_file, control_system=None, families=None, lazy=False,
+         prewarm=False):
+    """Load the elements of a lattice from a database.
+
+    Args:
+        mode (str): The name of the mode to be loaded.
+        db_file (str): The database file, as written by csv_to_db.
+        control_system (ControlSystem): The control system to be used. If none
+                                         is provided an EpicsControlSystem will
+                                         be created.
+        families (sequence): If given, only load the elements in at least one
+                              of these families.
+        lazy (bool): If True, only build elements when they are first used.
+        prewarm (bool): If True, start connecting to all the PVs of the lattice
+                         in the background; see EpicsLattice.prewarm().
+
+    Returns:
+        Lattice: The lattice containing the elements.
+
+    Raises:
+        ControlSystemException: if the default control system, cothread, is not
+                                 installed.
+        DataSourceException: if the mode is not in the database.
+    """
+    try:
+        if control_system is None:
+            # Don't import epics unless we need it to avoid unnecessary
+            # installation of cothread
+            from pytac import cothread_cs
+            control_system = cothread_cs.CothreadControlSystem()
+    except ImportError:
+        raise ControlSystemException("Please install cothread to load a lattice"
+                                     "using the default control system (found "
+                                     "in cothread_cs.py).")
+    lattice = load_csv.build_lattice(mode, control_system,
+                                     read_tables(db_file, mode, families), lazy)
+    if prewarm:
+        lattice.prewarm()
+    return lattice
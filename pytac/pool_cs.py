@@ -0,0 +1,138 @@
+"""Control system wrapper batching a control system that reads one PV at a
+time.
+
+EpicsLattice reads and writes all the PVs of a family in one call, by
+passing a list of PVs to the control system. A control system that only
+handles single PVs can be wrapped in a ThreadPoolControlSystem, which splits
+lists of PVs into single requests made concurrently on a bounded pool of
+threads and gathers the results back in order.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from pytac import utils
+from pytac.cs import ControlSystem
+from pytac.exceptions import ControlSystemException
+
+
+class ThreadPoolControlSystem(ControlSystem):
+    """Control system wrapper making the requests for lists of PVs
+    concurrently.
+
+    A timeout is a deadline for a whole request, however many PVs it has,
+    not a limit on each call to the wrapped control system. Requests for
+    single PVs are passed straight to the wrapped control system when there
+    is no timeout, and made on the pool otherwise. Requests that time out
+    are abandoned rather than interrupted, so they keep their thread until
+    the wrapped control system returns.
+
+    **Attributes:**
+
+    Attributes:
+        max_workers (int): The largest number of requests made at once.
+        timeout (float): The default time in seconds to wait for all the PVs
+                          of a request, or None to wait indefinitely.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The wrapped control system.
+           _executor (ThreadPoolExecutor): The pool of threads.
+    """
+    def __init__(self, cs, max_workers=8, timeout=None):
+        """
+        Args:
+            cs (ControlSystem): The control system to wrap, which only needs
+                                 to handle single PVs.
+            max_workers (int): The largest number of requests made at once.
+            timeout (float): The default time in seconds to wait for all the
+                              PVs of a request together, or None to wait
+                              indefinitely.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _gather(self, pvs, futures, timeout):
+        done, not_done = wait(futures, timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            late = [pv for pv, future in zip(pvs, futures)
+                    if future in not_done]
+            raise ControlSystemException("Timed out after {0} s waiting for "
+                                         "PVs {1}.".format(timeout, late))
+        return [future.result() for future in futures]
+
+    def get(self, pv, timeout=None):
+        """Get the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to get the value of.
+            timeout (float): The time in seconds to wait for all the PVs
+                              together, if not the default timeout.
+
+        Returns:
+            object: The value of a single PV, or a list of the values of the
+                     PVs in the same order.
+
+        Raises:
+            ControlSystemException: if the PVs are not all read in time.
+            Exception: the first error raised by the wrapped control system,
+                        in the order of the PVs.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(pv, utils.string_types):
+            if timeout is None:
+                return self._cs.get(pv)
+            return self._gather([pv], [self._executor.submit(self._cs.get,
+                                                             pv)],
+                                timeout)[0]
+        pvs = list(pv)
+        futures = [self._executor.submit(self._cs.get, p) for p in pvs]
+        return self._gather(pvs, futures, timeout)
+
+    def put(self, pv, value, timeout=None):
+        """Put the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value, or a sequence with the value of each
+                             PV.
+            timeout (float): The time in seconds to wait for all the PVs
+                              together, if not the default timeout.
+
+        Raises:
+            ValueError: if the number of values differs from the number of
+                         PVs.
+            ControlSystemException: if the PVs are not all written in time.
+            Exception: the first error raised by the wrapped control system,
+                        in the order of the PVs.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(pv, utils.string_types):
+            if timeout is None:
+                self._cs.put(pv, value)
+            else:
+                self._gather([pv], [self._executor.submit(self._cs.put, pv,
+                                                          value)], timeout)
+            return
+        pvs = list(pv)
+        value = list(value)
+        if len(value) != len(pvs):
+            raise ValueError("Got {0} values for {1} PVs."
+                             .format(len(value), len(pvs)))
+        futures = [self._executor.submit(self._cs.put, p, v)
+                   for p, v in zip(pvs, value)]
+        self._gather(pvs, futures, timeout)
+
+    def close(self):
+        """Stop the threads once the requests already made are done."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,124 @@
+"""Connect to the PVs of a lattice in the background.
+
+Control systems such as channel access only connect to a PV the first time
+it is used, so the first read of each family is slow. A Prewarmer connects
+to a list of PVs in chunks on a background thread, recording which PVs
+connected, so that the first cycle of a feedback process sees connected
+channels. Lattices start one with EpicsLattice.prewarm(), or when loaded
+with prewarm=True.
+"""
+import threading
+
+
+class Prewarmer(object):
+    """Connects to PVs in chunks on a background thread.
+
+    **Attributes:**
+
+    Attributes:
+        pvs (list): The PVs to connect to.
+        chunk_size (int): The number of PVs connected to at once.
+        timeout (float): The time in seconds to wait for the connections of
+                          each chunk, or None for the control system default.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The control system connecting to the PVs.
+           _callback (callable): Called with the number of PVs done and the
+                                  total after each chunk.
+           _status (dict): Whether each PV done so far connected.
+           _lock (threading.Lock): Protects _status.
+           _thread (threading.Thread): The background thread, if started.
+           _done (threading.Event): Set when all the PVs are done.
+    """
+    def __init__(self, cs, pvs, chunk_size=200, timeout=None, callback=None):
+        """
+        Args:
+            cs (ControlSystem): The control system connecting to the PVs.
+            pvs (sequence): The PVs to connect to.
+            chunk_size (int): The number of PVs connected to at once.
+            timeout (float): The time in seconds to wait for the connections
+                              of each chunk, or None for the control system
+                              default.
+            callback (callable): Called with the number of PVs done and the
+                                  total after each chunk.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self.pvs = list(pvs)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._callback = callback
+        self._status = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._done = threading.Event()
+
+    def run(self):
+        """Connect to the PVs in the calling thread."""
+        total = len(self.pvs)
+        for start in range(0, total, self.chunk_size):
+            chunk = self.pvs[start:start + self.chunk_size]
+            try:
+                connected = self._cs.connect(chunk, self.timeout)
+            except Exception:
+                connected = [False] * len(chunk)
+            with self._lock:
+                self._status.update(zip(chunk, connected))
+            if self._callback is not None:
+                self._callback(min(start + self.chunk_size, total), total)
+        self._done.set()
+
+    def start(self):
+        """Start connecting to the PVs in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for all the PVs to be done.
+
+        Args:
+            timeout (float): The longest time in seconds to wait, or None to
+                              wait indefinitely.
+
+        Returns:
+            bool: True if all the PVs are done.
+        """
+        return self._done.wait(timeout)
+
+    def is_done(self):
+        """Whether all the PVs are done.
+
+        Returns:
+            bool: True if all the PVs are done.
+        """
+        return self._done.is_set()
+
+    def get_progress(self):
+        """Get the number of PVs done so far.
+
+        Returns:
+            tuple: The number of PVs done and the total number of PVs.
+        """
+        with self._lock:
+            return len(self._status), len(self.pvs)
+
+    def get_status(self):
+        """Get whether each PV done so far connected.
+
+        Returns:
+            dict: True or False for each PV done so far.
+        """
+        with self._lock:
+            return dict(self._status)
+
+    def get_failed(self):
+        """Get the PVs that failed to connect so far.
+
+        Returns:
+            list: The PVs that failed, in the order they were given.
+        """
+        status = self.get_status()
+        return [pv for pv in self.pvs if status.get(pv) is False]
@@ -0,0 +1,345 @@
+"""Control system wrapper scheduling requests by priority.
+
+Services often share one control system between latency-critical feedback
+reads and bulk background work such as snapshots. A PriorityControlSystem
+splits each request into chunks of a bounded number of PVs and queues them
+by priority class. A single dispatcher thread always serves the most urgent
+class with chunks waiting, and takes turns between the requests of a class
+one chunk at a time. A large background request therefore delays an urgent
+one by at most one chunk.
+
+Each caller can be given a view of the scheduler with its own priority,
+which is used as the control system of a lattice:
+
+    scheduler = PriorityControlSystem(cs)
+    feedback_lattice.set_control_system(scheduler.get_view(HIGH))
+    snapshot_lattice.set_control_system(scheduler.get_view(LOW))
+
+The wrapped control system is only called by the dispatcher thread, through
+its run() method, so a control system that must be used from one thread,
+such as the cothread one, makes its calls on that thread.
+"""
+import collections
+import threading
+import time
+from pytac import utils
+from pytac.cs import ControlSystem
+
+
+# Priority classes; lower values are served first.
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# time.monotonic is not available in Python 2.7.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class _Request(object):
+    """A get or put of a list of PVs, split into chunks."""
+    def __init__(self, get, pvs, values, chunk_size):
+        self.get = get
+        self.pvs = pvs
+        self.values = values
+        self.results = [None] * len(pvs)
+        self.chunks = collections.deque(
+            (start, min(start + chunk_size, len(pvs)))
+            for start in range(0, len(pvs), chunk_size))
+        self.remaining = len(self.chunks)
+        self.error = None
+        self.submitted = _clock()
+        self.started = None
+        self.done = threading.Event()
+
+
+class _Metrics(object):
+    """Counts and times of the requests of a priority class."""
+    def __init__(self):
+        self.requests = 0
+        self.chunks = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+
+class PriorityControlSystem(ControlSystem):
+    """Control system wrapper serving requests in order of priority.
+
+    **Attributes:**
+
+    Attributes:
+        chunk_size (int): The largest number of PVs requested at once.
+        default_priority (int): The priority of requests made without one.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The wrapped control system.
+           _queues (dict): A deque of the requests with chunks waiting, for
+                            each priority.
+           _metrics (dict): The _Metrics of each priority.
+           _condition (threading.Condition): Protects the queues and metrics
+                                              and wakes the dispatcher.
+           _thread (threading.Thread): The dispatcher thread, started by the
+                                        first request.
+           _stopping (bool): Set to stop the dispatcher once the queues are
+                              empty.
+    """
+    def __init__(self, cs, chunk_size=50, default_priority=NORMAL):
+        """
+        Args:
+            cs (ControlSystem): The control system to wrap.
+            chunk_size (int): The largest number of PVs requested at once.
+            default_priority (int): The priority of requests made without
+                                     one.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self.chunk_size = chunk_size
+        self.default_priority = default_priority
+        self._queues = collections.defaultdict(collections.deque)
+        self._metrics = collections.defaultdict(_Metrics)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def _next_chunk(self):
+        """Wait for the next chunk to serve, or return None once stopped."""
+        with self._condition:
+            while not any(self._queues.values()):
+                if self._stopping:
+                    return None
+                self._condition.wait()
+            priority = min(p for p, queue in self._queues.items() if queue)
+            queue = self._queues[priority]
+            request = queue.popleft()
+            start, stop = request.chunks.popleft()
+            if request.chunks:
+                # Take turns with the other requests of the same priority.
+                queue.append(request)
+            metrics = self._metrics[priority]
+            metrics.chunks += 1
+            if request.started is None:
+                request.started = _clock()
+                wait = request.started - request.submitted
+                metrics.total_wait += wait
+                metrics.max_wait = max(metrics.max_wait, wait)
+            return priority, request, start, stop
+
+    def _finish(self, priority, request):
+        with self._condition:
+            if request.chunks:
+                # The request failed, so drop its remaining chunks.
+                request.chunks.clear()
+                self._queues[priority].remove(request)
+            metrics = self._metrics[priority]
+            latency = _clock() - request.submitted
+            metrics.requests += 1
+            metrics.total_latency += latency
+            metrics.max_latency = max(metrics.max_latency, latency)
+        request.done.set()
+
+    def _dispatch(self):
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return
+            priority, request, start, stop = chunk
+            try:
+                if request.get:
+                    request.results[start:stop] = self._cs.run(
+                        self._cs.get, request.pvs[start:stop])
+                else:
+                    self._cs.run(self._cs.put, request.pvs[start:stop],
+                                 request.values[start:stop])
+            except Exception as e:
+                request.error = e
+            request.remaining -= 1
+            if request.remaining == 0 or request.error is not None:
+                self._finish(priority, request)
+
+    def _submit(self, get, pvs, values, priority):
+        if priority is None:
+            priority = self.default_priority
+        request = _Request(get, pvs, values, self.chunk_size)
+        if not pvs:
+            return request
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._dispatch)
+                self._thread.daemon = True
+                self._thread.start()
+            self._queues[priority].append(request)
+            self._condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request
+
+    def get(self, pv, priority=None):
+        """Get the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to get the value of.
+            priority (int): The priority of the request, HIGH, NORMAL, LOW or
+                             any other integer, lower values being served
+                             first. Defaults to default_priority.
+
+        Returns:
+            object: The value of a single PV, or a list of the values of the
+                     PVs in the same order.
+
+        Raises:
+            Exception: the first error raised by the wrapped control system
+                        while serving the request.
+        """
+        if isinstance(pv, utils.string_types):
+            return self._submit(True, [pv], None, priority).results[0]
+        return self._submit(True, list(pv), None, priority).results
+
+    def put(self, pv, value, priority=None):
+        """Put the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value, or a sequence with the value of each
+                             PV.
+            priority (int): The priority of the request, lower values being
+                             served first. Defaults to default_priority.
+
+        Raises:
+            Exception: the first error raised by the wrapped control system
+                        while serving the request.
+        """
+        if isinstance(pv, utils.string_types):
+            self._submit(False, [pv], [value], priority)
+        else:
+            self._submit(False, list(pv), list(value), priority)
+
+    def connect(self, pvs, timeout=None):
+        """Connect to PVs using the wrapped control system, without
+        scheduling.
+
+        Args:
+            pvs (sequence): The PVs to connect to.
+            timeout (float): The time in seconds to wait for the connections.
+
+        Returns:
+            list: True for each PV that is connected.
+        """
+        return self._cs.connect(pvs, timeout)
+
+    def get_view(self, priority):
+        """Get a control system making all its requests with a priority.
+
+        Args:
+            priority (int): The priority of the requests.
+
+        Returns:
+            ControlSystem: The view of this scheduler.
+        """
+        return PriorityView(self, priority)
+
+    def get_metrics(self):
+        """Get the queue depth and times of each priority class.
+
+        Returns:
+            dict: For each priority seen, a dictionary of the number of
+                   requests and chunks waiting ('queued_requests',
+                   'queued_chunks'), the number of requests and chunks served
+                   ('requests', 'chunks'), and the mean and longest times in
+                   seconds from submitting a request to serving its first
+                   chunk ('mean_wait', 'max_wait') and to completing it
+                   ('mean_latency', 'max_latency').
+        """
+        with self._condition:
+            priorities = set(self._queues).union(self._metrics)
+            report = {}
+            for priority in priorities:
+                queue = self._queues.get(priority, ())
+                metrics = self._metrics.get(priority, _Metrics())
+                served = max(metrics.requests, 1)
+                report[priority] = {
+                    'queued_requests': len(queue),
+                    'queued_chunks': sum(len(r.chunks) for r in queue),
+                    'requests': metrics.requests,
+                    'chunks': metrics.chunks,
+                    'mean_wait': metrics.total_wait / served,
+                    'max_wait': metrics.max_wait,
+                    'mean_latency': metrics.total_latency / served,
+                    'max_latency': metrics.max_latency,
+                }
+            return report
+
+    def close(self):
+        """Stop the dispatcher thread once the queues are empty."""
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._thread = None
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PriorityView(ControlSystem):
+    """A control system making all its requests through a
+    PriorityControlSystem with one priority.
+
+    **Attributes:**
+
+    Attributes:
+        priority (int): The priority of the requests.
+
+    .. Private Attributes:
+           _scheduler (PriorityControlSystem): The scheduler.
+    """
+    def __init__(self, scheduler, priority):
+        """
+        Args:
+            scheduler (PriorityControlSystem): The scheduler.
+            priority (int): The priority of the requests.
+
+        **Methods:**
+        """
+        self._scheduler = scheduler
+        self.priority = priority
+
+    def get(self, pv):
+        """Get the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to get the value of.
+
+        Returns:
+            object: The value of a single PV, or a list of values.
+        """
+        return self._scheduler.get(pv, self.priority)
+
+    def put(self, pv, value):
+        """Put the value of a PV, or the values of a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value or values to be set.
+        """
+        self._scheduler.put(pv, value, self.priority)
+
+    def connect(self, pvs, timeout=None):
+        """Connect to PVs using the wrapped control system.
+
+        Args:
+            pvs (sequence): The PVs to connect to.
+            timeout (float): The time in seconds to wait for the connections.
+
+        Returns:
+            list: True for each PV that is connected.
+        """
+        return self._scheduler.connect(pvs, timeout)
@@ -0,0 +1,341 @@
+"""Control system wrapper limiting the rate of writes to groups of PVs.
+
+Some power supply IOCs misbehave when they receive hundreds of writes at
+once. A RateLimitedControlSystem queues writes and issues them from a
+background thread, in batches, at no more than a configured rate for each
+PV prefix, such as the prefix of the PVs of one IOC. Each prefix has a token
+bucket: a token is used for each PV written and tokens are refilled at the
+rate, up to a burst size. A batch is written once there are tokens for all
+of it. PVs matching no prefix are written without limit.
+
+A write to a PV that is still queued supersedes the queued value, so only
+the latest value is written. Callers get a future for each write, which
+completes with the value written when its PV has been written. A queued PV
+whose futures have all been cancelled is not written.
+
+Reads are passed straight to the wrapped control system. The writer thread
+writes through the run() method of the wrapped control system, so a control
+system that must be used from one thread, such as the cothread one, makes
+its writes on that thread.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from pytac import utils
+from pytac.cs import ControlSystem
+
+
+# time.monotonic is not available in Python 2.7.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class _Bucket(object):
+    """The token bucket and queued writes of a PV prefix."""
+    def __init__(self, rate, batch_size, burst):
+        self.rate = rate
+        self.batch_size = batch_size
+        self.capacity = max(burst or 0, batch_size or 1)
+        self.tokens = self.capacity
+        self.updated = _clock()
+        # The value and futures of each queued PV, in the order queued.
+        self.pending = collections.OrderedDict()
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wanted(self):
+        """The number of writes in the next batch."""
+        count = len(self.pending)
+        if self.batch_size is not None:
+            count = min(count, self.batch_size)
+        if self.rate is not None:
+            count = min(count, self.capacity)
+        return count
+
+    def take(self):
+        """Take the next batch of writes if there are tokens for all of it,
+        otherwise return None.
+        """
+        count = self.wanted()
+        if self.rate is not None:
+            if self.tokens < count:
+                return None
+            self.tokens -= count
+        return [self.pending.popitem(last=False) for _ in range(count)]
+
+    def delay(self):
+        """The time until there are tokens for the next batch."""
+        return (self.wanted() - self.tokens) / self.rate
+
+
+def _complete(future, value=None, error=None):
+    """Set the result or exception of a future unless it is already done."""
+    if future.done():
+        return
+    if error is None:
+        future.set_result(value)
+    else:
+        future.set_exception(error)
+
+
+class RateLimitedControlSystem(ControlSystem):
+    """Control system wrapper writing to PVs no faster than set rates.
+
+    **Attributes:**
+
+    Attributes:
+        writes (int): The number of PVs written so far.
+        coalesced (int): The number of writes superseded before they were
+                          issued.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The wrapped control system.
+           _limits (list): The (prefix, bucket) pairs, longest prefix first.
+           _unlimited (_Bucket): The bucket of the PVs matching no prefix.
+           _buckets (dict): The bucket of each PV written so far.
+           _condition (threading.Condition): Protects the buckets and wakes
+                                              the writer thread.
+           _thread (threading.Thread): The writer thread, started by the
+                                        first write.
+           _stopping (bool): Set to stop the writer once the queues are
+                              empty.
+    """
+    def __init__(self, cs, limits=None):
+        """
+        Args:
+            cs (ControlSystem): The control system to wrap.
+            limits (dict): The (rate, batch size) of each PV prefix; see
+                            add_limit().
+
+        Raises:
+            ValueError: if a rate is not positive.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self._limits = []
+        self._unlimited = _Bucket(None, None, None)
+        self._buckets = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.writes = 0
+        self.coalesced = 0
+        for prefix, (rate, batch_size) in (limits or {}).items():
+            self.add_limit(prefix, rate, batch_size)
+
+    def add_limit(self, prefix, rate, batch_size=1, burst=None):
+        """Limit the rate of writes to the PVs starting with a prefix.
+
+        A PV is limited by the longest prefix it starts with.
+
+        Args:
+            prefix (str): The start of the names of the PVs, for instance
+                           the prefix of an IOC.
+            rate (float): The largest number of PVs written per second, on
+                           average.
+            batch_size (int): The largest number of PVs written at once.
+            burst (int): The largest number of tokens saved up during a
+                          pause. It defaults to, and is at least, the batch
+                          size.
+
+        Raises:
+            ValueError: if the rate is not positive.
+        """
+        if not rate > 0:
+            raise ValueError("The rate of prefix {0} must be positive, not "
+                             "{1}.".format(prefix, rate))
+        with self._condition:
+            self._limits.append((prefix, _Bucket(rate, batch_size, burst)))
+            self._limits.sort(key=lambda limit: len(limit[0]), reverse=True)
+            self._buckets.clear()
+
+    def _get_all_buckets(self):
+        return [bucket for _, bucket in self._limits] + [self._unlimited]
+
+    def _get_bucket(self, pv):
+        bucket = self._buckets.get(pv)
+        if bucket is None:
+            bucket = self._unlimited
+            for prefix, limited in self._limits:
+                if pv.startswith(prefix):
+                    bucket = limited
+                    break
+            self._buckets[pv] = bucket
+        return bucket
+
+    def submit(self, pv, value):
+        """Queue writes to a PV or a list of PVs.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value, or a sequence with the value of each
+                             PV.
+
+        Returns:
+            Future or list: A future for each write, which completes with the
+                             value written to the PV.
+
+        Raises:
+            ValueError: if the number of values differs from the number of
+                         PVs.
+        """
+        if isinstance(pv, utils.string_types):
+            return self.submit([pv], [value])[0]
+        pv = list(pv)
+        value = list(value)
+        if len(value) != len(pv):
+            raise ValueError("Got {0} values for {1} PVs."
+                             .format(len(value), len(pv)))
+        futures = []
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._write)
+                self._thread.daemon = True
+                self._thread.start()
+            for p, v in zip(pv, value):
+                future = Future()
+                futures.append(future)
+                pending = self._get_bucket(p).pending
+                if p in pending:
+                    pending[p][0] = v
+                    pending[p][1].append(future)
+                    self.coalesced += 1
+                else:
+                    pending[p] = [v, [future]]
+            self._condition.notify()
+        return futures
+
+    def _next_batches(self):
+        """Wait for the next batches allowed, or return None once stopped."""
+        with self._condition:
+            while True:
+                now = _clock()
+                batches = []
+                delay = None
+                for bucket in self._get_all_buckets():
+                    if not bucket.pending:
+                        continue
+                    bucket.refill(now)
+                    batch = bucket.take()
+                    if batch is not None:
+                        batches.append(batch)
+                    elif delay is None or bucket.delay() < delay:
+                        delay = bucket.delay()
+                if batches:
+                    return batches
+                if delay is None and self._stopping:
+                    return None
+                self._condition.wait(delay)
+
+    def _write(self):
+        while True:
+            batches = self._next_batches()
+            if batches is None:
+                return
+            for batch in batches:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    # Never let one batch stop the writes queued after it.
+                    for _, (_, futures) in batch:
+                        for future in futures:
+                            _complete(future, error=e)
+
+    def _write_batch(self, batch):
+        """Write a batch of (PV, [value, futures]) entries, skipping those
+        whose futures have all been cancelled.
+        """
+        live = []
+        for pv, (value, futures) in batch:
+            futures = [future for future in futures
+                       if future.set_running_or_notify_cancel()]
+            if futures:
+                live.append((pv, value, futures))
+        if not live:
+            return
+        pvs = [pv for pv, _, _ in live]
+        values = [value for _, value, _ in live]
+        try:
+            self._cs.run(self._cs.put, pvs, values)
+        except Exception as e:
+            for _, _, futures in live:
+                for future in futures:
+                    _complete(future, error=e)
+        else:
+            self.writes += len(pvs)
+            for _, value, futures in live:
+                for future in futures:
+                    _complete(future, value)
+
+    def put(self, pv, value):
+        """Put the value of a PV, or the values of a list of PVs, waiting
+        until they have been written.
+
+        Args:
+            pv (str or sequence): The PV or PVs to put the value for.
+            value (object): The value, or a sequence with the value of each
+                             PV.
+
+        Raises:
+            Exception: the first error raised by the wrapped control system
+                        while writing the PVs.
+        """
+        futures = self.submit(pv, value)
+        for future in [futures] if isinstance(futures, Future) else futures:
+            future.result()
+
+    def get(self, pv):
+        """Get the value of a PV, or the values of a list of PVs, from the
+        wrapped control system.
+
+        Args:
+            pv (str or sequence): The PV or PVs to get the value of.
+
+        Returns:
+            object: The value of a single PV, or a list of values.
+        """
+        return self._cs.get(pv)
+
+    def connect(self, pvs, timeout=None):
+        """Connect to PVs using the wrapped control system.
+
+        Args:
+            pvs (sequence): The PVs to connect to.
+            timeout (float): The time in seconds to wait for the connections.
+
+        Returns:
+            list: True for each PV that is connected.
+        """
+        return self._cs.connect(pvs, timeout)
+
+    def get_pending(self):
+        """Get the number of PVs waiting to be written.
+
+        Returns:
+            int: The number of PVs queued.
+        """
+        with self._condition:
+            return sum(len(bucket.pending)
+                       for bucket in self._get_all_buckets())
+
+    def close(self):
+        """Stop the writer thread once all the queued PVs are written."""
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._thread = None
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
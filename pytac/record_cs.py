@@ -0,0 +1,282 @@
+"""Control systems that record traffic to, and replay it from, a trace file.
+
+A trace is a binary file starting with a fixed header followed by one record
+per get or put call. Each record is a fixed-size struct holding the
+operation, the time since recording started and the latency of the call,
+followed by the pickled PV names and values. Values are reduced to built-in
+and numpy types when recorded so that traces can be replayed without the
+original control system library installed. Each record is flushed as it is
+written, so a trace survives a crash of the recording process.
+"""
+import collections
+import pickle
+import struct
+import threading
+import time
+import numpy
+from pytac import utils
+from pytac.cs import ControlSystem
+from pytac.exceptions import ControlSystemException
+
+
+TRACE_HEADER = b'PYTACTR1'
+GET = 0
+PUT = 1
+# Flag added to the operation of calls that raised an exception.
+ERROR = 0x80
+_RECORD = struct.Struct('<BddI')
+# Protocol 2 can be read by both Python 2 and Python 3.
+_PICKLE_PROTOCOL = 2
+
+# time.monotonic is not available in Python 2.7.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def _plain(value):
+    """Reduce a value to built-in and numpy types.
+
+    Control system libraries often return subclasses of float, int, str or
+    numpy.ndarray carrying extra metadata (as cothread does); these would need
+    the library to be importable when the trace is unpickled.
+    """
+    if isinstance(value, numpy.ndarray):
+        return numpy.array(value)
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    for base in (bool, int, float, str):
+        if isinstance(value, base):
+            return base(value)
+    return value
+
+
+def _key(pv):
+    return pv if isinstance(pv, utils.string_types) else list(pv)
+
+
+def _hashable(pv):
+    return pv if isinstance(pv, utils.string_types) else tuple(pv)
+
+
+def read_trace(filename):
+    """Read all the records from a trace file.
+
+    Args:
+        filename (str): The trace file.
+
+    Returns:
+        list: (operation, time, latency, pv, value) tuples. For failed calls
+               the operation includes the ERROR flag and the value is the
+               error message.
+
+    Raises:
+        ControlSystemException: if the file is not a pytac trace.
+
+    A record cut short, for example by a crash while it was written, ends the
+    trace.
+    """
+    records = []
+    with open(filename, 'rb') as trace:
+        if trace.read(len(TRACE_HEADER)) != TRACE_HEADER:
+            raise ControlSystemException("{0} is not a pytac trace file."
+                                         .format(filename))
+        while True:
+            header = trace.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            op, timestamp, latency, length = _RECORD.unpack(header)
+            payload = trace.read(length)
+            if len(payload) < length:
+                break
+            pv, value = pickle.loads(payload)
+            records.append((op, timestamp, latency, pv, value))
+    return records
+
+
+class RecordingControlSystem(ControlSystem):
+    """Control system wrapper writing every call to a trace file.
+
+    Calls are passed through to the wrapped control system and their results,
+    or the exceptions they raise, are returned unchanged.
+
+    **Attributes:**
+
+    Attributes:
+        filename (str): The trace file being written.
+
+    .. Private Attributes:
+           _cs (ControlSystem): The wrapped control system.
+           _trace (file): The open trace file.
+           _start (float): The time recording started.
+           _lock (threading.Lock): Serialises writes to the trace.
+    """
+    def __init__(self, cs, filename):
+        """
+        Args:
+            cs (ControlSystem): The control system to wrap.
+            filename (str): The trace file to write. It is overwritten.
+
+        **Methods:**
+        """
+        self._cs = cs
+        self.filename = filename
+        self._trace = open(filename, 'wb')
+        self._trace.write(TRACE_HEADER)
+        self._start = _clock()
+        self._lock = threading.Lock()
+
+    def _write(self, op, start, pv, value):
+        latency = _clock() - start
+        payload = pickle.dumps((_key(pv), _plain(value)), _PICKLE_PROTOCOL)
+        with self._lock:
+            self._trace.write(_RECORD.pack(op, start - self._start, latency,
+                                           len(payload)))
+            self._trace.write(payload)
+            self._trace.flush()
+
+    def get(self, pv):
+        """Get the value of a PV, or a list of PVs, and record the call.
+
+        Args:
+            pv (string or list): The PV or PVs to get the value of.
+
+        Returns:
+            object: The value returned by the wrapped control system.
+        """
+        start = _clock()
+        try:
+            value = self._cs.get(pv)
+        except Exception as e:
+            self._write(GET | ERROR, start, pv, str(e))
+            raise
+        self._write(GET, start, pv, value)
+        return value
+
+    def put(self, pv, value):
+        """Put the value of a PV, or a list of PVs, and record the call.
+
+        Args:
+            pv (string or list): The PV or PVs to put the value for.
+            value (object): The value or values to be set.
+        """
+        start = _clock()
+        try:
+            self._cs.put(pv, value)
+        except Exception as e:
+            self._write(PUT | ERROR, start, pv, str(e))
+            raise
+        self._write(PUT, start, pv, value)
+
+    def close(self):
+        """Flush and close the trace file."""
+        with self._lock:
+            self._trace.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayControlSystem(ControlSystem):
+    """Control system answering calls from a recorded trace.
+
+    Each call is answered by the first record not yet replayed of a call
+    of the same kind to the same PVs, so calls made by several threads, whose
+    order may change from run to run, can be replayed. The recorded value is
+    returned, or the recorded failure raised as a ControlSystemException. No
+    connection to a real control system is made.
+
+    **Attributes:**
+
+    Attributes:
+        realtime (bool): Whether to reproduce the timing of the recording:
+                          each call returns when it did relative to the
+                          first call, rather than immediately.
+
+    .. Private Attributes:
+           _records (list): The records read from the trace.
+           _queues (dict): The indices of the records not yet replayed, for
+                            each operation and PVs.
+           _replayed (int): The number of records replayed.
+           _start (float): The time of the first call replayed, or None.
+           _lock (threading.Lock): Serialises access to the records.
+    """
+    def __init__(self, filename, realtime=False):
+        """
+        Args:
+            filename (str): The trace file to replay.
+            realtime (bool): Whether to reproduce the timing of the
+                              recording.
+
+        **Methods:**
+        """
+        self._records = read_trace(filename)
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self.rewind()
+
+    def remaining(self):
+        """The number of records not yet replayed.
+
+        Returns:
+            int: The number of remaining records.
+        """
+        return len(self._records) - self._replayed
+
+    def rewind(self):
+        """Restart replay from the first record."""
+        with self._lock:
+            self._queues = collections.defaultdict(collections.deque)
+            for i, (op, _, _, pv, _) in enumerate(self._records):
+                self._queues[(op & ~ERROR, _hashable(pv))].append(i)
+            self._replayed = 0
+            self._start = None
+
+    def _replay(self, op, pv):
+        with self._lock:
+            queue = self._queues.get((op, _hashable(pv)))
+            if not queue:
+                raise ControlSystemException("No recorded call {0} to PV {1} "
+                                             "left to replay.".format(op, pv))
+            record = self._records[queue.popleft()]
+            self._replayed += 1
+            if self._start is None:
+                self._start = _clock()
+        record_op, timestamp, latency, _, value = record
+        if self.realtime:
+            first = self._records[0][1]
+            delay = self._start + timestamp - first + latency - _clock()
+            if delay > 0:
+                time.sleep(delay)
+        if record_op & ERROR:
+            raise ControlSystemException(value)
+        return value
+
+    def get(self, pv):
+        """Get the recorded value of a PV, or a list of PVs.
+
+        Args:
+            pv (string or list): The PV or PVs to get the value of.
+
+        Returns:
+            object: The recorded value.
+
+        Raises:
+            ControlSystemException: if the call does not match the trace, or
+                                     the recorded call failed.
+        """
+        return self._replay(GET, pv)
+
+    def put(self, pv, value):
+        """Check a put against the trace; nothing is written.
+
+        Args:
+            pv (string or list): The PV or PVs to put the value for.
+            value (object): The value or values to be set.
+
+        Raises:
+            ControlSystemException: if the call does not match the trace, or
+                                     the recorded call failed.
+        """
+        self._replay(PUT, pv)
@@ -0,0 +1,580 @@
+"""Share the structure of a lattice between processes through shared memory.
+
+A process publishes a loaded lattice once. Its elements, families, positions,
+PV names and unit conversion tables are packed into a single shared memory
+block as numpy columns. Worker processes attach to the block by name and get
+a read-only SharedEpicsLattice, using a control system of their own.
+
+The attached lattice is not built from a copy of the tables. Its lengths,
+positions and cells are read-only numpy views of the block, and families,
+element names, PV names and device names are looked up by searching the
+columns in the block. Elements are only built in a worker when it first uses
+them, and the unit conversion tables of their magnets are views of the block
+too. Only the elements built, their devices and the interpolators of their
+unit conversions are held by the worker.
+
+The structure of the attached lattice cannot be changed: adding elements,
+devices, families or data sources to it or to its elements raises a
+DataSourceException. Values are still read and written through the control
+system of the worker.
+
+Requires Python 3.8 or later for multiprocessing.shared_memory.
+
+The block starts with the length of a JSON manifest, followed by the
+manifest and then the columns, each aligned to 8 bytes. The manifest gives
+the name and energy of the lattice and the dtype, offset and length of every
+column, and of a mask marking missing values in the columns that have them.
+The rows of each unit conversion are contiguous, in order of uc_id, as
+written by load_csv.get_tables().
+"""
+import fnmatch
+import json
+import re
+import struct
+import numpy
+import pytac
+from pytac import data_source, device, epics, load_csv, units
+from pytac.exceptions import DataSourceException
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+HEADER = struct.Struct('<Q')
+ALIGNMENT = 8
+
+
+def _check_available():
+    if shared_memory is None:
+        raise DataSourceException("Shared lattices need "
+                                  "multiprocessing.shared_memory, which "
+                                  "requires Python 3.8 or later.")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _column_array(values):
+    """Convert a column to a numpy array and a mask of missing values."""
+    missing = numpy.array([value is None for value in values], dtype=bool)
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(v, str) for v in present):
+        array = numpy.array([(v or '').encode('utf-8') for v in values],
+                            dtype=bytes)
+    elif all(isinstance(v, (int, numpy.integer)) for v in present):
+        array = numpy.array([v or 0 for v in values], dtype=numpy.int64)
+    else:
+        array = numpy.array([0.0 if v is None else v for v in values],
+                            dtype=numpy.float64)
+    return array, (missing if missing.any() else None)
+
+
+class SharedColumn(object):
+    """A read-only column of a table held in shared memory.
+
+    Values are converted to Python objects when they are read, so the column
+    can be used wherever build_lattice expects a list.
+
+    **Attributes:**
+
+    Attributes:
+        array (numpy.ndarray): The read-only view of the values.
+        missing (numpy.ndarray): True for missing values, or None if no value
+                                  is missing.
+    """
+    def __init__(self, array, missing=None):
+        """
+        Args:
+            array (numpy.ndarray): The values.
+            missing (numpy.ndarray): True for missing values.
+
+        **Methods:**
+        """
+        self.array = array
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.array)
+
+    def _convert(self, value, missing):
+        if missing:
+            return None
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return list(self)[n]
+        missing = self.missing is not None and self.missing[n]
+        return self._convert(self.array[n].item(), missing)
+
+    def __iter__(self):
+        values = self.array.tolist()
+        if self.missing is None and self.array.dtype.kind != 'S':
+            return iter(values)
+        missing = (self.missing.tolist() if self.missing is not None
+                   else [False] * len(values))
+        return (self._convert(value, value_missing)
+                for value, value_missing in zip(values, missing))
+
+
+def _is_in(column, values):
+    """Mark the values of a string column that are among some strings."""
+    if column.array.dtype.kind != 'S':
+        # A column without any strings is stored as numbers.
+        return numpy.zeros(len(column), dtype=bool)
+    return numpy.isin(column.array, [value.encode('utf-8')
+                                     for value in values])
+
+
+class SharedElement(epics.EpicsElement):
+    """An element of a SharedEpicsLattice, which cannot be changed.
+
+    **Methods:**
+    """
+    def _reject(self):
+        raise DataSourceException("Element {0} of a shared lattice cannot be "
+                                  "changed.".format(self))
+
+    def set_data_source(self, data_source, data_source_type):
+        """Raises, as the element cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+    def add_device(self, field, device, uc):
+        """Raises, as the element cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+    def add_to_family(self, family):
+        """Raises, as the element cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+
+class SharedEpicsLattice(epics.LazyEpicsLattice):
+    """A read-only lattice whose structure is read from shared memory.
+
+    Elements are built when they are first used, as in a LazyEpicsLattice,
+    but elements are selected and found by searching the shared columns
+    rather than indexes of this process.
+
+    .. Private Attributes:
+           _tables (dict): The SharedColumn of each column of each table.
+           _rigidity (Rigidity): The rigidity shared by the unit conversions
+                                  of the magnets.
+           _rigidity_ids (numpy.ndarray): The ids of the elements whose unit
+                                           conversions use the rigidity.
+           _unitconvs (dict): The unit conversion built for each uc_id.
+           _shared_memory (SharedMemory): The block, which must stay open
+                                           while the views are used.
+    """
+    def __init__(self, name, epics_cs, tables, memory=None):
+        """
+        Args:
+            name (str): The name of the lattice.
+            epics_cs (ControlSystem): The control system used to store the
+                                       values on a PV.
+            tables (dict): The SharedColumn of each column of each table, as
+                            published by publish().
+            memory (SharedMemory): The block holding the columns.
+
+        **Methods:**
+        """
+        # The indexes of a LazyEpicsLattice are not built, as the shared
+        # columns are searched instead.
+        super(epics.LazyEpicsLattice, self).__init__(name, epics_cs)
+        self._tables = tables
+        self._shared_memory = memory
+        elements = tables['elements']
+        self._factory = self._build_element
+        self._lengths = elements['length'].array
+        self._cells = elements['cell']
+        # Only the families of the elements built are kept here.
+        self._families = {}
+        self._lattice = [None] * len(self._lengths)
+        self._rigidity = units.Rigidity(3000)
+        self._unitconvs = {}
+        self._rigidity_ids = self._get_family_ids(load_csv.RIGIDITY_FAMILIES)
+        super(SharedEpicsLattice, self).set_data_source(
+            data_source.DeviceDataSource(), pytac.LIVE)
+        devices = tables['devices']
+        # Devices with id 0 are attached to the lattice not elements.
+        for row in numpy.flatnonzero(devices['id'].array == 0).tolist():
+            d = epics.EpicsDevice(devices['name'][row], epics_cs, True,
+                                  devices['get_pv'][row],
+                                  devices['set_pv'][row])
+            super(SharedEpicsLattice, self).add_device(
+                devices['field'][row], d, load_csv.DEFAULT_UC)
+        super(SharedEpicsLattice, self).add_device(
+            's_position', device.BasicDevice(elements['s'].array),
+            load_csv.DEFAULT_UC)
+        super(SharedEpicsLattice, self).add_device(
+            'energy', device.EnergyDevice(self._rigidity),
+            load_csv.DEFAULT_UC)
+
+    def _reject(self):
+        raise DataSourceException("Shared lattice {0} cannot be changed."
+                                  .format(self))
+
+    def set_data_source(self, data_source, data_source_type):
+        """Raises, as the lattice cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+    def add_device(self, field, device, uc):
+        """Raises, as the lattice cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+    def add_element(self, element):
+        """Raises, as the lattice cannot be changed.
+
+        Raises:
+            DataSourceException: always.
+        """
+        self._reject()
+
+    def _get_family_ids(self, families):
+        """The ids of the elements in at least one of some families."""
+        elements = self._tables['elements']
+        members = self._tables['families']
+        ids = members['id'].array[_is_in(members['family'], families)]
+        mask = _is_in(elements['type'], families)
+        mask |= numpy.isin(elements['id'].array, ids)
+        return elements['id'].array[mask]
+
+    def _get_positions(self, ids):
+        """The positions in the ring of the elements with some ids."""
+        mask = numpy.isin(self._tables['elements']['id'].array, ids)
+        return numpy.flatnonzero(mask).tolist()
+
+    def _get_unitconv(self, uc_id):
+        uc = self._unitconvs.get(uc_id)
+        if uc is not None:
+            return uc
+        pchip = self._tables['pchip']
+        start, stop = numpy.searchsorted(pchip['uc_id'].array,
+                                         [uc_id, uc_id + 1])
+        if stop > start:
+            uc = units.PchipUnitConv(pchip['eng'].array[start:stop],
+                                     pchip['phy'].array[start:stop])
+        else:
+            poly = self._tables['poly']
+            start, stop = numpy.searchsorted(poly['uc_id'].array,
+                                             [uc_id, uc_id + 1])
+            if stop == start:
+                raise KeyError("No unit conversion with uc_id {0}."
+                               .format(uc_id))
+            # The coefficients are stored in decreasing powers.
+            uc = units.PolyUnitConv(poly['val'].array[start:stop])
+        unitconv = self._tables['unitconv']
+        el_ids = unitconv['el_id'].array[unitconv['uc_id'].array == uc_id]
+        if numpy.isin(el_ids, self._rigidity_ids).any():
+            uc._post_eng_to_phys = self._rigidity.div
+            uc._pre_phys_to_eng = self._rigidity.mult
+        self._unitconvs[uc_id] = uc
+        return uc
+
+    def _build_element(self, index):
+        elements = self._tables['elements']
+        id_ = elements['id'][index]
+        e = SharedElement(elements['name'][index], elements['length'][index],
+                          elements['type'][index], elements['s'][index], id_,
+                          elements['cell'][index])
+        # The element only rejects changes made after it is built.
+        epics.EpicsElement.add_to_family(e, e.type_)
+        epics.EpicsElement.set_data_source(e, data_source.DeviceDataSource(),
+                                           pytac.LIVE)
+        devices = self._tables['devices']
+        for row in numpy.flatnonzero(devices['id'].array == id_).tolist():
+            d = epics.EpicsDevice(devices['name'][row], self._cs, True,
+                                  devices['get_pv'][row],
+                                  devices['set_pv'][row])
+            epics.EpicsElement.add_device(e, devices['field'][row], d,
+                                          load_csv.DEFAULT_UC)
+        families = self._tables['families']
+        for row in numpy.flatnonzero(families['id'].array == id_).tolist():
+            epics.EpicsElement.add_to_family(e, families['family'][row])
+        unitconv = self._tables['unitconv']
+        for row in numpy.flatnonzero(unitconv['el_id'].array == id_).tolist():
+            e._data_source_manager._uc[unitconv['field'][row]] = (
+                self._get_unitconv(unitconv['uc_id'][row]))
+        return e
+
+    def get_element(self, name):
+        """Get an element by name, building it if needed.
+
+        If several elements have the name, the first in the ring is
+        returned.
+
+        Args:
+            name (str): The name of the element.
+
+        Returns:
+            Element: The element with the given name.
+
+        Raises:
+            ValueError: if there is no element with the given name.
+        """
+        names = self._tables['elements']['name']
+        positions = numpy.flatnonzero(_is_in(names, [name]))
+        if not len(positions):
+            raise ValueError("No element named {0}.".format(name))
+        return self._load(int(positions[0]))
+
+    def get_elements(self, family=None, cell=None):
+        """Get the elements of a family from the lattice, building them if
+        needed.
+
+        If no family is specified it returns all elements. Elements are
+        returned in the order they exist in the ring.
+
+        Args:
+            family (str): requested family.
+            cell (int): restrict elements to those in the specified cell.
+
+        Returns:
+            list: list containing all elements of the specified family.
+
+        Raises:
+            ValueError: if there are no elements in the specified cell or
+                         family.
+        """
+        ids = self._tables['elements']['id'].array
+        if family is None:
+            mask = numpy.ones(len(self._lattice), dtype=bool)
+        else:
+            mask = numpy.isin(ids, self._get_family_ids([family]))
+        if not mask.any():
+            raise ValueError("No elements in family {0}.".format(family))
+        if cell is not None:
+            mask &= self._cells.array == cell
+            if self._cells.missing is not None:
+                mask &= ~self._cells.missing
+        if not mask.any():
+            raise ValueError("No elements in cell {0}.".format(cell))
+        return [self._load(i) for i in numpy.flatnonzero(mask).tolist()]
+
+    def get_all_families(self):
+        """Get all families of elements in the lattice.
+
+        Returns:
+            set: all defined families.
+        """
+        families = set(self._tables['elements']['type'])
+        families.update(self._tables['families']['family'])
+        return families
+
+    def _lookup_pv(self, pv):
+        if pv not in self._pv_index:
+            devices = self._tables['devices']
+            mask = _is_in(devices['get_pv'], [pv])
+            mask |= _is_in(devices['set_pv'], [pv])
+            for position in self._get_positions(devices['id'].array[mask]):
+                self._load(position)
+        return super(SharedEpicsLattice, self)._lookup_pv(pv)
+
+    def _load_devices(self, names):
+        devices = self._tables['devices']
+        mask = _is_in(devices['name'], names)
+        for position in self._get_positions(devices['id'].array[mask]):
+            self._load(position)
+
+    def find_device(self, name):
+        """Find the lattice or elements and fields of the devices with a
+        name, building the elements found.
+
+        Args:
+            name (str): The name of the device.
+
+        Returns:
+            list: The (lattice or element, field) pairs of the devices, with
+                   the lattice first and then the elements in ring order.
+
+        Raises:
+            DataSourceException: if no device of the lattice has the name.
+        """
+        self._load_devices([name])
+        return super(SharedEpicsLattice, self).find_device(name)
+
+    def find_devices(self, pattern):
+        """Find the lattice or elements and fields of the devices whose names
+        match a glob pattern, building the elements found.
+
+        Args:
+            pattern (str): The pattern, matched case-sensitively using
+                            fnmatch.
+
+        Returns:
+            list: The (lattice or element, field) pairs of the devices, with
+                   the lattice first and then the elements in ring order.
+        """
+        names = self._tables['devices']['name'].array
+        if names.dtype.kind == 'S':
+            prefix = re.split(r'[*?[]', pattern, 1)[0].encode('utf-8')
+            candidates = set(names[numpy.char.startswith(names, prefix)])
+            self._load_devices([name for name in (c.decode('utf-8')
+                                                  for c in candidates)
+                                if fnmatch.fnmatchcase(name, pattern)])
+        return super(SharedEpicsLattice, self).find_devices(pattern)
+
+    def _get_all_pv_names(self):
+        devices = self._tables['devices']
+        pvs = set(self._pv_index)
+        for column in ('get_pv', 'set_pv'):
+            pvs.update(pv for pv in devices[column] if pv is not None)
+        return list(pvs)
+
+
+class SharedLattice(object):
+    """The shared memory block holding a published lattice.
+
+    Only the process that published the lattice should unlink the block,
+    once no worker needs it any more.
+
+    **Attributes:**
+
+    Attributes:
+        name (str): The name of the shared memory block, passed to attach().
+
+    .. Private Attributes:
+           _memory (SharedMemory): The shared memory block.
+    """
+    def __init__(self, memory):
+        """
+        Args:
+            memory (SharedMemory): The shared memory block.
+
+        **Methods:**
+        """
+        self._memory = memory
+        self.name = memory.name
+
+    def close(self):
+        """Close this process's access to the block."""
+        self._memory.close()
+
+    def unlink(self):
+        """Close and destroy the block."""
+        self._memory.close()
+        self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+def publish(lattice, name=None):
+    """Publish the structure of a lattice in shared memory.
+
+    Args:
+        lattice (EpicsLattice): The lattice, which is fully loaded.
+        name (str): The name of the shared memory block. A unique name is
+                     chosen if None.
+
+    Returns:
+        SharedLattice: The block, whose name is passed to the workers.
+
+    Raises:
+        DataSourceException: if shared memory is not available.
+    """
+    _check_available()
+    arrays = []
+    manifest = {'name': lattice.name, 'energy': lattice.get_value('energy'),
+                'tables': {}}
+    offset = 0
+    for table_name, table in load_csv.get_tables(lattice).items():
+        columns = manifest['tables'][table_name] = {}
+        for column, values in table.items():
+            array, missing = _column_array(values)
+            columns[column] = {'dtype': array.dtype.str, 'offset': offset,
+                               'length': len(array), 'missing': None}
+            arrays.append((offset, array))
+            offset = _align(offset + array.nbytes)
+            if missing is not None:
+                columns[column]['missing'] = offset
+                arrays.append((offset, missing))
+                offset = _align(offset + missing.nbytes)
+    header = json.dumps(manifest).encode('utf-8')
+    start = _align(HEADER.size + len(header))
+    memory = shared_memory.SharedMemory(name=name, create=True,
+                                        size=max(start + offset, 1))
+    HEADER.pack_into(memory.buf, 0, len(header))
+    memory.buf[HEADER.size:HEADER.size + len(header)] = header
+    for array_offset, array in arrays:
+        view = numpy.ndarray(array.shape, array.dtype, memory.buf,
+                             start + array_offset)
+        view[:] = array
+        del view
+    return SharedLattice(memory)
+
+
+def _attach_memory(name):
+    try:
+        # The publisher owns the block, so workers must not track it.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # The track argument was added in Python 3.13.
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach(name, control_system):
+    """Attach to a lattice published in shared memory.
+
+    Args:
+        name (str): The name of the shared memory block.
+        control_system (ControlSystem): The control system of this process.
+
+    Returns:
+        SharedEpicsLattice: A read-only lattice reading its structure from the
+                             block, whose elements are built when first used.
+
+    Raises:
+        DataSourceException: if shared memory is not available.
+        FileNotFoundError: if there is no block with the name.
+    """
+    _check_available()
+    memory = _attach_memory(name)
+    length, = HEADER.unpack_from(memory.buf, 0)
+    manifest = json.loads(bytes(memory.buf[HEADER.size:
+                                           HEADER.size + length])
+                          .decode('utf-8'))
+    start = _align(HEADER.size + length)
+    tables = {}
+    for table_name, columns in manifest['tables'].items():
+        tables[table_name] = table = {}
+        for column, spec in columns.items():
+            array = numpy.ndarray(spec['length'], numpy.dtype(spec['dtype']),
+                                  memory.buf, start + spec['offset'])
+            array.flags.writeable = False
+            missing = None
+            if spec['missing'] is not None:
+                missing = numpy.ndarray(spec['length'], bool, memory.buf,
+                                        start + spec['missing'])
+                missing.flags.writeable = False
+            table[column] = SharedColumn(array, missing)
+    lattice = SharedEpicsLattice(manifest['name'], control_system, tables,
+                                 memory)
+    lattice.set_value('energy', manifest['energy'], units=pytac.ENG)
+    return lattice
@@ -1,6 +1,9 @@
 """Classes for use in unit conversion."""
+import collections
+import threading
 import pytac
 import numpy
+from pytac import utils
 from pytac.exceptions import UnitsException
 from scipy.interpolate import PchipInterpolator
 
@@ -17,6 +20,195 @@ def unit_function(value):
     return value
 
 
+class Rigidity(object):
+    """The magnetic rigidity of the beam at a given energy.
+
+    The field of magnets such as quadrupoles must be divided by the rigidity
+    to give their strength. A single Rigidity is shared by every unit
+    conversion that needs it, through its div and mult methods, so changing
+    the energy rescales all of them at once.
+
+    **Attributes:**
+
+    Attributes:
+        value (float): The rigidity in T m.
+
+    .. Private Attributes:
+           _energy (float): The beam energy in MeV.
+    """
+    def __init__(self, energy):
+        """
+        Args:
+            energy (float): The beam energy in MeV.
+
+        **Methods:**
+        """
+        self.energy = energy
+
+    @property
+    def energy(self):
+        """float: The beam energy in MeV. Setting it recomputes the rigidity."""
+        return self._energy
+
+    @energy.setter
+    def energy(self, energy):
+        self._energy = energy
+        self.value = utils.rigidity(energy)
+
+    def div(self, value):
+        """Divide by the rigidity, for use as a post_eng_to_phys function.
+
+        Args:
+            value (float): The value to be divided.
+
+        Returns:
+            float: The value divided by the rigidity.
+        """
+        return value / self.value
+
+    def mult(self, value):
+        """Multiply by the rigidity, for use as a pre_phys_to_eng function.
+
+        Args:
+            value (float): The value to be multiplied.
+
+        Returns:
+            float: The value multiplied by the rigidity.
+        """
+        return value * self.value
+
+
+class ConversionCache(object):
+    """A bounded least recently used cache of unit conversion results.
+
+    Results are keyed by the conversion object, the direction and the value,
+    together with the pre and post functions of the object and the value of
+    any Rigidity they belong to. Replacing those functions or changing the
+    energy therefore never returns stale results. Other changes to a
+    conversion object, such as replacing its coefficients, require the cache
+    to be cleared.
+
+    **Attributes:**
+
+    Attributes:
+        maxsize (int): The most results kept.
+        hits (int): The number of conversions answered from the cache.
+        misses (int): The number of conversions that had to be computed.
+
+    .. Private Attributes:
+           _results (OrderedDict): The cached results, least recently used
+                                    first.
+           _lock (threading.Lock): Protects _results and the statistics.
+    """
+    def __init__(self, maxsize=1024):
+        """
+        Args:
+            maxsize (int): The most results kept.
+
+        **Methods:**
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _function_key(function):
+        owner = getattr(function, '__self__', None)
+        if isinstance(owner, Rigidity):
+            return (function, owner.value)
+        return function
+
+    def convert(self, uc, value, origin, target):
+        """Convert a value with a conversion object, using cached results.
+
+        Values that cannot be hashed, such as arrays, are converted without
+        the cache.
+
+        Args:
+            uc (UnitConv): The conversion object.
+            value (float): The value to be converted.
+            origin (str): pytac.ENG or pytac.PHYS.
+            target (str): pytac.ENG or pytac.PHYS.
+
+        Returns:
+            float: The result value.
+        """
+        try:
+            key = (uc, origin, target, value,
+                   self._function_key(uc._post_eng_to_phys),
+                   self._function_key(uc._pre_phys_to_eng))
+            hash(key)
+        except TypeError:
+            return uc._convert(value, origin, target)
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                result = self._results.pop(key)
+                self._results[key] = result
+                return result
+            self.misses += 1
+        result = uc._convert(value, origin, target)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        """Remove all the cached results and reset the statistics."""
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_info(self):
+        """Get the statistics of the cache.
+
+        Returns:
+            dict: The hits, misses, current size and maxsize of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._results), 'maxsize': self.maxsize}
+
+
+# The cache used by UnitConv.convert, None when caching is disabled.
+_conversion_cache = None
+
+
+def enable_conversion_cache(maxsize=1024):
+    """Cache the results of all unit conversions.
+
+    Args:
+        maxsize (int): The most results kept.
+
+    Returns:
+        ConversionCache: The new cache.
+    """
+    global _conversion_cache
+    _conversion_cache = ConversionCache(maxsize)
+    return _conversion_cache
+
+
+def disable_conversion_cache():
+    """Stop caching the results of unit conversions."""
+    global _conversion_cache
+    _conversion_cache = None
+
+
+def get_conversion_cache_info():
+    """Get the statistics of the conversion cache.
+
+    Returns:
+        dict: The hits, misses, current size and maxsize of the cache, or None
+               if caching is disabled.
+    """
+    cache = _conversion_cache
+    return None if cache is None else cache.get_info()
+
+
 class UnitConv(object):
     """Class to convert between physics and engineering units.
 
@@ -49,6 +241,35 @@ class UnitConv(object):
         self._post_eng_to_phys = post_eng_to_phys
         self._pre_phys_to_eng = pre_phys_to_eng
 
+    # The number of changes made to the pre and post functions of this
+    # object, which tells a UnitConvBank packing it when to rebuild.
+    _version = 0
+    # The number of such changes made to any object, which tells a bank
+    # when to check the versions of the objects it packed.
+    _changes = 0
+
+    def _changed(self):
+        self._version += 1
+        UnitConv._changes += 1
+
+    def _get_post_eng_to_phys(self):
+        return self._post_function
+
+    def _set_post_eng_to_phys(self, function):
+        self._post_function = function
+        self._changed()
+
+    def _get_pre_phys_to_eng(self):
+        return self._pre_function
+
+    def _set_pre_phys_to_eng(self, function):
+        self._pre_function = function
+        self._changed()
+
+    _post_eng_to_phys = property(_get_post_eng_to_phys,
+                                 _set_post_eng_to_phys)
+    _pre_phys_to_eng = property(_get_pre_phys_to_eng, _set_pre_phys_to_eng)
+
     def _raw_eng_to_phys(self, value):
         """Function to be implemented by child classes.
 
@@ -103,6 +324,8 @@ class UnitConv(object):
 
     def convert(self, value, origin, target):
         """
+        If the conversion cache is enabled the result may come from it.
+
         Args:
             value (float):
             origin (str): pytac.ENG or pytac.PHYS
@@ -114,6 +337,12 @@ class UnitConv(object):
         Raises:
             UnitsException: invalid conversion.
         """
+        cache = _conversion_cache
+        if cache is None or origin == target:
+            return self._convert(value, origin, target)
+        return cache.convert(self, value, origin, target)
+
+    def _convert(self, value, origin, target):
         if origin == target:
             return value
         if origin == pytac.PHYS and target == pytac.ENG:
@@ -316,3 +545,364 @@ class NullUnitConv(UnitConv):
             float: The unconverted given physics value.
         """
         return phys_value
+
+
+def _rigidity_of(function, method):
+    """The Rigidity whose bound method function is, or None."""
+    rigidity = getattr(function, '__self__', None)
+    if not isinstance(rigidity, Rigidity):
+        return None
+    # On Python 2 method is an unbound method rather than a function.
+    method = getattr(method, '__func__', method)
+    return rigidity if getattr(function, '__func__', None) is method else None
+
+
+class UnitConvBank(object):
+    """Batched unit conversion for many unit conversion objects at once.
+
+    Each entry of the bank is a unit conversion object, usually that of one
+    field of one element. The polynomial coefficients of all the
+    PolyUnitConvs are packed into one coefficient matrix, padded with leading
+    zeros, and the breakpoints and coefficients of all the PchipUnitConvs are
+    concatenated with an offset for each entry. Any selection of entries can
+    then be converted with a few vectorised numpy operations, evaluated in
+    the same order as numpy.polyval and scipy's PPoly so that the results
+    match those of the individual objects exactly. The padding is skipped, so
+    infinite values give the infinite limit of each polynomial, where
+    numpy.polyval gives NaN.
+
+    Conversions with no closed form, from physics to engineering units for
+    PchipUnitConvs and for PolyUnitConvs of degree greater than one, and any
+    conversion using pre or post functions other than unit_function or the
+    methods of a Rigidity, fall back to the individual objects.
+
+    The bank rebuilds itself when the pre or post function of one of its unit
+    conversion objects has been changed since it was built. Each object
+    counts its own changes, so changes to other objects do not rebuild it.
+
+    **Attributes:**
+
+    Attributes:
+        unitconvs (list): The unit conversion object of each entry.
+        keys (list): The key of each entry, for example an (element, field)
+                      pair.
+
+    .. Private Attributes:
+           _index (dict): The entry of each key.
+           _kind (numpy.ndarray): The kind of each entry, one of the _NULL,
+                                   _POLY, _PCHIP or _OTHER constants.
+           _coef (numpy.ndarray): The padded polynomial coefficients of each
+                                   entry, in decreasing powers.
+           _first (numpy.ndarray): The column of the first coefficient of
+                                    each entry, after the padding.
+           _linear (numpy.ndarray): True for the polynomials of degree one.
+           _start (numpy.ndarray): The offset of the breakpoints of each pchip
+                                    entry in _breaks.
+           _stop (numpy.ndarray): The offset of the last interval of each
+                                   pchip entry in _breaks.
+           _breaks (numpy.ndarray): The concatenated pchip breakpoints.
+           _pchip_coef (numpy.ndarray): The concatenated cubic coefficients of
+                                         each pchip interval.
+           _rigidities (list): The distinct Rigidity objects used.
+           _post (numpy.ndarray): The index in _rigidities of the post
+                                   function of each entry, -1 for none.
+           _pre (numpy.ndarray): The index in _rigidities of the pre function
+                                  of each entry, -1 for none.
+           _all (numpy.ndarray): The indices of all the entries.
+           _all_masks (dict): The masks of all the entries, computed the first
+                               time all of them are converted.
+           _versions (list): The version of each unit conversion object
+                              when the bank was built.
+           _changes (int): The count of changes to the pre and post
+                            functions of all unit conversion objects when
+                            the versions were last checked.
+    """
+    _NULL = 0
+    _POLY = 1
+    _PCHIP = 2
+    _OTHER = 3
+
+    def __init__(self, unitconvs, keys=None):
+        """
+        Args:
+            unitconvs (sequence): The unit conversion object of each entry.
+            keys (sequence): The key of each entry. Defaults to the entry
+                              numbers.
+
+        **Methods:**
+        """
+        self.unitconvs = list(unitconvs)
+        n = len(self.unitconvs)
+        self.keys = list(range(n)) if keys is None else list(keys)
+        self._index = dict((key, i) for i, key in enumerate(self.keys))
+        self._all = numpy.arange(n, dtype=numpy.intp)
+        self._build()
+
+    def _build(self):
+        """Pack the unit conversion objects into arrays."""
+        n = len(self.unitconvs)
+        self._changes = UnitConv._changes
+        self._versions = self._get_versions()
+        self._all_masks = None
+        self._kind = numpy.full(n, self._OTHER, dtype=numpy.int8)
+        self._rigidities = []
+        self._post = numpy.full(n, -1, dtype=numpy.intp)
+        self._pre = numpy.full(n, -1, dtype=numpy.intp)
+        degree = max([len(uc.p.coeffs) for uc in self.unitconvs
+                      if isinstance(uc, PolyUnitConv)] or [1])
+        self._coef = numpy.zeros((n, degree))
+        self._first = numpy.zeros(n, dtype=numpy.intp)
+        self._linear = numpy.zeros(n, dtype=bool)
+        self._start = numpy.zeros(n, dtype=numpy.intp)
+        self._stop = numpy.zeros(n, dtype=numpy.intp)
+        breaks = []
+        pchip_coef = []
+        offset = 0
+        for i, uc in enumerate(self.unitconvs):
+            if not self._add_functions(i, uc):
+                continue
+            if isinstance(uc, NullUnitConv):
+                self._kind[i] = self._NULL
+            elif isinstance(uc, PolyUnitConv):
+                self._kind[i] = self._POLY
+                coeffs = uc.p.coeffs
+                self._first[i] = degree - len(coeffs)
+                self._coef[i, self._first[i]:] = coeffs
+                self._linear[i] = len(coeffs) == 2 and coeffs[0] != 0
+            elif isinstance(uc, PchipUnitConv):
+                self._kind[i] = self._PCHIP
+                self._start[i] = offset
+                self._stop[i] = offset + len(uc.pp.x) - 2
+                breaks.append(uc.pp.x)
+                pchip_coef.append(uc.pp.c.T)
+                offset += len(uc.pp.x)
+                # Keep the offsets of the coefficients in step with breaks.
+                pchip_coef.append(numpy.zeros((1, uc.pp.c.shape[0])))
+        self._breaks = numpy.concatenate(breaks) if breaks else numpy.zeros(0)
+        self._pchip_coef = (numpy.concatenate(pchip_coef) if pchip_coef
+                            else numpy.zeros((0, 4)))
+
+    def _get_versions(self):
+        return [getattr(uc, '_version', 0) for uc in self.unitconvs]
+
+    def _check_versions(self):
+        """Rebuild the bank if the pre or post function of one of its unit
+        conversion objects has changed. Changes to other objects, such as
+        those built for new elements, do not cause a rebuild.
+        """
+        self._changes = UnitConv._changes
+        if self._get_versions() != self._versions:
+            self._build()
+
+    def _add_functions(self, i, uc):
+        """Record the pre and post functions of an entry.
+
+        Returns:
+            bool: False if a function cannot be applied in a batch.
+        """
+        for function, method, indices in (
+                (uc._post_eng_to_phys, Rigidity.div, self._post),
+                (uc._pre_phys_to_eng, Rigidity.mult, self._pre)):
+            if function is unit_function:
+                continue
+            rigidity = _rigidity_of(function, method)
+            if rigidity is None:
+                return False
+            for j, r in enumerate(self._rigidities):
+                if r is rigidity:
+                    break
+            else:
+                j = len(self._rigidities)
+                self._rigidities.append(rigidity)
+            indices[i] = j
+        return True
+
+    def __len__(self):
+        """The number of entries in the bank.
+
+        Returns:
+            int: The number of entries.
+        """
+        return len(self.unitconvs)
+
+    def get_indices(self, keys):
+        """Get the entries of keys.
+
+        Args:
+            keys (sequence): The keys, for example (element, field) pairs.
+
+        Returns:
+            numpy.ndarray: The entry of each key.
+
+        Raises:
+            KeyError: if a key is not in the bank.
+        """
+        return numpy.array([self._index[key] for key in keys],
+                           dtype=numpy.intp)
+
+    def _get_masks(self, indices):
+        """The masks selecting the entries converted by each method."""
+        if indices is self._all and self._all_masks is not None:
+            return self._all_masks
+        kind = self._kind[indices]
+        poly = kind == self._POLY
+        linear = poly & self._linear[indices]
+        masks = {
+            'poly': poly,
+            'pchip': kind == self._PCHIP,
+            'linear': linear,
+            # The entries converted by the objects, for each direction.
+            'other_to_phys': kind == self._OTHER,
+            'other_to_eng': ~((kind == self._NULL) | linear),
+            'post': self._post[indices],
+            'pre': self._pre[indices],
+        }
+        if indices is self._all:
+            self._all_masks = masks
+        return masks
+
+    def _apply_rigidity(self, values, rigidity, divide):
+        scaled = rigidity >= 0
+        if numpy.any(scaled):
+            factors = numpy.array([r.value for r in self._rigidities])
+            if divide:
+                values[scaled] = values[scaled] / factors[rigidity[scaled]]
+            else:
+                values[scaled] = values[scaled] * factors[rigidity[scaled]]
+
+    def _poly_eng_to_phys(self, values, indices):
+        first = self._first[indices]
+        result = numpy.zeros_like(values)
+        for j, coefficient in enumerate(self._coef[indices].T):
+            # Skip the padding, as 0 * inf would turn infinite values into
+            # NaN.
+            numpy.multiply(result, values, out=result, where=first < j)
+            numpy.add(result, coefficient, out=result, where=first <= j)
+        return result
+
+    def _pchip_eng_to_phys(self, values, indices):
+        low = self._start[indices]
+        high = self._stop[indices]
+        # Binary search for the interval containing each value, which is
+        # the first or last interval for values outside the breakpoints.
+        while numpy.any(low < high):
+            middle = (low + high + 1) // 2
+            below = self._breaks[middle] <= values
+            low = numpy.where(below, middle, low)
+            high = numpy.where(below, high, middle - 1)
+        s = values - self._breaks[low]
+        c = self._pchip_coef[low]
+        # Summed in increasing powers, as scipy's PPoly evaluates them.
+        result = 0.0 + c[:, -1] * 1.0
+        z = numpy.ones_like(s)
+        for k in range(c.shape[1] - 2, -1, -1):
+            z *= s
+            result += c[:, k] * z
+        return result
+
+    def eng_to_phys(self, values, indices=None, out=None):
+        """Convert values from engineering to physics units.
+
+        Args:
+            values (array-like): The value of each entry converted.
+            indices (array-like): The entries of the values. Defaults to all
+                                   the entries, in order.
+            out (numpy.ndarray): A float array to store the converted values
+                                  in; see convert().
+
+        Returns:
+            numpy.ndarray: The converted values.
+        """
+        return self.convert(values, pytac.ENG, pytac.PHYS, indices, out)
+
+    def phys_to_eng(self, values, indices=None, out=None):
+        """Convert values from physics to engineering units.
+
+        Args:
+            values (array-like): The value of each entry converted.
+            indices (array-like): The entries of the values. Defaults to all
+                                   the entries, in order.
+            out (numpy.ndarray): A float array to store the converted values
+                                  in; see convert().
+
+        Returns:
+            numpy.ndarray: The converted values.
+        """
+        return self.convert(values, pytac.PHYS, pytac.ENG, indices, out)
+
+    def convert(self, values, origin, target, indices=None, out=None):
+        """Convert values between engineering and physics units.
+
+        Args:
+            values (array-like): The value of each entry converted.
+            origin (str): pytac.ENG or pytac.PHYS.
+            target (str): pytac.ENG or pytac.PHYS.
+            indices (array-like): The entries of the values. Defaults to all
+                                   the entries, in order.
+            out (numpy.ndarray): A float array of the same shape as the
+                                  values to store the converted values in,
+                                  for example one reused between calls. It
+                                  may be the values themselves, to convert
+                                  them in place.
+
+        Returns:
+            numpy.ndarray: The converted values, in out if it is given.
+
+        Raises:
+            UnitsException: invalid conversion.
+        """
+        if self._changes != UnitConv._changes:
+            self._check_versions()
+        values = numpy.asarray(values, dtype=float)
+        if indices is None:
+            indices = self._all
+        else:
+            indices = numpy.asarray(indices, dtype=numpy.intp)
+        if values.shape != indices.shape:
+            raise UnitsException("Expected {0} values but got {1}."
+                                 .format(indices.shape, values.shape))
+        if out is None:
+            result = values.copy()
+        elif out.shape != values.shape:
+            raise UnitsException("Expected an output array of shape {0} but "
+                                 "got {1}.".format(values.shape, out.shape))
+        else:
+            if out is not values:
+                out[...] = values
+            result = out
+        if origin == target:
+            return result
+        if origin == pytac.ENG and target == pytac.PHYS:
+            to_phys = True
+        elif origin == pytac.PHYS and target == pytac.ENG:
+            to_phys = False
+        else:
+            raise UnitsException("Conversion from {0} to {1} not understood."
+                                 .format(origin, target))
+        masks = self._get_masks(indices)
+        others = numpy.flatnonzero(
+            masks['other_to_phys' if to_phys else 'other_to_eng'])
+        # Keep the original values for the objects, in case the result is
+        # being stored in the values themselves.
+        originals = values[others]
+        if to_phys:
+            poly = masks['poly']
+            if numpy.any(poly):
+                result[poly] = self._poly_eng_to_phys(values[poly],
+                                                      indices[poly])
+            pchip = masks['pchip']
+            if numpy.any(pchip):
+                result[pchip] = self._pchip_eng_to_phys(values[pchip],
+                                                        indices[pchip])
+            self._apply_rigidity(result, masks['post'], True)
+        else:
+            self._apply_rigidity(result, masks['pre'], False)
+            linear = masks['linear']
+            if numpy.any(linear):
+                # The root of a x + (b - y), computed as numpy.roots does.
+                coef = self._coef[indices[linear]]
+                result[linear] = -(coef[:, -1] - result[linear]) / coef[:, -2]
+        for i, value in zip(others, originals):
+            result[i] = self.unitconvs[indices[i]].convert(value, origin,
+                                                           target)
+        return result
@@ -3,6 +3,13 @@ import math
 import scipy.constants
 
 
+try:
+    # The types of PV names, which may be unicode in Python 2.
+    string_types = (basestring,)  # noqa: F821
+except NameError:
+    string_types = (str,)
+
+
 electron_mass_name = 'electron mass energy equivalent in MeV'
 electron_mass_mev, _, _ = (scipy.constants
                            .physical_constants[electron_mass_name])
@@ -20,3 +27,39 @@ def rigidity(energy_mev):
     energy_j = energy_mev * 1e6 * scipy.constants.e
     p = beta * energy_j / scipy.constants.c
     return p / scipy.constants.e
+
+
+def is_read_error(value):
+    """Whether a value returned by a control system reports a failed read.
+
+    Control systems may report a failed read by returning None, an exception
+    or an object whose ok attribute is False, as cothread's ca_nothing does.
+
+    Args:
+        value (object): A value returned by a control system.
+
+    Returns:
+        bool: True if the value represents a failed read.
+    """
+    if value is None or isinstance(value, Exception):
+        return True
+    return not getattr(value, 'ok', True)
+
+
+def is_valid_value(value):
+    """Whether a value returned by a control system is a usable value.
+
+    Failed reads, see is_read_error(), and NaN are not valid.
+
+    Args:
+        value (object): A value returned by a control system.
+
+    Returns:
+        bool: False if the value represents a failed read or is NaN.
+    """
+    if is_read_error(value):
+        return False
+    try:
+        return not math.isnan(value)
+    except TypeError:
+        return True
@@ -71,7 +71,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['numpy', 'scipy'],
+    install_requires=['numpy', 'scipy', 'futures; python_version < "3"'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
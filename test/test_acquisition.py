@@ -0,0 +1,62 @@
+import numpy
+import pytest
+from pytac.acquisition import RingBuffer, FamilyAcquisition
+
+
+def test_ring_buffer_get_last_is_chronological_view():
+    buf = RingBuffer(3, 2)
+    for i in range(5):
+        buf.append([i, -i])
+    last = buf.get_last()
+    numpy.testing.assert_equal(last, [[2, -2], [3, -3], [4, -4]])
+    numpy.testing.assert_equal(buf.get_last(1), [[4, -4]])
+    assert numpy.shares_memory(last, buf._data)
+    assert not last.flags.writeable
+
+
+def test_ring_buffer_len_and_too_many_samples_raises_ValueError():
+    buf = RingBuffer(4, 1)
+    buf.append([1])
+    assert len(buf) == 1
+    with pytest.raises(ValueError):
+        buf.get_last(2)
+
+
+def test_ring_buffer_append_wrong_shape_raises_ValueError():
+    buf = RingBuffer(4, 2)
+    with pytest.raises(ValueError):
+        buf.append([1, 2, 3])
+
+
+@pytest.mark.parametrize('n_samples', [1, 3, 5, 8, 13])
+def test_ring_buffer_statistics_match_rescan(n_samples):
+    buf = RingBuffer(4, 3)
+    samples = numpy.random.RandomState(1).normal(size=(n_samples, 3))
+    for sample in samples:
+        buf.append(sample)
+    window = samples[-4:]
+    numpy.testing.assert_allclose(buf.mean(), window.mean(axis=0))
+    numpy.testing.assert_allclose(buf.rms(),
+                                  numpy.sqrt((window ** 2).mean(axis=0)))
+    numpy.testing.assert_allclose(buf.std(), window.std(axis=0), atol=1e-12)
+
+
+def test_family_acquisition_stream(simple_epics_lattice):
+    acq = FamilyAcquisition(simple_epics_lattice, 'family', ['x'], 10)
+    samples = list(acq.stream(rate=1000, count=3))
+    assert len(samples) == 3
+    numpy.testing.assert_equal(acq.get_last('x'), [[40.0]] * 3)
+    numpy.testing.assert_equal(acq.mean('x'), [40.0])
+    numpy.testing.assert_equal(acq.rms('x'), [40.0])
+
+
+def test_family_acquisition_uses_element_values_without_get_values(simple_lattice):
+    acq = FamilyAcquisition(simple_lattice, 'family', ['x'], 2)
+    acq.acquire()
+    numpy.testing.assert_equal(acq.get_last('x', 1), [[40.0]])
+
+
+def test_stream_with_invalid_rate_raises_ValueError(simple_epics_lattice):
+    acq = FamilyAcquisition(simple_epics_lattice, 'family', ['x'], 2)
+    with pytest.raises(ValueError):
+        next(acq.stream(rate=0))
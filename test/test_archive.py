@@ -0,0 +1,95 @@
+import numpy
+import pytest
+import pytac
+from pytac.archive import Archive, attach_archive, write_archive
+
+
+@pytest.fixture
+def archive(tmpdir):
+    samples = {'Q1:RB': ([1.0, 3.0], [10.0, 30.0]),
+               'Q1:SP': ([2.0], [20.0]),
+               'S1:RB': ([0.0, 3.0], [5.0, 6.0])}
+    write_archive(str(tmpdir), samples, ['Q1:RB', 'Q1:SP', 'S1:RB'])
+    return Archive(str(tmpdir))
+
+
+def test_archive_holds_last_value(archive):
+    numpy.testing.assert_equal(archive.timestamps, [0.0, 1.0, 2.0, 3.0])
+    assert archive.get_value('Q1:RB', 2.5) == 10.0
+    assert archive.get_value('Q1:RB', 3.0) == 30.0
+    assert numpy.isnan(archive.get_value('Q1:SP', 1.0))
+
+
+def test_archive_get_values_contiguous_columns_are_views(archive):
+    values = archive.get_values(['Q1:RB', 'Q1:SP'], 2.0)
+    numpy.testing.assert_equal(values, [10.0, 20.0])
+    assert numpy.shares_memory(values, archive.values)
+    numpy.testing.assert_equal(archive.get_values(['S1:RB', 'Q1:RB'], 3.0),
+                               [6.0, 30.0])
+
+
+def test_archive_raises_DataSourceException(archive):
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        archive.get_value('Q1:RB')
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        archive.get_value('Q1:RB', -1.0)
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        archive.get_value('not_a_pv', 1.0)
+
+
+def test_lattice_replays_archive(lattice, archive):
+    attach_archive(lattice, archive)
+    lattice.set_replay_time(2.0)
+    quad = lattice.get_elements('quad')[0]
+    assert quad.get_value('b1', pytac.RB, data_source=pytac.ARCHIVE) == 10.0
+    assert quad.get_value('b1', pytac.SP, data_source=pytac.ARCHIVE) == 20.0
+    assert lattice.get_value('energy', data_source=pytac.ARCHIVE) == 3000
+    lattice.set_default_data_source(pytac.ARCHIVE)
+    lattice.set_replay_time(3.0)
+    assert quad.get_value('b1') == 30.0
+    numpy.testing.assert_equal(lattice.get_values('quad', 'b1', pytac.RB),
+                               [30.0])
+    lattice._cs.get.assert_not_called()
+
+
+def test_lattice_archive_values_can_be_modified(lattice, archive):
+    attach_archive(lattice, archive)
+    lattice.set_replay_time(3.0)
+    values = lattice.get_values('quad', 'b1', pytac.RB, dtype=float,
+                                data_source=pytac.ARCHIVE)
+    values += 1.0
+    numpy.testing.assert_equal(values, [31.0])
+    assert archive.get_value('Q1:RB', 3.0) == 30.0
+
+
+def test_set_default_data_source_error_lists_archive(lattice):
+    with pytest.raises(pytac.exceptions.DataSourceException) as excinfo:
+        lattice.set_default_data_source('invalid')
+    assert pytac.ARCHIVE in str(excinfo.value)
+
+
+def test_archive_data_source_is_read_only(lattice, archive):
+    attach_archive(lattice, archive)
+    quad = lattice.get_elements('quad')[0]
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        quad.set_value('b1', 1.0, data_source=pytac.ARCHIVE)
+
+
+def test_set_replay_time_without_archive_raises_DataSourceException(lattice):
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        lattice.set_replay_time(0.0)
+
+
+def test_bulk_reads_from_sim_raise_DataSourceException(lattice):
+    for read in (lambda: lattice.get_values('quad', 'b1', pytac.RB,
+                                            data_source=pytac.SIM),
+                 lambda: lattice.get_values('quad', 'b1', pytac.RB,
+                                            data_source=pytac.SIM,
+                                            masked=True),
+                 lambda: lattice.get_waveforms('quad', 'b1',
+                                               data_source=pytac.SIM),
+                 lambda: lattice.get_snapshot([('quad', 'b1', pytac.RB)],
+                                              data_source=pytac.SIM)):
+        with pytest.raises(pytac.exceptions.DataSourceException):
+            read()
+    assert not lattice._cs.get.called
@@ -0,0 +1,188 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import mock
+import numpy
+import pytest
+import pytac
+from pytac import utils
+from pytac.breaker_cs import CircuitBreakerControlSystem
+
+
+class FlakyControlSystem(pytac.cs.ControlSystem):
+    """Reads of PVs in down raise, as a whole batch, like a timeout would."""
+    def __init__(self):
+        self.down = set()
+        self.calls = []
+
+    def get(self, pv):
+        self.calls.append(pv)
+        pvs = [pv] if isinstance(pv, str) else pv
+        if self.down.intersection(pvs):
+            raise Exception('timeout')
+        values = [float(len(p)) for p in pvs]
+        return values[0] if isinstance(pv, str) else values
+
+    def put(self, pv, value):
+        pass
+
+
+class ThreadBoundControlSystem(FlakyControlSystem):
+    """Only accepts calls from its own thread, like cothread."""
+    def __init__(self):
+        FlakyControlSystem.__init__(self)
+        self._executor = ThreadPoolExecutor(1)
+        self.owner = self._executor.submit(threading.current_thread).result()
+
+    def get(self, pv):
+        assert threading.current_thread() is self.owner
+        return FlakyControlSystem.get(self, pv)
+
+    def run(self, function, *args, **kwargs):
+        return self._executor.submit(function, *args, **kwargs).result()
+
+
+def mock_cs():
+    wrapped = mock.MagicMock()
+    wrapped.run.side_effect = lambda function, *args: function(*args)
+    return wrapped
+
+
+@pytest.fixture
+def flaky_cs():
+    return FlakyControlSystem()
+
+
+def test_failing_pv_is_opened_and_skipped(flaky_cs):
+    cs = CircuitBreakerControlSystem(flaky_cs, failure_threshold=2,
+                                     backoff=60)
+    flaky_cs.down.add('B')
+    for _ in range(2):
+        values, valid = cs.get_partial(['A', 'B', 'CC'])
+        assert values[0] == 1.0 and values[2] == 2.0
+        assert numpy.isnan(values[1])
+        numpy.testing.assert_equal(valid, [True, False, True])
+    assert cs.get_open_pvs() == ['B']
+    del flaky_cs.calls[:]
+    values = cs.get(['A', 'B', 'CC'])
+    assert flaky_cs.calls == [['A', 'CC']]
+    assert numpy.isnan(values[1])
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.get('B')
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.put(['A', 'B'], [1, 2])
+
+
+def test_retry_closes_recovered_pv_with_backoff(flaky_cs):
+    cs = CircuitBreakerControlSystem(flaky_cs, failure_threshold=1,
+                                     backoff=0.0, max_backoff=0.0)
+    flaky_cs.down.add('B')
+    cs.get_partial(['B'])
+    assert cs.is_open('B')
+    assert cs.retry_open() == []
+    assert cs.is_open('B')
+    flaky_cs.down.clear()
+    assert cs.retry_open() == ['B']
+    assert not cs.is_open('B')
+    assert cs.get('B') == 1.0
+
+
+def test_backoff_doubles_up_to_max(flaky_cs):
+    cs = CircuitBreakerControlSystem(flaky_cs, failure_threshold=1,
+                                     backoff=1.0, max_backoff=3.0)
+    flaky_cs.down.add('B')
+    cs.get_partial(['B'])
+    health = cs._health['B']
+    assert health.backoff == 1.0
+    for expected in (2.0, 3.0):
+        health.retry_time = 0
+        cs.retry_open()
+        assert health.backoff == expected
+
+
+def test_background_retry_thread(flaky_cs):
+    cs = CircuitBreakerControlSystem(flaky_cs, failure_threshold=1,
+                                     backoff=0.0)
+    flaky_cs.down.add('B')
+    cs.get_partial(['B'])
+    flaky_cs.down.clear()
+    cs.start(interval=0.001)
+    try:
+        deadline = time.time() + 5
+        while cs.is_open('B') and time.time() < deadline:
+            time.sleep(0.001)
+    finally:
+        cs.stop()
+    assert not cs.is_open('B')
+
+
+def test_failed_values_returned_by_control_system_are_masked():
+    wrapped = mock_cs()
+    wrapped.get.return_value = [1.0, None, float('nan')]
+    cs = CircuitBreakerControlSystem(wrapped)
+    values, valid = cs.get_partial(['A', 'B', 'C'])
+    numpy.testing.assert_equal(valid, [True, False, True])
+    assert wrapped.get.call_count == 1
+
+
+def test_nan_values_do_not_open_the_circuit():
+    wrapped = mock_cs()
+    wrapped.get.return_value = float('nan')
+    cs = CircuitBreakerControlSystem(wrapped, failure_threshold=1)
+    for _ in range(3):
+        assert numpy.isnan(cs.get('A'))
+    assert not cs.is_open('A')
+    cs.put('A', 1.0)
+
+
+def test_failed_batch_is_read_again_concurrently():
+    reading = []
+    all_reading = threading.Event()
+
+    class SlowControlSystem(pytac.cs.ControlSystem):
+        def get(self, pv):
+            if not isinstance(pv, str):
+                raise Exception('timeout')
+            # Only succeeds once all three PVs are being read at once.
+            reading.append(pv)
+            if len(reading) == 3:
+                all_reading.set()
+            return 1.0 if all_reading.wait(5) else None
+
+    cs = CircuitBreakerControlSystem(SlowControlSystem(), max_workers=3)
+    values, valid = cs.get_partial(['A', 'B', 'C'])
+    assert values == [1.0, 1.0, 1.0]
+
+
+def test_wrapped_control_system_is_called_on_its_own_thread():
+    wrapped = ThreadBoundControlSystem()
+    cs = CircuitBreakerControlSystem(wrapped, failure_threshold=1,
+                                     backoff=0.0)
+    wrapped.down.add('B')
+    values, valid = cs.get_partial(['A', 'B', 'CC'])
+    numpy.testing.assert_equal(valid, [True, False, True])
+    wrapped.down.clear()
+    cs.start(interval=0.001)
+    try:
+        deadline = time.time() + 5
+        while cs.is_open('B') and time.time() < deadline:
+            time.sleep(0.001)
+    finally:
+        cs.stop()
+    assert not cs.is_open('B')
+    assert cs.get('CC') == 2.0
+
+
+@pytest.mark.parametrize('value, expected',
+                         [(1.0, True), (None, False), (ValueError(), False),
+                          (float('nan'), False), ('text', True),
+                          (numpy.zeros(3), True)])
+def test_is_valid_value(value, expected):
+    assert utils.is_valid_value(value) == expected
+
+
+@pytest.mark.parametrize('value, expected',
+                         [(1.0, False), (None, True), (ValueError(), True),
+                          (float('nan'), False), (mock.Mock(ok=False), True)])
+def test_is_read_error(value, expected):
+    assert utils.is_read_error(value) == expected
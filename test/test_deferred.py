@@ -0,0 +1,87 @@
+import mock
+import numpy
+import pytest
+import pytac
+from pytac import load_csv
+from pytac.deferred import DeferredValue, Prefetch
+
+
+def fake_get(pv):
+    if isinstance(pv, str):
+        if pv == 'bad':
+            raise ValueError(pv)
+        return float(len(pv))
+    if 'bad' in pv:
+        raise ValueError('bad')
+    return [float(len(p)) for p in pv]
+
+
+@pytest.fixture
+def vmx_lattice():
+    cs = mock.MagicMock()
+    cs.get.side_effect = fake_get
+    return load_csv.load('VMX', cs)
+
+
+def test_element_loop_is_read_in_one_request(vmx_lattice):
+    quads = vmx_lattice.get_elements('QUAD')
+    expected = [q.get_value('b1', units=pytac.PHYS) for q in quads]
+    vmx_lattice._cs.get.reset_mock()
+    with vmx_lattice.prefetch():
+        values = [q.get_value('b1', units=pytac.PHYS) for q in quads]
+        assert isinstance(values[0], DeferredValue)
+        assert not values[0].done()
+        assert vmx_lattice._cs.get.call_count == 0
+    vmx_lattice._cs.get.assert_called_once_with(
+        vmx_lattice.get_pv_names('QUAD', 'b1', pytac.RB))
+    assert [v.result() for v in values] == expected
+    numpy.testing.assert_allclose(numpy.array(values, dtype=float), expected)
+
+
+def test_value_needed_inside_block_reads_pending_pvs():
+    cs = mock.MagicMock()
+    cs.get.side_effect = fake_get
+    with Prefetch(cs) as prefetch:
+        a = prefetch.add('a')
+        bb = prefetch.add('bb')
+        assert a + 1 == 2.0
+        assert 2 * bb == 4.0 and bb > a and -a == -1.0
+        ccc = prefetch.add('ccc')
+    assert cs.get.call_args_list == [mock.call(['a', 'bb']),
+                                     mock.call(['ccc'])]
+    assert float(ccc) == 3.0
+
+
+def test_pvs_requested_again_after_a_read_are_read_again():
+    cs = mock.MagicMock()
+    cs.get.side_effect = [[1.0], [2.0]]
+    with Prefetch(cs) as prefetch:
+        first = prefetch.add('a')
+        shared = prefetch.add('a')
+        assert first.result() == 1.0 and shared.result() == 1.0
+        second = prefetch.add('a')
+        assert not second.done()
+        assert second.result() == 2.0
+        assert prefetch.get_value('a') == 2.0
+    assert first.result() == 1.0
+    assert cs.get.call_args_list == [mock.call(['a']), mock.call(['a'])]
+
+
+def test_failed_reads_only_raise_for_their_values():
+    cs = mock.MagicMock()
+    cs.get.side_effect = fake_get
+    with Prefetch(cs) as prefetch:
+        good = prefetch.add('good')
+        bad = prefetch.add('bad')
+    assert good.result() == 4.0
+    with pytest.raises(ValueError):
+        bad.result()
+
+
+def test_reads_through_other_control_systems_are_not_deferred():
+    cs = mock.MagicMock()
+    other = mock.MagicMock()
+    other.get.return_value = 1.0
+    with Prefetch(cs):
+        device = pytac.epics.EpicsDevice('d', other, rb_pv='pv')
+        assert device.get_value(pytac.RB) == 1.0
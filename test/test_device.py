@@ -1,7 +1,9 @@
 import mock
+import pickle
 import pytac
 import pytest
-from pytac.device import BasicDevice
+from pytac.device import BasicDevice, EnergyDevice
+from pytac.units import Rigidity
 from pytac.epics import EpicsDevice, PvEnabler
 from constants import PREFIX, RB_PV, SP_PV
 
@@ -62,6 +64,27 @@ def test_get_basic_device_value_with_handle():
     assert device.get_value(handle=pytac.RB) == 1.0
 
 
+def test_energy_device_sets_rigidity_energy():
+    rigidity = Rigidity(3000)
+    device = EnergyDevice(rigidity)
+    assert device.get_value() == 3000
+    device.set_value(2500)
+    assert rigidity.energy == 2500
+    assert rigidity.value == pytac.utils.rigidity(2500)
+
+
+def test_pickled_epics_device_drops_control_system():
+    device = EpicsDevice(PREFIX, mock.MagicMock(), PvEnabler('PV', 1,
+                                                             mock.MagicMock()),
+                         RB_PV, SP_PV)
+    unpickled = pickle.loads(pickle.dumps(device))
+    assert unpickled._cs is None and unpickled._enabled._cs is None
+    assert unpickled.rb_pv == RB_PV
+    cs = mock.MagicMock()
+    unpickled.set_control_system(cs)
+    assert unpickled._cs is cs and unpickled._enabled._cs is cs
+
+
 # Generalised device tests.
 @pytest.mark.parametrize('device_creation_function', [create_epics_device,
                          create_basic_device])
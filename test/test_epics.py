@@ -1,6 +1,9 @@
 import numpy
 import pytest
 import pytac
+from pytac.data_source import DeviceDataSource
+from pytac.device import BasicDevice
+from pytac.epics import EpicsDevice, EpicsElement, EpicsLattice
 from constants import DUMMY_ARRAY, RB_PV, SP_PV
 
 
@@ -70,3 +73,150 @@ def test_get_pv_name_raises_DataSourceException_if_no_live_data_source(simple_ep
 def test_create_EpicsDevice_raises_DataSourceException_if_no_PVs_are_given():
     with pytest.raises(pytac.exceptions.DataSourceException):
         pytac.epics.EpicsDevice('device_1', 'a_control_system')
+
+
+@pytest.fixture
+def two_bpm_lattice(simple_epics_lattice, mock_cs, unit_uc):
+    element = EpicsElement(2, 0, 'BPM', 0.0, cell=1)
+    element.add_to_family('family')
+    element.set_data_source(DeviceDataSource(), pytac.LIVE)
+    element.add_device('y', EpicsDevice('y_device', mock_cs, True, 'down:rb'),
+                       unit_uc)
+    simple_epics_lattice.add_element(element)
+    return simple_epics_lattice
+
+
+def test_get_values_masked_marks_elements_without_field(two_bpm_lattice):
+    values = two_bpm_lattice.get_values('family', 'x', pytac.RB, masked=True)
+    assert isinstance(values, numpy.ma.MaskedArray)
+    numpy.testing.assert_equal(values.mask, [False, True])
+    assert values[0] == DUMMY_ARRAY[0]
+    two_bpm_lattice._cs.get.assert_called_with([RB_PV])
+
+
+def test_get_values_masked_marks_failed_reads(two_bpm_lattice):
+    def get(pvs):
+        if len(pvs) > 1:
+            raise Exception('timeout')
+        if pvs == ['down:rb']:
+            raise Exception('timeout')
+        return [1.0]
+    two_bpm_lattice._cs.get.side_effect = get
+    values = two_bpm_lattice.get_values('family', 'y', pytac.RB, masked=True,
+                                        dtype=numpy.float32)
+    assert values.dtype == numpy.float32
+    numpy.testing.assert_equal(values.mask, [False, True])
+    assert values[0] == 1.0
+
+
+def test_get_values_masked_marks_nan_values(simple_epics_lattice):
+    simple_epics_lattice._cs.get.return_value = [float('nan')]
+    values = simple_epics_lattice.get_values('family', 'x', pytac.RB,
+                                             masked=True)
+    assert values.mask.all()
+
+
+def test_find_pv_returns_owner_field_and_handle(simple_epics_lattice,
+                                                simple_epics_element, mock_cs):
+    assert simple_epics_lattice.find_pv(SP_PV) == (simple_epics_element, 'y',
+                                                   pytac.RB)
+    simple_epics_lattice.set_data_source(DeviceDataSource(), pytac.LIVE)
+    device = EpicsDevice('energy', mock_cs, rb_pv='energy:rb')
+    simple_epics_lattice.add_device('energy', device, None)
+    assert simple_epics_lattice.find_pv('energy:rb') == (simple_epics_lattice,
+                                                         'energy', pytac.RB)
+
+
+def test_find_pv_follows_devices_added_to_elements(simple_epics_lattice,
+                                                   simple_epics_element,
+                                                   mock_cs, unit_uc):
+    device = EpicsDevice('x_device', mock_cs, rb_pv='new:rb')
+    simple_epics_element.add_device('x', device, unit_uc)
+    assert simple_epics_lattice.find_pv('new:rb') == (simple_epics_element,
+                                                      'x', pytac.RB)
+    # The replaced device's setpoint PV no longer belongs to the lattice.
+    simple_epics_element.add_device('y', device, unit_uc)
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        simple_epics_lattice.find_pv(SP_PV)
+
+
+def test_find_pvs_accepts_arrays(simple_epics_lattice, simple_epics_element):
+    results = simple_epics_lattice.find_pvs(numpy.array([RB_PV, 'unknown']))
+    assert results == [(simple_epics_element, 'y', pytac.SP), None]
+
+
+def test_find_device_returns_fields_in_ring_order(mock_cs, unit_uc):
+    lattice = EpicsLattice('lattice', mock_cs)
+    elements = []
+    for i in range(3):
+        element = EpicsElement(str(i), 0, 'BPM', 0.0)
+        element.set_data_source(DeviceDataSource(), pytac.LIVE)
+        lattice.add_element(element)
+        elements.append(element)
+    for i in (2, 0, 1):
+        name = 'SR0{0}-BPM'.format(i)
+        for field in ('y', 'x'):
+            device = EpicsDevice(name, mock_cs, rb_pv=name + ':' + field)
+            elements[i].add_device(field, device, unit_uc)
+    assert lattice.find_device('SR01-BPM') == [(elements[1], 'x'),
+                                               (elements[1], 'y')]
+    assert lattice.find_devices('SR0[02]*') == [(elements[0], 'x'),
+                                                (elements[0], 'y'),
+                                                (elements[2], 'x'),
+                                                (elements[2], 'y')]
+    assert lattice.find_devices('SR1*') == []
+    assert lattice.get_element('1') is elements[1]
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        lattice.find_device('unknown')
+
+
+def test_get_snapshot_reads_all_pvs_once(simple_epics_lattice, mock_cs,
+                                         unit_uc):
+    simple_epics_lattice.set_data_source(DeviceDataSource(), pytac.LIVE)
+    device = EpicsDevice('dcct', mock_cs, rb_pv='dcct:rb')
+    simple_epics_lattice.add_device('beam_current', device, unit_uc)
+    simple_epics_lattice.add_device('s_position', BasicDevice([0.0]), unit_uc)
+    mock_cs.get.return_value = [1.0, 2.0, 3.0]
+    requests = [('family', 'x', pytac.RB), ('family', 'y', pytac.RB),
+                ('family', 'x', pytac.SP)]
+    snapshot = simple_epics_lattice.get_snapshot(
+        requests, ['beam_current', 's_position'], dtype=numpy.float64)
+    mock_cs.get.assert_called_once_with([RB_PV, SP_PV, 'dcct:rb'])
+    numpy.testing.assert_equal(snapshot[requests[0]], [1.0])
+    numpy.testing.assert_equal(snapshot[requests[1]], [2.0])
+    numpy.testing.assert_equal(snapshot[requests[2]], [2.0])
+    assert snapshot['beam_current'] == 3.0
+    assert snapshot['s_position'] == [0.0]
+
+
+def test_get_waveforms_copies_into_reused_array(mock_cs, unit_uc):
+    lattice = EpicsLattice('lattice', mock_cs)
+    for i in range(3):
+        element = EpicsElement(str(i), 0, 'BPM', 0.0)
+        element.set_data_source(DeviceDataSource(), pytac.LIVE)
+        device = EpicsDevice('bpm', mock_cs, rb_pv='BPM{0}:TBT'.format(i))
+        element.add_device('x_tbt', device, unit_uc)
+        element.add_to_family('BPM')
+        lattice.add_element(element)
+    mock_cs.get.return_value = [numpy.arange(4.0), numpy.arange(4.0) + 4,
+                                numpy.arange(2.0)]
+    waveforms = lattice.get_waveforms('BPM', 'x_tbt')
+    mock_cs.get.assert_called_once_with(['BPM0:TBT', 'BPM1:TBT', 'BPM2:TBT'])
+    assert waveforms.shape == (3, 4)
+    numpy.testing.assert_equal(waveforms[1], [4, 5, 6, 7])
+    numpy.testing.assert_equal(waveforms[2], [0, 1, numpy.nan, numpy.nan])
+    out = numpy.zeros((3, 3), dtype=numpy.float32)
+    assert lattice.get_waveforms('BPM', 'x_tbt', out=out) is out
+    numpy.testing.assert_equal(out[0], [0, 1, 2])
+    with pytest.raises(ValueError):
+        lattice.get_waveforms('BPM', 'x_tbt', out=numpy.zeros((2, 3)))
+
+
+def test_get_values_fills_output_array(simple_epics_lattice):
+    out = numpy.zeros(1, dtype=numpy.float32)
+    values = simple_epics_lattice.get_values('family', 'x', pytac.RB, out=out)
+    assert values is out
+    numpy.testing.assert_equal(out, DUMMY_ARRAY)
+    with pytest.raises(ValueError):
+        simple_epics_lattice.get_values('family', 'x', pytac.RB,
+                                        out=numpy.zeros(2))
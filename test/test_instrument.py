@@ -0,0 +1,88 @@
+import mock
+import pytest
+import pytac
+from pytac import load_csv
+from pytac.instrument import Instrumentation, LatencyStats, BIN_EDGES
+from constants import RB_PV
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    stats.add(2e-6, items=3)
+    stats.add(0.5)
+    summary = stats.as_dict()
+    assert summary['calls'] == 2
+    assert summary['items'] == 4
+    assert summary['max_batch'] == 3
+    assert summary['max'] == 0.5
+    assert sum(summary['histogram']) == 2
+    assert summary['p50'] <= summary['p99']
+    stats.add(1e6)
+    assert stats.percentile(100) == 1e6
+    assert stats.counts[len(BIN_EDGES)] == 1
+
+
+def test_instrumented_lattice_records_methods_fields_and_pvs(simple_epics_lattice):
+    instrumentation = Instrumentation()
+    instrumentation.attach_lattice(simple_epics_lattice)
+    simple_epics_lattice.get_values('family', 'x', pytac.RB)
+    simple_epics_lattice[0].get_value('x', pytac.RB)
+    summary = instrumentation.get_summary()
+    assert summary['methods']['EpicsLattice.get_values']['calls'] == 1
+    assert summary['methods']['EpicsElement.get_value']['calls'] == 1
+    assert summary['methods']['PolyUnitConv.convert']['calls'] == 1
+    assert summary['fields'][('family', 'x')]['calls'] == 1
+    assert summary['fields'][(None, 'x')]['calls'] >= 1
+    assert summary['pvs'][RB_PV]['calls'] == 2
+    folded = instrumentation.get_folded()
+    assert any(line.startswith('EpicsLattice.get_values;MagicMock.get ')
+               for line in folded)
+    assert 'pvs' in instrumentation.format_summary()
+
+
+def test_detach_restores_original_methods(simple_epics_lattice):
+    instrumentation = Instrumentation()
+    instrumentation.attach(simple_epics_lattice)
+    assert 'get_values' in simple_epics_lattice.__dict__
+    instrumentation.detach_all()
+    assert 'get_values' not in simple_epics_lattice.__dict__
+    simple_epics_lattice.get_values('family', 'x', pytac.RB)
+    assert instrumentation.get_summary()['methods'] == {}
+
+
+def test_detach_restores_instance_attributes():
+    cs = mock.MagicMock()
+    original_get = cs.get
+    instrumentation = Instrumentation()
+    instrumentation.attach(cs, ('get', 'put'))
+    assert cs.get is not original_get
+    cs.get('pv')
+    instrumentation.detach(cs)
+    assert cs.get is original_get
+    original_get.assert_called_once_with('pv')
+
+
+def test_attach_lattice_only_instruments_built_elements():
+    lattice = load_csv.load('VMX', mock.MagicMock(), lazy=True)
+    instrumentation = Instrumentation()
+    instrumentation.attach_lattice(lattice)
+    assert lattice.get_loaded_count() == 0
+    instrumentation.detach_all()
+
+
+def test_attach_unknown_object_raises_ValueError():
+    with pytest.raises(ValueError):
+        Instrumentation().attach(object())
+
+
+def test_reset_and_write_folded(tmpdir):
+    cs = mock.MagicMock()
+    instrumentation = Instrumentation()
+    instrumentation.attach(cs, ('get',))
+    cs.get([RB_PV])
+    filename = str(tmpdir.join('trace.folded'))
+    instrumentation.write_folded(filename)
+    with open(filename) as folded:
+        assert folded.read().startswith('MagicMock.get ')
+    instrumentation.reset()
+    assert instrumentation.get_folded() == []
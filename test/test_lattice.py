@@ -1,9 +1,10 @@
+import mock
 import numpy
 import pytest
 import pytac
 from pytac.element import Element
 from pytac.lattice import Lattice
-from constants import DUMMY_ARRAY, LATTICE_NAME
+from constants import DUMMY_ARRAY, DUMMY_VALUE_1, LATTICE_NAME
 
 
 def test_create_lattice():
@@ -56,7 +57,8 @@ def test_get_element_devices_raises_exceptions_correctly_for_mismatched_family(s
     del basic_element._data_source_manager._data_sources[pytac.LIVE]
     basic_lattice.add_element(basic_element)
     devices = basic_lattice.get_element_devices('family', 'x')
-    assert devices == []
+    assert devices == [None]
+    assert basic_lattice.get_element_device_names('family', 'x') == [None]
 
 
 def test_get_element_devices_raises_FieldException_if_field_not_matched(simple_lattice):
@@ -90,6 +92,37 @@ def test_lattice_get_elements_by_cell(simple_lattice):
         simple_lattice.get_elements(cell=2)
 
 
+def test_get_element_by_name(simple_lattice, simple_element):
+    assert simple_lattice.get_element(simple_element.name) is simple_element
+    with pytest.raises(ValueError):
+        simple_lattice.get_element('unknown')
+
+
+def test_waveform_array_pads_and_truncates():
+    values = [numpy.arange(3), 7, [1, 2, 3, 4, 5]]
+    waveforms = pytac.lattice.waveform_array(values, samples=4,
+                                             dtype=numpy.int64)
+    numpy.testing.assert_equal(waveforms, [[0, 1, 2, 0], [7, 0, 0, 0],
+                                           [1, 2, 3, 4]])
+    assert pytac.lattice.waveform_array([]).shape == (0, 0)
+
+
+def test_get_waveforms(simple_lattice, x_device):
+    x_device.get_value.return_value = numpy.arange(3.0)
+    waveforms = simple_lattice.get_waveforms('family', 'x')
+    numpy.testing.assert_equal(waveforms, [[0.0, 1.0, 2.0]])
+
+
+def test_get_element_values_fills_output_array(simple_lattice):
+    out = numpy.zeros(1)
+    assert simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                             out=out) is out
+    assert out[0] == DUMMY_VALUE_1
+    with pytest.raises(ValueError):
+        simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                          out=numpy.zeros(2))
+
+
 def test_get_all_families(simple_lattice):
     families = simple_lattice.get_all_families()
     assert list(families) == ['family']
@@ -164,3 +197,36 @@ def test_set_default_arguments_exceptions(simple_lattice):
         simple_lattice.set_default_units('invalid_units')
     with pytest.raises(pytac.exceptions.DataSourceException):
         simple_lattice.set_default_data_source('invalid_data_source')
+
+
+def test_get_element_values_masked_keeps_family_alignment(simple_lattice):
+    element2 = Element(2, 1.0, 'family', 0.0)
+    element2.add_to_family('family')
+    simple_lattice.add_element(element2)
+    values = simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                               masked=True)
+    assert len(values) == len(simple_lattice.get_family_s('family'))
+    numpy.testing.assert_equal(values.mask, [False, True])
+    assert values[0] == DUMMY_ARRAY[0]
+
+
+def test_get_element_values_masked_marks_conversion_failures(simple_lattice):
+    uc = mock.MagicMock()
+    uc.convert.side_effect = pytac.exceptions.UnitsException
+    simple_lattice[0]._data_source_manager._uc['x'] = uc
+    values = simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                               masked=True)
+    assert values.mask.all()
+
+
+def test_get_element_values_masked_marks_control_system_errors(simple_lattice, x_device):
+    class ca_nothing(Exception):
+        """Not a pytac exception, like cothread's error."""
+    x_device.get_value.side_effect = pytac.exceptions.ControlSystemException
+    values = simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                               masked=True)
+    assert values.mask.all()
+    x_device.get_value.side_effect = ca_nothing
+    values = simple_lattice.get_element_values('family', 'x', pytac.RB,
+                                               masked=True)
+    assert values.mask.all()
@@ -1,16 +1,22 @@
+import os
+import pickle
 import sys
 import pytac
 import pytest
+import mock
+import numpy
 from mock import patch
 from types import ModuleType
+from pytac import load_csv
 from pytac.load_csv import load
+from constants import CURRENT_DIR
 
 
 @pytest.fixture(scope="session")
 def Travis_CI_compatibility():
     """Travis CI cannot import cothread so we must create a mock of cothread and
         catools (the module that pytac imports from cothread), including the
-        functions that pytac explicitly imports (caget and caput).
+        functions that pytac explicitly imports (caget, caput and connect).
     """
     class catools(object):
         def caget():
@@ -19,6 +25,9 @@ def Travis_CI_compatibility():
         def caput():
             pass
 
+        def connect():
+            pass
+
     cothread = ModuleType('cothread')
     cothread.catools = catools
     sys.modules['cothread'] = cothread
@@ -88,3 +97,190 @@ def test_families_loaded(lattice):
     assert lattice.get_all_families() == set(['drift', 'sext', 'quad',
                                               'ds', 'qf', 'qs', 'sd'])
     assert lattice.get_elements('quad')[0].families == set(('quad', 'qf', 'qs'))
+
+
+def test_read_table_returns_typed_columns():
+    filename = os.path.join(CURRENT_DIR, 'data', 'dummy',
+                            load_csv.ELEMENTS_FILENAME)
+    table = load_csv.read_table(filename, load_csv.TABLES['elements'][1])
+    assert table['name'] == ['d1', 'q1', 's1', 'd2']
+    assert table['length'] == [1.0, 0.5, 0.3, 0.8]
+    assert table['cell'] == [None, 1, 2, None]
+
+
+def test_read_tables_skips_missing_unitconv_files():
+    tables = load_csv.read_tables(os.path.join(CURRENT_DIR, 'data'), 'dummy')
+    assert set(tables) == {'elements', 'devices', 'families'}
+    assert tables['devices']['get_pv'] == ['Q1:RB', 'Q1:RB']
+
+
+def test_parallel_and_sequential_read_tables_match():
+    data_dir = os.path.join(os.path.dirname(load_csv.__file__), 'data')
+    tables = load_csv.read_tables(data_dir, 'VMX', parallel=True)
+    assert tables == load_csv.read_tables(data_dir, 'VMX', parallel=False)
+
+
+def test_build_lattice_raises_KeyError_for_unknown_uc_id():
+    tables = load_csv.read_tables(os.path.join(CURRENT_DIR, 'data'), 'dummy')
+    tables['unitconv'] = {'el_id': [2], 'field': ['b1'], 'uc_id': [99]}
+    tables['poly'] = {'uc_id': [], 'coeff': [], 'val': []}
+    tables['pchip'] = {'uc_id': [], 'eng': [], 'phy': []}
+    with pytest.raises(KeyError):
+        load_csv.build_lattice('dummy', mock.MagicMock(), tables)
+
+
+@pytest.fixture
+def lazy_lattice():
+    return load('dummy', mock.MagicMock(), os.path.join(CURRENT_DIR, 'data'),
+                lazy=True)
+
+
+def test_lazy_lattice_only_builds_requested_elements(lazy_lattice):
+    assert isinstance(lazy_lattice, pytac.epics.LazyEpicsLattice)
+    assert len(lazy_lattice) == 4
+    assert lazy_lattice.get_length() == 2.6
+    assert lazy_lattice.get_all_families() == set(['drift', 'sext', 'quad',
+                                                   'ds', 'qf', 'qs', 'sd'])
+    assert lazy_lattice.get_loaded_count() == 0
+    quads = lazy_lattice.get_elements('quad')
+    assert lazy_lattice.get_loaded_count() == 1
+    assert quads[0].get_pv_name('b1', pytac.RB) == 'Q1:RB'
+    assert lazy_lattice.get_elements('quad') == quads
+    assert lazy_lattice.get_elements(cell=2)[0].name == 's1'
+    assert lazy_lattice.get_loaded_count() == 2
+
+
+def test_lazy_lattice_indexing(lazy_lattice):
+    assert lazy_lattice[-1] is lazy_lattice[3]
+    assert [e.name for e in lazy_lattice[1:3]] == ['q1', 's1']
+    with pytest.raises(IndexError):
+        lazy_lattice[4]
+    assert [e.name for e in lazy_lattice] == ['d1', 'q1', 's1', 'd2']
+
+
+def test_lazy_lattice_finds_pvs_of_elements_not_built():
+    eager = load('VMX', mock.MagicMock())
+    lazy = load('VMX', mock.MagicMock(), lazy=True)
+    bpm = eager.get_elements('BPM')[5]
+    pv = bpm.get_pv_name('x', pytac.RB)
+    element, field, handle = lazy.find_pv(pv)
+    assert (element.index, field, handle) == (bpm.index, 'x', pytac.RB)
+    assert lazy.get_loaded_count() == 1
+    assert lazy.find_pv(pv)[0] is element
+    pvs = [e.get_pv_name('b1', pytac.SP) for e in eager.get_elements('QUAD')]
+    found = lazy.find_pvs(pvs)
+    assert [f[0].index for f in found] == [e.index for e in
+                                           eager.get_elements('QUAD')]
+
+
+def test_lazy_lattice_finds_devices_and_elements_by_name():
+    eager = load('VMX', mock.MagicMock())
+    lazy = load('VMX', mock.MagicMock(), lazy=True)
+    assert lazy.get_element('100').index == eager.get_element('100').index
+    assert lazy.get_loaded_count() == 1
+    found = lazy.find_devices('SR05*')
+    expected = eager.find_devices('SR05*')
+    assert len(found) > 0
+    positions = [(e.index, field) for e, field in expected]
+    assert [(e.index, field) for e, field in found] == positions
+    assert all(e.get_device(field).name.startswith('SR05')
+               for e, field in found)
+    assert lazy.find_device('SR-DI-DCCT-01') == [(lazy, 'beam_current')]
+
+
+def test_lazy_lattice_applies_defaults_to_later_elements(lazy_lattice):
+    lazy_lattice.set_default_units(pytac.PHYS)
+    lazy_lattice.set_default_data_source(pytac.SIM)
+    assert lazy_lattice.get_loaded_count() == 0
+    manager = lazy_lattice[0]._data_source_manager
+    assert manager.default_units == pytac.PHYS
+    assert manager.default_data_source == pytac.SIM
+
+
+def test_lazy_and_eager_lattices_match():
+    cs = mock.MagicMock()
+
+    def describe(lattice):
+        return ([(e.index, e.s, e.get_pv_name('x', pytac.RB))
+                 for e in lattice.get_elements('BPM')],
+                [(e.index, e.get_unitconv('b1').eng_to_phys(70))
+                 for e in lattice.get_elements('QUAD')])
+    lazy_lattice = load('VMX', cs, lazy=True)
+    assert describe(lazy_lattice) == describe(load('VMX', cs))
+    n_bpms = len(lazy_lattice.get_elements('BPM'))
+    n_quads = len(lazy_lattice.get_elements('QUAD'))
+    assert lazy_lattice.get_loaded_count() == n_bpms + n_quads
+
+
+def test_setting_energy_rescales_magnet_unitconvs():
+    lattice = load('VMX', mock.MagicMock())
+    quad_uc = lattice.get_elements('QUAD')[0].get_unitconv('b1')
+    k1 = quad_uc.eng_to_phys(70)
+    lattice.set_value('energy', 1500)
+    assert lattice.get_value('energy') == 1500
+    ratio = pytac.utils.rigidity(3000) / pytac.utils.rigidity(1500)
+    assert quad_uc.eng_to_phys(70) == pytest.approx(k1 * ratio)
+    assert quad_uc.phys_to_eng(k1 * ratio) == pytest.approx(70)
+
+
+def test_unitconv_bank_converts_lattice_fields():
+    lattice = load('VMX', mock.MagicMock())
+    bank = lattice.get_unitconv_bank()
+    assert lattice.get_unitconv_bank() is bank
+    quads = lattice.get_elements('QUAD')
+    indices = bank.get_indices([(quad, 'b1') for quad in quads])
+    currents = numpy.linspace(50, 150, len(quads))
+    expected = [quad.get_unitconv('b1').eng_to_phys(current)
+                for quad, current in zip(quads, currents)]
+    numpy.testing.assert_array_equal(bank.eng_to_phys(currents, indices),
+                                     expected)
+
+
+def test_get_tables_round_trips_through_build_lattice(lattice):
+    tables = load_csv.get_tables(lattice)
+    assert tables['elements']['s'] == [0.0, 1.0, 1.5, 1.8]
+    assert tables['families']['family'] == ['ds', 'qf', 'qs', 'sd', 'ds']
+    rebuilt = load_csv.build_lattice('dummy', mock.MagicMock(), tables)
+    assert [e.families for e in rebuilt] == [e.families for e in lattice]
+    assert tables == load_csv.get_tables(rebuilt)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_pickled_lattice_reattaches_control_system(lazy):
+    lattice = load('VMX', mock.MagicMock(), lazy=lazy)
+    lattice.get_unitconv_bank()
+    unpickled = pickle.loads(pickle.dumps(lattice, pickle.HIGHEST_PROTOCOL))
+    assert unpickled._cs is None
+    assert unpickled._unitconv_bank is None
+    cs = mock.MagicMock()
+    cs.get.return_value = [1.0] * len(lattice.get_elements('BPM'))
+    unpickled.set_control_system(cs)
+    assert unpickled.get_values('BPM', 'x', pytac.RB) == cs.get.return_value
+    bpm = unpickled.get_elements('BPM')[0]
+    bpm.get_value('x', pytac.RB)
+    cs.get.assert_called_with(bpm.get_pv_name('x', pytac.RB))
+    quad = lattice.get_elements('QUAD')[0].get_unitconv('b1')
+    unpickled_quad = unpickled.get_elements('QUAD')[0].get_unitconv('b1')
+    assert unpickled_quad.eng_to_phys(70) == quad.eng_to_phys(70)
+    unpickled.set_value('energy', 1500)
+    assert unpickled_quad.eng_to_phys(70) != quad.eng_to_phys(70)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_pickled_element_does_not_include_its_lattice(lazy):
+    lattice = load('VMX', mock.MagicMock(), lazy=lazy)
+    element = lattice.get_elements('BPM')[0]
+    data = pickle.dumps(element, pickle.HIGHEST_PROTOCOL)
+    assert len(data) * 100 < len(pickle.dumps(lattice))
+    assert pickle.loads(data)._parent_lattice is None
+    assert element._parent_lattice is lattice
+    unpickled = pickle.loads(pickle.dumps(lattice, pickle.HIGHEST_PROTOCOL))
+    assert all(e._parent_lattice is unpickled for e in unpickled)
+
+
+def test_lazy_lattice_builds_new_elements_with_new_control_system():
+    lattice = load('VMX', mock.MagicMock(), lazy=True)
+    cs = mock.MagicMock()
+    lattice.set_control_system(cs)
+    bpm = lattice.get_elements('BPM')[0]
+    assert bpm.get_device('x')._cs is cs
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import mock
+import pytest
+import pytac
+from pytac import load_csv, load_db
+from constants import CURRENT_DIR
+
+
+PACKAGE_DATA = os.path.join(os.path.dirname(os.path.abspath(
+    load_csv.__file__)), 'data')
+
+
+@pytest.fixture
+def db_file(tmpdir):
+    filename = str(tmpdir.join('lattices.sqlite'))
+    load_db.csv_to_db(os.path.join(CURRENT_DIR, 'data'), filename)
+    return filename
+
+
+def describe(lattice):
+    elements = []
+    for element in lattice:
+        fields = {}
+        for field in element.get_fields()[pytac.LIVE]:
+            device = element.get_device(field)
+            uc = element.get_unitconv(field)
+            fields[field] = (device.rb_pv, device.sp_pv, type(uc).__name__,
+                             uc.convert(1.0, pytac.ENG, pytac.PHYS))
+        elements.append((element.index, element.name, element.type_,
+                         element.length, element.s, element.cell,
+                         sorted(element.families), fields))
+    return elements
+
+
+def test_csv_to_db_stores_all_modes(db_file):
+    assert load_db.get_modes(db_file) == ['dummy']
+
+
+def read_text(filename):
+    with open(filename) as text_file:
+        return text_file.read()
+
+
+@pytest.mark.parametrize('directory, mode',
+                         [(os.path.join(CURRENT_DIR, 'data'), 'dummy'),
+                          (PACKAGE_DATA, 'VMX'), (PACKAGE_DATA, 'VMXSP'),
+                          (PACKAGE_DATA, 'DIAD')])
+def test_round_trip_reproduces_csv_files(directory, mode, tmpdir):
+    filename = str(tmpdir.join('lattices.sqlite'))
+    load_db.csv_to_db(directory, filename, [mode])
+    out = tmpdir.mkdir('out')
+    load_db.db_to_csv(filename, str(out))
+    for name in os.listdir(os.path.join(directory, mode)):
+        original = os.path.join(directory, mode, name)
+        assert read_text(str(out.join(mode, name))) == read_text(original)
+
+
+def test_load_matches_load_csv(db_file):
+    cs = mock.MagicMock()
+    lattice = load_db.load('dummy', db_file, cs)
+    expected = load_csv.load('dummy', cs, os.path.join(CURRENT_DIR, 'data'))
+    assert describe(lattice) == describe(expected)
+    assert lattice.get_value('energy') == expected.get_value('energy')
+
+
+def test_identical_modes_share_their_tables(tmpdir):
+    filename = str(tmpdir.join('lattices.sqlite'))
+    load_db.csv_to_db(PACKAGE_DATA, filename, ['VMX', 'VMXSP'])
+    cs = mock.MagicMock()
+    for mode in ('VMX', 'VMXSP'):
+        expected = describe(load_csv.load(mode, cs))
+        assert describe(load_db.load(mode, filename, cs)) == expected
+    connection = sqlite3.connect(filename)
+    count = connection.execute('SELECT COUNT(*) FROM contents').fetchone()
+    assert count[0] == len(load_csv.TABLES)
+    connection.close()
+
+
+def test_load_families_subset(tmpdir):
+    filename = str(tmpdir.join('lattices.sqlite'))
+    load_db.csv_to_db(PACKAGE_DATA, filename, ['VMX'])
+    cs = mock.MagicMock()
+    full = load_csv.load('VMX', cs)
+    lattice = load_db.load('VMX', filename, cs, families=['BPM', 'HSTR'])
+    expected = [e for e in describe(full)
+                if set(e[6]).intersection(('BPM', 'HSTR'))]
+    assert describe(lattice) == expected
+    assert lattice.get_value('energy') == full.get_value('energy')
+
+
+def test_unknown_mode_raises_DataSourceException(db_file):
+    with pytest.raises(pytac.exceptions.DataSourceException):
+        load_db.load('unknown', db_file, mock.MagicMock())
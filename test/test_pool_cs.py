@@ -0,0 +1,81 @@
+import threading
+import time
+import pytest
+import pytac
+from pytac.pool_cs import ThreadPoolControlSystem
+
+
+class ScalarControlSystem(pytac.cs.ControlSystem):
+    """Handles one PV at a time, slowly, and counts concurrent requests."""
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.values = {}
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+
+    def get(self, pv):
+        assert isinstance(pv, str)
+        self._request()
+        if pv == 'bad':
+            raise ValueError(pv)
+        return float(len(pv))
+
+    def put(self, pv, value):
+        assert isinstance(pv, str)
+        self._request()
+        self.values[pv] = value
+
+
+def test_get_returns_values_in_order_within_concurrency_limit():
+    scalar_cs = ScalarControlSystem()
+    with ThreadPoolControlSystem(scalar_cs, max_workers=4) as cs:
+        pvs = ['a' * n for n in range(1, 13)]
+        start = time.time()
+        assert cs.get(pvs) == [float(n) for n in range(1, 13)]
+        assert time.time() - start < 12 * scalar_cs.delay
+        assert cs.get('abc') == 3.0
+    assert scalar_cs.max_active == 4
+
+
+def test_put_writes_every_pv():
+    scalar_cs = ScalarControlSystem(delay=0)
+    with ThreadPoolControlSystem(scalar_cs) as cs:
+        cs.put(['a', 'b'], [1, 2])
+        cs.put('c', 3)
+    assert scalar_cs.values == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_errors_and_timeouts_are_raised():
+    scalar_cs = ScalarControlSystem(delay=0.2)
+    with ThreadPoolControlSystem(scalar_cs, max_workers=2, timeout=1) as cs:
+        with pytest.raises(ValueError):
+            cs.get(['a', 'bad'])
+        with pytest.raises(pytac.exceptions.ControlSystemException):
+            cs.get(['a', 'b', 'c'], timeout=0.05)
+
+
+def test_timeout_applies_to_single_pvs():
+    scalar_cs = ScalarControlSystem(delay=0.2)
+    with ThreadPoolControlSystem(scalar_cs, timeout=0.05) as cs:
+        with pytest.raises(pytac.exceptions.ControlSystemException):
+            cs.get('a')
+        with pytest.raises(pytac.exceptions.ControlSystemException):
+            cs.put('a', 1)
+        assert cs.get('a', timeout=1) == 1.0
+
+
+def test_put_raises_ValueError_for_mismatched_values():
+    scalar_cs = ScalarControlSystem(delay=0)
+    with ThreadPoolControlSystem(scalar_cs) as cs:
+        with pytest.raises(ValueError):
+            cs.put(['a', 'b'], [1])
+    assert scalar_cs.values == {}
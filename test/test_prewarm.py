@@ -0,0 +1,53 @@
+import mock
+from pytac import load_csv
+from pytac.cs import ControlSystem
+from pytac.prewarm import Prewarmer
+
+
+class ConnectingControlSystem(ControlSystem):
+    """Fails to read or connect to PVs in down."""
+    def __init__(self, down=()):
+        self.down = set(down)
+        self.connected = []
+
+    def get(self, pv):
+        pvs = [pv] if isinstance(pv, str) else pv
+        if self.down.intersection(pvs):
+            raise Exception('timeout')
+        self.connected.extend(pvs)
+        return 1.0 if isinstance(pv, str) else [1.0] * len(pvs)
+
+
+def test_prewarmer_reports_progress_and_status():
+    cs = ConnectingControlSystem(down=['c'])
+    progress = []
+    prewarmer = Prewarmer(cs, ['a', 'b', 'c', 'd', 'e'], chunk_size=2,
+                          callback=lambda done, total: progress.append(done))
+    prewarmer.start()
+    assert prewarmer.wait(5)
+    assert prewarmer.is_done()
+    assert progress == [2, 4, 5]
+    assert prewarmer.get_progress() == (5, 5)
+    assert prewarmer.get_failed() == ['c']
+    assert prewarmer.get_status()['d'] is True
+    assert sorted(cs.connected) == ['a', 'b', 'd', 'e']
+
+
+def test_prewarmer_marks_chunk_failed_if_connect_raises():
+    cs = mock.MagicMock()
+    cs.connect.side_effect = Exception('no server')
+    prewarmer = Prewarmer(cs, ['a', 'b'])
+    prewarmer.run()
+    assert prewarmer.get_failed() == ['a', 'b']
+
+
+def test_load_prewarms_all_pvs_without_building_elements():
+    cs = mock.MagicMock()
+    cs.connect.side_effect = lambda pvs, timeout: [True] * len(pvs)
+    lattice = load_csv.load('VMX', cs, lazy=True, prewarm=True)
+    prewarmer = lattice.get_prewarmer()
+    assert prewarmer.wait(5)
+    pvs = set(lattice._pv_index)
+    assert set(prewarmer.get_status()) == pvs
+    assert 'SR-DI-DCCT-01:SIGNAL' in pvs
+    assert lattice.get_loaded_count() == 0
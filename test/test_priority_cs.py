@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pytac.cs import ControlSystem
+from pytac.priority_cs import HIGH, LOW, NORMAL, PriorityControlSystem
+
+
+class GatedControlSystem(ControlSystem):
+    """Records each request; the first one waits until the gate opens."""
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def get(self, pvs):
+        self.calls.append(list(pvs))
+        self.started.set()
+        self.gate.wait(5)
+        if 'bad' in pvs:
+            raise ValueError('bad')
+        return [len(pv) for pv in pvs]
+
+    def put(self, pvs, values):
+        self.calls.append(list(pvs))
+
+
+class ThreadBoundControlSystem(ControlSystem):
+    """Only accepts calls from its own thread, like cothread."""
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(1)
+        self.owner = self._executor.submit(threading.current_thread).result()
+
+    def get(self, pvs):
+        assert threading.current_thread() is self.owner
+        return [len(pv) for pv in pvs]
+
+    def put(self, pvs, values):
+        assert threading.current_thread() is self.owner
+
+    def run(self, function, *args, **kwargs):
+        return self._executor.submit(function, *args, **kwargs).result()
+
+
+def submit(scheduler, pvs, priority, results):
+    thread = threading.Thread(target=lambda: results.append(
+        scheduler.get(pvs, priority)))
+    thread.start()
+    return thread
+
+
+def wait_for_queued(scheduler, count):
+    for _ in range(500):
+        metrics = scheduler.get_metrics()
+        if sum(m['queued_requests'] for m in metrics.values()) == count:
+            return
+        time.sleep(0.01)
+
+
+def test_urgent_requests_overtake_and_requests_interleave():
+    cs = GatedControlSystem()
+    with PriorityControlSystem(cs, chunk_size=2) as scheduler:
+        results = []
+        threads = [submit(scheduler, ['l1', 'l2', 'l3', 'l4'], LOW, results)]
+        assert cs.started.wait(5)
+        threads.append(submit(scheduler, ['a1', 'a2', 'a3', 'a4'], NORMAL,
+                              results))
+        wait_for_queued(scheduler, 2)
+        threads.append(submit(scheduler, ['b1', 'b2'], NORMAL, results))
+        wait_for_queued(scheduler, 3)
+        threads.append(submit(scheduler, ['high'], HIGH, results))
+        wait_for_queued(scheduler, 4)
+        cs.gate.set()
+        for thread in threads:
+            thread.join(5)
+        assert cs.calls == [['l1', 'l2'], ['high'], ['a1', 'a2'],
+                            ['b1', 'b2'], ['a3', 'a4'], ['l3', 'l4']]
+        assert [4] in results and [2, 2, 2, 2] in results
+        metrics = scheduler.get_metrics()
+        assert metrics[NORMAL]['requests'] == 2
+        assert metrics[NORMAL]['chunks'] == 3
+        assert metrics[LOW]['queued_requests'] == 0
+        assert metrics[HIGH]['max_wait'] > 0
+
+
+def test_single_pvs_puts_and_errors():
+    cs = GatedControlSystem()
+    cs.gate.set()
+    with PriorityControlSystem(cs, chunk_size=1) as scheduler:
+        assert scheduler.get('abc') == 3
+        scheduler.get_view(HIGH).put(['a', 'b'], [1, 2])
+        assert cs.calls[-2:] == [['a'], ['b']]
+        with pytest.raises(ValueError):
+            scheduler.get(['ok', 'bad', 'never'])
+        assert ['never'] not in cs.calls
+        assert scheduler.get_metrics()[NORMAL]['queued_chunks'] == 0
+
+
+def test_wrapped_control_system_is_called_on_its_own_thread():
+    cs = ThreadBoundControlSystem()
+    with PriorityControlSystem(cs, chunk_size=2) as scheduler:
+        assert scheduler.get(['a', 'bb', 'ccc']) == [1, 2, 3]
+        scheduler.put(['a', 'b', 'c'], [1, 2, 3])
+        assert scheduler.get_metrics()[NORMAL]['requests'] == 2
@@ -0,0 +1,104 @@
+import threading
+import time
+import mock
+import pytest
+from pytac.cs import ControlSystem
+from pytac.ratelimit_cs import RateLimitedControlSystem
+
+
+class RecordingControlSystem(ControlSystem):
+    """Records the time and contents of each write."""
+    def __init__(self):
+        self.writes = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def get(self, pv):
+        return 1.0
+
+    def put(self, pvs, values):
+        self.gate.wait(5)
+        if 'bad' in pvs:
+            raise ValueError('bad')
+        self.writes.append((time.time(), list(pvs), list(values)))
+
+
+def test_writes_are_batched_and_rate_limited():
+    cs = RecordingControlSystem()
+    with RateLimitedControlSystem(cs, {'PS': (100, 5)}) as limited:
+        start = time.time()
+        pvs = ['PS{0:02d}'.format(i) for i in range(20)]
+        limited.put(pvs, list(range(20)))
+        elapsed = time.time() - start
+        assert [len(w[1]) for w in cs.writes] == [5, 5, 5, 5]
+        # 5 PVs are written at once, then 15 more need tokens at 100/s.
+        assert elapsed >= 0.14
+        assert sum((w[1] for w in cs.writes), []) == pvs
+        assert limited.writes == 20
+
+
+def test_unlimited_pvs_are_written_at_once():
+    cs = RecordingControlSystem()
+    with RateLimitedControlSystem(cs) as limited:
+        limited.add_limit('PS', 1)
+        limited.put(['Q1', 'Q2', 'Q3'], [1, 2, 3])
+        assert cs.writes[0][1] == ['Q1', 'Q2', 'Q3']
+
+
+def test_superseded_writes_are_coalesced():
+    cs = RecordingControlSystem()
+    cs.gate.clear()
+    with RateLimitedControlSystem(cs) as limited:
+        first = limited.submit('A', 1)
+        for _ in range(100):
+            if not limited.get_pending():
+                break
+            time.sleep(0.01)
+        # A is being written, so the next writes to B are queued.
+        futures = [limited.submit('B', value) for value in (1, 2, 3)]
+        cs.gate.set()
+        assert first.result(5) == 1
+        assert [f.result(5) for f in futures] == [3, 3, 3]
+        assert cs.writes[-1][1:] == (['B'], [3])
+        assert limited.coalesced == 2
+
+
+def test_failed_writes_raise():
+    cs = RecordingControlSystem()
+    with RateLimitedControlSystem(cs) as limited:
+        with pytest.raises(ValueError):
+            limited.put('bad', 1)
+        assert limited.get('A') == 1.0
+
+
+@pytest.mark.parametrize('rate', [0, -1.0])
+def test_non_positive_rate_raises_ValueError(rate):
+    with pytest.raises(ValueError):
+        RateLimitedControlSystem(mock.MagicMock(), {'SR01': (rate, 1)})
+
+
+def test_cancelled_writes_are_skipped_and_the_writer_keeps_going():
+    cs = RecordingControlSystem()
+    cs.gate.clear()
+    with RateLimitedControlSystem(cs) as limited:
+        first = limited.submit('A', 1)
+        for _ in range(100):
+            if not limited.get_pending():
+                break
+            time.sleep(0.01)
+        cancelled = limited.submit('B', 2)
+        assert cancelled.cancel()
+        assert first.cancel() is False
+        cs.gate.set()
+        assert first.result(5) == 1
+        assert limited.submit('C', 3).result(2) == 3
+        assert [w[1] for w in cs.writes] == [['A'], ['C']]
+
+
+def test_mismatched_lengths_raise_ValueError():
+    cs = RecordingControlSystem()
+    with RateLimitedControlSystem(cs) as limited:
+        with pytest.raises(ValueError):
+            limited.submit(['A', 'B'], [1])
+        assert limited.get_pending() == 0
+    assert cs.writes == []
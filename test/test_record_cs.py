@@ -0,0 +1,103 @@
+import time
+import mock
+import numpy
+import pytest
+import pytac
+from pytac.record_cs import (RecordingControlSystem, ReplayControlSystem,
+                             read_trace, GET, PUT, ERROR)
+from constants import RB_PV, SP_PV
+
+
+@pytest.fixture
+def trace_file(tmpdir):
+    return str(tmpdir.join('trace.bin'))
+
+
+@pytest.fixture
+def recorded_trace(trace_file):
+    cs = mock.MagicMock()
+    cs.get.side_effect = [1.5, [numpy.float64(2.0), 3], ValueError('timeout')]
+    recorder = RecordingControlSystem(cs, trace_file)
+    assert recorder.get(RB_PV) == 1.5
+    assert recorder.get([RB_PV, SP_PV]) == [2.0, 3]
+    recorder.put([SP_PV], [4.0])
+    with pytest.raises(ValueError):
+        recorder.get(SP_PV)
+    recorder.close()
+    cs.put.assert_called_with([SP_PV], [4.0])
+    return trace_file
+
+
+def test_recorded_trace_contents(recorded_trace):
+    records = read_trace(recorded_trace)
+    assert [r[0] for r in records] == [GET, GET, PUT, GET | ERROR]
+    assert [r[3] for r in records] == [RB_PV, [RB_PV, SP_PV], [SP_PV], SP_PV]
+    assert type(records[1][4][0]) is float
+    assert records[3][4] == 'timeout'
+    for _, timestamp, latency, _, _ in records:
+        assert timestamp >= 0 and latency >= 0
+
+
+def test_replay_reproduces_recorded_calls(recorded_trace):
+    cs = ReplayControlSystem(recorded_trace)
+    assert cs.get(RB_PV) == 1.5
+    assert cs.get([RB_PV, SP_PV]) == [2.0, 3]
+    cs.put([SP_PV], [4.0])
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.get(SP_PV)
+    assert cs.remaining() == 0
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.get(RB_PV)
+    cs.rewind()
+    assert cs.get(RB_PV) == 1.5
+
+
+def test_replay_matches_calls_recorded_in_another_order(recorded_trace):
+    cs = ReplayControlSystem(recorded_trace)
+    cs.put([SP_PV], [4.0])
+    assert cs.get([RB_PV, SP_PV]) == [2.0, 3]
+    assert cs.get(RB_PV) == 1.5
+    assert cs.remaining() == 1
+
+
+def test_unrecorded_call_raises_ControlSystemException(recorded_trace):
+    cs = ReplayControlSystem(recorded_trace)
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.put([RB_PV, SP_PV], [1, 2])
+    cs.get(RB_PV)
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        cs.get(RB_PV)
+
+
+def test_realtime_replay_reproduces_gaps_between_calls(trace_file):
+    cs = mock.MagicMock()
+    cs.get.return_value = 1.0
+    with RecordingControlSystem(cs, trace_file) as recorder:
+        recorder.get(RB_PV)
+        time.sleep(0.1)
+        recorder.get(SP_PV)
+    replay = ReplayControlSystem(trace_file, realtime=True)
+    start = time.time()
+    replay.get(RB_PV)
+    replay.get(SP_PV)
+    assert time.time() - start >= 0.09
+
+
+def test_trace_is_flushed_after_each_call(trace_file):
+    cs = mock.MagicMock()
+    cs.get.return_value = 1.0
+    recorder = RecordingControlSystem(cs, trace_file)
+    recorder.get(RB_PV)
+    assert len(read_trace(trace_file)) == 1
+    recorder.close()
+    with open(trace_file, 'ab') as f:
+        # A record cut short by a crash.
+        f.write(b'\x00' * 5)
+    assert len(read_trace(trace_file)) == 1
+
+
+def test_read_trace_rejects_other_files(trace_file):
+    with open(trace_file, 'wb') as f:
+        f.write(b'not a trace')
+    with pytest.raises(pytac.exceptions.ControlSystemException):
+        read_trace(trace_file)
@@ -0,0 +1,150 @@
+import os
+import mock
+import numpy
+import pytest
+import pytac
+from pytac import load_csv, shared_lattice
+from constants import CURRENT_DIR
+
+
+pytestmark = pytest.mark.skipif(shared_lattice.shared_memory is None,
+                                reason="multiprocessing.shared_memory is not "
+                                       "available")
+
+
+@pytest.fixture
+def dummy_lattice():
+    return load_csv.load('dummy', mock.MagicMock(),
+                         os.path.join(CURRENT_DIR, 'data'))
+
+
+@pytest.fixture
+def published(dummy_lattice):
+    shared = shared_lattice.publish(dummy_lattice)
+    yield shared
+    shared.unlink()
+
+
+def describe(lattice):
+    return [(e.index, e.name, e.type_, e.length, e.s, e.cell,
+             sorted(e.families),
+             dict((field, (e.get_device(field).rb_pv,
+                           e.get_device(field).sp_pv))
+                  for field in e.get_fields()[pytac.LIVE]))
+            for e in lattice]
+
+
+def test_attached_lattice_matches_published_lattice(dummy_lattice,
+                                                    published):
+    cs = mock.MagicMock()
+    lattice = shared_lattice.attach(published.name, cs)
+    assert isinstance(lattice, pytac.epics.LazyEpicsLattice)
+    assert lattice.name == 'dummy'
+    assert lattice._cs is cs
+    assert lattice.get_loaded_count() == 0
+    assert describe(lattice) == describe(dummy_lattice)
+    numpy.testing.assert_equal(lattice.get_value('s_position'),
+                               [0.0, 1.0, 1.5, 1.8])
+
+
+def test_attached_lattice_uses_its_own_control_system(published):
+    cs = mock.MagicMock()
+    cs.get.return_value = [1.5]
+    lattice = shared_lattice.attach(published.name, cs)
+    assert lattice.get_values('quad', 'b1', pytac.RB) == [1.5]
+    cs.get.assert_called_with(['Q1:RB'])
+
+
+def test_column_arrays_record_missing_values():
+    array, missing = shared_lattice._column_array(['a', None, 'bcd'])
+    assert array.dtype.kind == 'S'
+    numpy.testing.assert_array_equal(missing, [False, True, False])
+    array, missing = shared_lattice._column_array([1, 2])
+    assert array.dtype == numpy.int64 and missing is None
+    array, missing = shared_lattice._column_array([1.5, None])
+    assert array.dtype == numpy.float64 and missing[1]
+
+
+def test_vmx_unit_conversions_and_energy_are_shared():
+    cs = mock.MagicMock()
+    lattice = load_csv.load('VMX', cs)
+    lattice.set_value('energy', 2500)
+    with shared_lattice.publish(lattice) as published:
+        attached = shared_lattice.attach(published.name, cs)
+        assert attached.get_value('energy') == 2500
+        quad = lattice.get_elements('QUAD')[3]
+        attached_quad = attached.get_elements('QUAD')[3]
+        for value in (50.0, 120.0):
+            expected = quad.get_unitconv('b1').eng_to_phys(value)
+            assert attached_quad.get_unitconv('b1').eng_to_phys(value) == expected
+
+
+def test_shared_column_converts_values():
+    column = shared_lattice.SharedColumn(numpy.array([b'a', b'bc']),
+                                         numpy.array([False, True]))
+    assert list(column) == ['a', None]
+    assert column[0] == 'a'
+    assert column[1:] == [None]
+    column = shared_lattice.SharedColumn(numpy.array([1, 2]))
+    assert list(column) == [1, 2]
+    assert type(column[1]) is int
+
+
+def test_attached_lattice_reads_its_structure_from_shared_memory():
+    cs = mock.MagicMock()
+    lattice = load_csv.load('VMX', cs)
+    with shared_lattice.publish(lattice) as published:
+        attached = shared_lattice.attach(published.name, cs)
+        for array in (attached._lengths, attached.get_value('s_position')):
+            assert not array.flags.owndata and not array.flags.writeable
+        quad = attached.get_elements('QUAD')[0]
+        assert attached.get_loaded_count() == len(lattice.get_elements('QUAD'))
+        uc = quad.get_unitconv('b1')
+        assert not uc.x.flags.owndata and not uc.x.flags.writeable
+        assert attached.get_length() == lattice.get_length()
+        assert attached.get_all_families() == lattice.get_all_families()
+        assert attached.get_elements('BPM', cell=2)[0].index == (
+            lattice.get_elements('BPM', cell=2)[0].index)
+
+
+def owners(found):
+    return [(element.index, field) for element, field in found]
+
+
+def test_attached_lattice_finds_elements_by_name_pv_and_device():
+    cs = mock.MagicMock()
+    lattice = load_csv.load('VMX', cs)
+    bpm = lattice.get_elements('BPM')[5]
+    pv = bpm.get_pv_name('x', pytac.RB)
+    name = bpm.get_device('x').name
+    with shared_lattice.publish(lattice) as published:
+        attached = shared_lattice.attach(published.name, cs)
+        element, field, handle = attached.find_pv(pv)
+        assert (element.index, field, handle) == (bpm.index, 'x', pytac.RB)
+        assert attached.get_loaded_count() == 1
+        assert attached.get_element(bpm.name).name == bpm.name
+        assert owners(attached.find_device(name)) == owners(
+            lattice.find_device(name))
+        pattern = name[:-1] + '*'
+        assert owners(attached.find_devices(pattern)) == owners(
+            lattice.find_devices(pattern))
+        pvs = sorted(lattice._get_all_pv_names())
+        assert sorted(attached._get_all_pv_names()) == pvs
+        with pytest.raises(ValueError):
+            attached.get_element('missing')
+
+
+def test_attached_lattice_rejects_changes(published):
+    lattice = shared_lattice.attach(published.name, mock.MagicMock())
+    element = lattice[0]
+    changes = [lambda: lattice.add_element(pytac.element.Element('e', 1.0,
+                                                                 'd', 0.0)),
+               lambda: lattice.add_device('x', mock.MagicMock(), None),
+               lambda: lattice.set_data_source(mock.MagicMock(), pytac.SIM),
+               lambda: element.add_device('x', mock.MagicMock(), None),
+               lambda: element.add_to_family('family'),
+               lambda: element.set_data_source(mock.MagicMock(), pytac.SIM)]
+    for change in changes:
+        with pytest.raises(pytac.exceptions.DataSourceException):
+            change()
+    assert len(lattice) == 4 and 'family' not in element.families
@@ -0,0 +1,86 @@
+import numpy
+import pytest
+from pytac.tune import TuneAnalyser, hann_window
+
+
+TURNS = 256
+TUNE = 0.2237
+
+
+@pytest.fixture
+def advances():
+    return numpy.array([0.0, 1.2, 2.0, 3.9, 6.7, 7.1])
+
+
+@pytest.fixture
+def tbt_data(advances):
+    turns = numpy.arange(TURNS)
+    amplitudes = numpy.linspace(0.5, 2.0, len(advances))[:, None]
+    phases = 2 * numpy.pi * TUNE * turns + advances[:, None] + 0.3
+    return 0.1 + amplitudes * numpy.cos(phases)
+
+
+def test_hann_window():
+    window = hann_window(4)
+    numpy.testing.assert_allclose(window, [0, 0.5, 1, 0.5], atol=1e-15)
+
+
+def test_get_tunes_of_all_rows(tbt_data, advances):
+    tunes, amplitudes, phases = TuneAnalyser(TURNS).get_tunes(tbt_data)
+    numpy.testing.assert_allclose(tunes, TUNE, atol=1e-9)
+    numpy.testing.assert_allclose(amplitudes,
+                                  numpy.linspace(0.5, 2.0, len(advances)),
+                                  rtol=1e-6)
+    numpy.testing.assert_allclose(numpy.cos(phases - advances - 0.3), 1.0)
+
+
+def test_refinement_improves_on_interpolation_near_the_integer():
+    turns = numpy.arange(TURNS)
+    data = numpy.cos(2 * numpy.pi * 0.03 * turns + 1.0)[None, :]
+    interpolated = TuneAnalyser(TURNS, iterations=0).get_tunes(data)[0]
+    refined = TuneAnalyser(TURNS).get_tunes(data)[0]
+    assert abs(refined[0] - 0.03) < abs(interpolated[0] - 0.03)
+    assert abs(refined[0] - 0.03) < 1e-7
+
+
+def test_tune_range_excludes_other_peaks(tbt_data):
+    turns = numpy.arange(TURNS)
+    data = tbt_data + 3 * numpy.cos(2 * numpy.pi * 0.31 * turns)
+    assert abs(TuneAnalyser(TURNS).get_tune(data) - 0.31) < 1e-6
+    analyser = TuneAnalyser(TURNS, tune_range=(0.15, 0.25))
+    assert abs(analyser.get_tune(data) - TUNE) < 1e-3
+
+
+def test_rows_with_nan_give_nan(tbt_data):
+    tbt_data[2, -10:] = numpy.nan
+    tunes, amplitudes, phases = TuneAnalyser(TURNS).get_tunes(tbt_data)
+    assert numpy.isnan([tunes[2], amplitudes[2], phases[2]]).all()
+    assert numpy.isfinite(numpy.delete(tunes, 2)).all()
+    assert abs(TuneAnalyser(TURNS).get_tune(tbt_data) - TUNE) < 1e-9
+
+
+def test_get_phase_advances(tbt_data, advances):
+    measured = TuneAnalyser(TURNS).get_phase_advances(tbt_data)
+    numpy.testing.assert_allclose(measured, advances, atol=1e-6)
+
+
+def test_invalid_shapes_and_ranges_raise_ValueError(tbt_data):
+    with pytest.raises(ValueError):
+        TuneAnalyser(3)
+    with pytest.raises(ValueError):
+        TuneAnalyser(TURNS, tune_range=(0.1001, 0.1002))
+    with pytest.raises(ValueError):
+        TuneAnalyser(TURNS + 1).get_tunes(tbt_data)
+
+
+def test_phase_advances_skip_rows_with_nan(tbt_data, advances):
+    tbt_data[2, 0] = numpy.nan
+    measured = TuneAnalyser(TURNS).get_phase_advances(tbt_data)
+    assert numpy.isnan(measured[2])
+    numpy.testing.assert_allclose(numpy.delete(measured, 2),
+                                  numpy.delete(advances, 2), atol=1e-6)
+    tbt_data[0, 0] = numpy.nan
+    measured = TuneAnalyser(TURNS).get_phase_advances(tbt_data)
+    numpy.testing.assert_allclose(measured[[1, 3, 4, 5]],
+                                  advances[[1, 3, 4, 5]] - advances[1],
+                                  atol=1e-6)
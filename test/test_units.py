@@ -1,7 +1,7 @@
 import pytest
 import pytac
 import numpy
-from pytac.units import UnitConv, PolyUnitConv, PchipUnitConv, NullUnitConv
+from pytac.units import UnitConv, PolyUnitConv, PchipUnitConv, NullUnitConv, Rigidity, UnitConvBank
 from constants import DUMMY_VALUE_1, DUMMY_VALUE_2, DUMMY_VALUE_3
 
 
@@ -121,6 +121,17 @@ def test_PolyUnitConv_with_additional_function():
     assert poly_uc.phys_to_eng(18.0) == 3
 
 
+def test_Rigidity_rescales_shared_unit_conversions():
+    rigidity = Rigidity(3000)
+    assert rigidity.value == pytac.utils.rigidity(3000)
+    poly_uc = PolyUnitConv([2, 0], rigidity.div, rigidity.mult)
+    assert poly_uc.eng_to_phys(4) == 8 / rigidity.value
+    rigidity.energy = 1500
+    assert rigidity.value == pytac.utils.rigidity(1500)
+    assert poly_uc.eng_to_phys(4) == 8 / rigidity.value
+    assert poly_uc.phys_to_eng(8 / rigidity.value) == pytest.approx(4)
+
+
 def test_NullUnitConv():
     null_uc = NullUnitConv()
     assert null_uc.eng_to_phys(DUMMY_VALUE_1) == DUMMY_VALUE_1
@@ -129,3 +140,154 @@ def test_NullUnitConv():
     assert null_uc.phys_to_eng(DUMMY_VALUE_1) == DUMMY_VALUE_1
     assert null_uc.phys_to_eng(DUMMY_VALUE_2) == DUMMY_VALUE_2
     assert null_uc.phys_to_eng(DUMMY_VALUE_3) == DUMMY_VALUE_3
+
+
+@pytest.fixture
+def bank_unitconvs():
+    rigidity = Rigidity(3000)
+    return [PolyUnitConv([2.5, 0.1]),
+            PolyUnitConv([2.5, 0.1], rigidity.div, rigidity.mult),
+            PolyUnitConv([1, 2, 3]),
+            PchipUnitConv([0, 1.5, 3, 7], [0, 2, 2.5, 9]),
+            PchipUnitConv([1, 2, 4], [1, 4, 5], rigidity.div, rigidity.mult),
+            NullUnitConv(),
+            PolyUnitConv([3, 1], f1, f2)]
+
+
+def test_UnitConvBank_matches_unitconv_objects_exactly(bank_unitconvs):
+    bank = UnitConvBank(bank_unitconvs)
+    eng = numpy.array([0.3, -4.1, 1.7, 2.2, 3.3, 9.0, 4.0])
+    phys = bank.eng_to_phys(eng)
+    expected = [uc.eng_to_phys(e) for uc, e in zip(bank_unitconvs, eng)]
+    numpy.testing.assert_array_equal(phys, expected)
+    phys = numpy.array(expected)
+    indices = [0, 1, 3, 4, 5, 6]
+    numpy.testing.assert_array_equal(
+        bank.phys_to_eng(phys[indices], indices),
+        [bank_unitconvs[i].phys_to_eng(phys[i]) for i in indices])
+
+
+def test_UnitConvBank_converts_into_output_array(bank_unitconvs):
+    bank = UnitConvBank(bank_unitconvs)
+    eng = numpy.array([0.3, -4.1, 1.7, 2.2, 3.3, 9.0, 4.0])
+    expected = bank.eng_to_phys(eng)
+    out = numpy.empty(7)
+    assert bank.eng_to_phys(eng, out=out) is out
+    numpy.testing.assert_array_equal(out, expected)
+    # Converting in place gives the same results, including for the entries
+    # converted by the objects.
+    indices = [0, 1, 3, 4, 5, 6]
+    values = expected[indices]
+    bank.phys_to_eng(values, indices, out=values)
+    numpy.testing.assert_array_equal(
+        values, bank.phys_to_eng(expected[indices], indices))
+    with pytest.raises(pytac.exceptions.UnitsException):
+        bank.eng_to_phys(eng, out=numpy.empty(3))
+
+
+def test_UnitConvBank_keeps_infinite_values_of_mixed_degree_polynomials():
+    ucs = [PolyUnitConv([2.5, 0.1]), PolyUnitConv([1, 2, 3])]
+    bank = UnitConvBank(ucs * 2)
+    values = numpy.array([numpy.inf, numpy.inf, -numpy.inf, -numpy.inf])
+    numpy.testing.assert_array_equal(bank.eng_to_phys(values),
+                                     [numpy.inf, numpy.inf, -numpy.inf,
+                                      numpy.inf])
+
+
+def test_UnitConvBank_rebuilds_when_functions_change():
+    uc = PolyUnitConv([2.0, 0.0])
+    bank = UnitConvBank([uc, NullUnitConv()])
+    numpy.testing.assert_array_equal(bank.eng_to_phys([1.0, 1.0]), [2.0, 1.0])
+    rigidity = Rigidity(3000)
+    uc._post_eng_to_phys = rigidity.div
+    uc._pre_phys_to_eng = rigidity.mult
+    numpy.testing.assert_array_equal(bank.eng_to_phys([1.0, 1.0]),
+                                     [uc.eng_to_phys(1.0), 1.0])
+    uc._post_eng_to_phys = f1
+    assert bank.eng_to_phys([1.0, 1.0])[0] == uc.eng_to_phys(1.0)
+
+
+def test_UnitConvBank_only_rebuilds_for_its_own_unitconvs():
+    rigidity = Rigidity(3000)
+    bank = UnitConvBank([PolyUnitConv([2.0, 0.0], rigidity.div,
+                                      rigidity.mult)])
+    builds = []
+    bank._build = lambda: builds.append(UnitConvBank._build(bank))
+    other = PolyUnitConv([3.0, 0.0])
+    other._post_eng_to_phys = rigidity.div
+    assert bank.eng_to_phys([1.0])[0] == bank.unitconvs[0].eng_to_phys(1.0)
+    assert builds == []
+    bank.unitconvs[0]._post_eng_to_phys = f1
+    assert bank.eng_to_phys([1.0])[0] == 4.0
+    assert len(builds) == 1
+
+
+def test_UnitConvBank_pchip_extrapolates_like_PchipInterpolator():
+    uc = PchipUnitConv([0, 1.5, 3, 7], [0, 2, 2.5, 9])
+    bank = UnitConvBank([uc] * 6)
+    eng = numpy.array([-2.0, 0.0, 1.5, 3.0, 7.0, 9.5])
+    numpy.testing.assert_array_equal(bank.eng_to_phys(eng), uc.pp(eng))
+
+
+def test_UnitConvBank_follows_rigidity_changes():
+    rigidity = Rigidity(3000)
+    uc = PolyUnitConv([2.5, 0.1], rigidity.div, rigidity.mult)
+    bank = UnitConvBank([uc])
+    rigidity.energy = 1000
+    assert bank.eng_to_phys([4.0])[0] == uc.eng_to_phys(4.0)
+
+
+def test_UnitConvBank_keys_and_invalid_arguments(bank_unitconvs):
+    bank = UnitConvBank(bank_unitconvs, 'abcdefg')
+    indices = bank.get_indices('ga')
+    numpy.testing.assert_array_equal(indices, [6, 0])
+    assert bank.convert([1.0, 2.0], pytac.ENG, pytac.ENG, indices)[1] == 2.0
+    with pytest.raises(pytac.exceptions.UnitsException):
+        bank.convert([1.0, 2.0], pytac.ENG, 'invalid', indices)
+    with pytest.raises(pytac.exceptions.UnitsException):
+        bank.convert([1.0], pytac.ENG, pytac.PHYS, indices)
+
+
+@pytest.fixture
+def conversion_cache():
+    cache = pytac.units.enable_conversion_cache(maxsize=2)
+    yield cache
+    pytac.units.disable_conversion_cache()
+
+
+def test_conversion_cache_hits_and_evicts(conversion_cache):
+    pchip_uc = PchipUnitConv([1, 2, 3], [1, 4, 9])
+    expected = pchip_uc._convert(5.0, pytac.PHYS, pytac.ENG)
+    assert pchip_uc.convert(5.0, pytac.PHYS, pytac.ENG) == expected
+    assert pchip_uc.convert(5.0, pytac.PHYS, pytac.ENG) == expected
+    pchip_uc.convert(2.0, pytac.ENG, pytac.PHYS)
+    pchip_uc.convert(3.0, pytac.ENG, pytac.PHYS)
+    assert pytac.units.get_conversion_cache_info() == {
+        'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+    pchip_uc.convert(5.0, pytac.PHYS, pytac.ENG)
+    assert conversion_cache.misses == 4
+    conversion_cache.clear()
+    assert conversion_cache.get_info()['size'] == 0
+
+
+def test_conversion_cache_invalidated_by_functions_and_energy(
+        conversion_cache):
+    rigidity = Rigidity(3000)
+    poly_uc = PolyUnitConv([2, 0])
+    assert poly_uc.convert(4, pytac.ENG, pytac.PHYS) == 8
+    poly_uc._post_eng_to_phys = rigidity.div
+    assert poly_uc.convert(4, pytac.ENG, pytac.PHYS) == 8 / rigidity.value
+    rigidity.energy = 1000
+    assert poly_uc.convert(4, pytac.ENG, pytac.PHYS) == 8 / rigidity.value
+    assert conversion_cache.hits == 0
+
+
+def test_conversion_cache_skips_unhashable_values(conversion_cache):
+    poly_uc = PolyUnitConv([2, 0])
+    numpy.testing.assert_array_equal(
+        poly_uc.convert(numpy.array([1, 2]), pytac.ENG, pytac.PHYS), [2, 4])
+    assert conversion_cache.get_info()['misses'] == 0
+
+
+def test_conversion_cache_disabled_by_default():
+    assert pytac.units.get_conversion_cache_info() is None